@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark of the postprocessing pipeline. Synthesizes a lecture with ffmpeg's lavfi test sources,
+stores it in chunks like the frontend does and times concatenation, probing and postprocessing.
+Results are printed as JSON.
+"""
+
+import asyncio
+from argparse import ArgumentParser, Namespace
+import json
+import logging
+import os
+from pathlib import Path
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from typing import Any, Awaitable, Callable, Dict, List
+
+from ise_record.cropdetect import video_properties
+from ise_record.encoders import DEFAULT_ENCODER_PROFILE, ENCODER_PROFILES
+from ise_record.ffmpeg import run_command
+from ise_record.options import PostprocessingOptions
+from ise_record.postprocess import concat_chunks, postprocess_recording
+
+# sources and codecs resemble what browsers record: VP8 video with Opus audio in WebM
+_VIDEO_CODEC = [ '-c:v', 'libvpx', '-deadline', 'realtime', '-cpu-used', '8', '-b:v', '1500k' ]
+_AUDIO_CODEC = [ '-c:a', 'libopus', '-b:a', '64k' ]
+_OVERLAY_SIZE = '640x360'
+
+def _lavfi(source: str) -> List[str]:
+    return [ '-f', 'lavfi', '-i', source ]
+
+async def synthesize_track(path: Path, kind: str, duration: float, size: str, seed: int) -> None:
+    """
+        Encodes a synthetic track.
+
+        :param path output file
+        :param kind 'stream' (display with voice), 'overlay' (camera) or 'audio' (microphone)
+        :param duration length in seconds
+        :param size frame size of the display stream, e.g. 1920x1080
+        :param seed varies the test tone so that tracks differ
+    """
+    tone = f'sine=frequency={220 + 110 * seed}:sample_rate=48000'
+
+    if kind == 'stream':
+        inputs = _lavfi(f'testsrc2=size={size}:rate=30') + _lavfi(tone)
+        codecs = _VIDEO_CODEC + _AUDIO_CODEC
+    elif kind == 'overlay':
+        inputs = _lavfi(f'testsrc=size={_OVERLAY_SIZE}:rate=30')
+        codecs = _VIDEO_CODEC
+    else:
+        inputs = _lavfi(tone)
+        codecs = _AUDIO_CODEC
+
+    await run_command([ 'ffmpeg', '-v', 'error' ] + inputs + [ '-t', str(duration) ] + codecs + [
+        '-f', 'webm', '-y', str(path)
+    ])
+
+def split_into_chunks(source_path: Path, track_path: Path, chunks: int, digits: int) -> int:
+    """
+        Cuts a file into chunks of equal size. MediaRecorder's chunks are consecutive pieces of one
+        WebM stream that only make sense together, too.
+
+        :param source_path file to cut
+        :param track_path directory to store the chunks in
+        :param chunks number of chunks
+        :param digits digits of the running number in the chunk file names
+        :returns the size of the track in bytes
+    """
+    data = source_path.read_bytes()
+    chunk_size = -(-len(data) // chunks)
+    os.makedirs(track_path, exist_ok=True)
+
+    for i in range(chunks):
+        chunk_path = track_path / f'chunk.{i:0{digits}d}'
+        chunk_path.write_bytes(data[i * chunk_size:(i + 1) * chunk_size])
+
+    return len(data)
+
+async def synthesize_recording(recording_path: Path, argv: Namespace) -> Dict[str, int]:
+    """
+        Synthesizes the tracks of a recording and stores them in chunks.
+
+        :returns the size of each track in bytes
+    """
+    tracks = [ 'stream' ] + ([ 'overlay' ] if argv.overlay else []) + [
+        f'audio-{i}' for i in range(argv.audio_tracks)
+    ]
+    chunks = max(1, round(argv.duration / argv.chunk_seconds))
+    sizes: Dict[str, int] = {}
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        for seed, track in enumerate(tracks):
+            kind = track.partition('-')[0]
+            source_path = Path(tempdir) / f'{track}.webm'
+
+            await synthesize_track(source_path, kind, argv.duration, argv.resolution, seed)
+            sizes[track] = split_into_chunks(
+                source_path,
+                recording_path / track,
+                chunks,
+                argv.digits
+            )
+
+    return sizes
+
+async def _timed(repeat: int, run: Callable[[], Awaitable[Any]]) -> List[float]:
+    seconds: List[float] = []
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await run()
+        seconds.append(time.perf_counter() - start)
+
+    return seconds
+
+def _summary(stage: str, seconds: List[float], **extra: Any) -> Dict[str, Any]:
+    median = statistics.median(seconds)
+    return { 'stage': stage, 'seconds': seconds, 'median_seconds': median, **extra }
+
+async def _ffmpeg_version() -> str:
+    return (await run_command([ 'ffmpeg', '-version' ])).decode(errors='replace').splitlines()[0]
+
+async def run_benchmark(recording_path: Path, argv: Namespace) -> Dict[str, Any]:
+    """ Runs all stages and collects their timings """
+    sizes = await synthesize_recording(recording_path, argv)
+    results: List[Dict[str, Any]] = []
+    mb = 1024 * 1024
+
+    for track, size in sizes.items():
+        track_path = recording_path / track
+
+        async def concat(track_path: Path = track_path) -> None:
+            (await concat_chunks(track_path)).unlink()
+
+        seconds = await _timed(argv.repeat, concat)
+        results.append(_summary(
+            'concat', seconds,
+            track=track, bytes=size, mb_per_s=size / mb / statistics.median(seconds)
+        ))
+
+    stream_path = await concat_chunks(recording_path / 'stream')
+
+    seconds = await _timed(argv.repeat, lambda: video_properties(
+        stream_path,
+        argv.crop_detect_samples,
+        argv.crop_detect_frames
+    ))
+    results.append(_summary(
+        'probe', seconds,
+        realtime_factor=argv.duration / statistics.median(seconds)
+    ))
+
+    stream_path.unlink()
+
+    options = PostprocessingOptions(
+        crop_detect_samples=argv.crop_detect_samples,
+        crop_detect_frames=argv.crop_detect_frames,
+        use_render_cache=False,
+        pipe_chunks=argv.pipe_chunks,
+        encoder=ENCODER_PROFILES[argv.encoder_profile],
+        encoder_threads=argv.encoder_threads,
+        render_segments=argv.render_segments
+    )
+
+    async def postprocess() -> None:
+        result = await postprocess_recording(recording_path, options=options)
+
+        if result.output_file is None:
+            raise RuntimeError(f"Postprocessing failed: {result.reason.name}")
+
+    seconds = await _timed(argv.repeat, postprocess)
+    total_size = sum(sizes.values())
+    results.append(_summary(
+        'postprocess', seconds,
+        bytes=total_size,
+        mb_per_s=total_size / mb / statistics.median(seconds),
+        realtime_factor=argv.duration / statistics.median(seconds)
+    ))
+
+    return {
+        'benchmark': 'pipeline',
+        'system': {
+            'platform': platform.platform(),
+            'python': platform.python_version(),
+            'cpu_count': os.cpu_count(),
+            'ffmpeg': await _ffmpeg_version()
+        },
+        'config': {
+            'duration': argv.duration,
+            'resolution': argv.resolution,
+            'overlay': argv.overlay,
+            'audio_tracks': argv.audio_tracks,
+            'chunk_seconds': argv.chunk_seconds,
+            'encoder_profile': argv.encoder_profile,
+            'encoder_threads': argv.encoder_threads,
+            'render_segments': argv.render_segments,
+            'pipe_chunks': argv.pipe_chunks,
+            'repeat': argv.repeat
+        },
+        'results': results
+    }
+
+async def main():
+    """
+    Main function. Parses command line, runs the benchmark and prints the results.
+    """
+
+    parser = ArgumentParser(
+        prog="ise-benchmark-pipeline",
+        description="Time the postprocessing pipeline on a synthesized recording"
+    )
+    parser.add_argument('-l', '--log-level', default="WARNING")
+    parser.add_argument(
+        '--duration', type=float, default=300.0,
+        help="length of the lecture in seconds (default: 300)"
+    )
+    parser.add_argument(
+        '--resolution', default='1920x1080',
+        help="frame size of the display stream (default: 1920x1080)"
+    )
+    parser.add_argument(
+        '--no-overlay', dest='overlay', action='store_false',
+        help="leave out the camera track"
+    )
+    parser.add_argument(
+        '--audio-tracks', type=int, default=0,
+        help="number of additional audio tracks (default: 0)"
+    )
+    parser.add_argument(
+        '--chunk-seconds', type=float, default=5.0,
+        help="duration of a chunk (default: 5)"
+    )
+    parser.add_argument(
+        '--digits', type=int, default=4,
+        help="digits of the running number in chunk file names (default: 4)"
+    )
+    parser.add_argument(
+        '--repeat', type=int, default=1,
+        help="number of timed runs of every stage (default: 1)"
+    )
+    parser.add_argument('--crop-detect-samples', type=int, default=0)
+    parser.add_argument('--crop-detect-frames', type=int, default=10)
+    parser.add_argument('--pipe-chunks', action='store_true')
+    parser.add_argument(
+        '--encoder-profile', choices=sorted(ENCODER_PROFILES), default=DEFAULT_ENCODER_PROFILE
+    )
+    parser.add_argument('--encoder-threads', type=int, default=0)
+    parser.add_argument('--render-segments', type=int, default=1)
+    parser.add_argument(
+        '--workdir', type=Path,
+        help="directory to synthesize the recording in (default: system temporary directory)"
+    )
+    parser.add_argument(
+        '-o', '--output', type=Path,
+        help="file to write the results to (default: standard output)"
+    )
+    argv = parser.parse_args()
+
+    logging.basicConfig(level=argv.log_level)
+
+    workdir = Path(tempfile.mkdtemp(dir=argv.workdir))
+
+    try:
+        report = await run_benchmark(workdir / 'benchmark', argv)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if argv.output is not None:
+        argv.output.write_text(json.dumps(report, indent=2), encoding='utf-8')
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+if __name__ == "__main__":
+    asyncio.run(main())
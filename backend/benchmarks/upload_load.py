@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+
+"""
+Load benchmark of the chunk upload endpoint. Simulates many recordings that upload a chunk per
+track at the pace of the frontend and reports throughput and latency percentiles as JSON.
+"""
+
+import asyncio
+from asyncio.subprocess import Process
+from argparse import ArgumentParser, Namespace
+import json
+import os
+from pathlib import Path
+import platform
+import shutil
+import socket
+import statistics
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, NamedTuple
+
+import httpx
+
+# upper bounds of the latency histogram buckets in milliseconds
+_HISTOGRAM_BUCKETS = [ 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000 ]
+
+class Upload(NamedTuple):
+    """ Outcome of a single chunk upload """
+    seconds: float
+    size: int
+    status: int
+
+def track_names(tracks: int) -> List[str]:
+    """ Track names of a recording like the frontend's: main stream, camera, extra microphones """
+    return [ 'stream', 'overlay', *(f'audio-{i}' for i in range(tracks - 2)) ][:tracks]
+
+def chunk_size(track: str, argv: Namespace) -> int:
+    """ Size of a chunk of a track in bytes, derived from typical bitrates """
+    if track == 'stream':
+        kbps = argv.video_kbps + argv.audio_kbps
+    elif track == 'overlay':
+        kbps = argv.video_kbps // 2
+    else:
+        kbps = argv.audio_kbps
+
+    return int(kbps * 1000 / 8 * argv.chunk_seconds)
+
+def percentile(values: List[float], percent: float) -> float:
+    """ Nearest-rank percentile of a non-empty list """
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * percent // 100))
+    return ordered[int(rank) - 1]
+
+def histogram(latencies_ms: List[float]) -> Dict[str, int]:
+    """ Cumulative counts of latencies up to each bucket bound, like Prometheus histograms """
+    buckets = {
+        str(bound): sum(1 for latency in latencies_ms if latency <= bound)
+        for bound in _HISTOGRAM_BUCKETS
+    }
+    buckets['+Inf'] = len(latencies_ms)
+    return buckets
+
+async def simulate_recording(
+        client: httpx.AsyncClient,
+        name: str,
+        payloads: Dict[str, bytes],
+        argv: Namespace,
+        uploads: List[Upload]
+) -> None:
+    """ Uploads the chunks of one recording, all tracks at once, one round per chunk interval """
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+
+    async def upload(track: str, index: int) -> None:
+        payload = payloads[track]
+        began = time.perf_counter()
+
+        try:
+            if argv.upload_mode == 'raw':
+                response = await client.put(
+                    f'/api/recordings/{name}/{track}/{index}',
+                    headers={ 'Content-Type': 'application/octet-stream' },
+                    content=payload
+                )
+            else:
+                response = await client.post(
+                    '/api/chunks',
+                    data={ 'recording': name, 'track': track, 'index': str(index) },
+                    files={ 'chunk': (f'chunk.{index}', payload, 'video/webm') }
+                )
+            status = response.status_code
+        except httpx.HTTPError:
+            status = 0
+
+        seconds = time.perf_counter() - began
+        uploads.append(Upload(seconds=seconds, size=len(payload), status=status))
+
+    async def upload_batch(index: int) -> None:
+        began = time.perf_counter()
+
+        try:
+            response = await client.post(
+                '/api/chunks/batch',
+                data={
+                    'recording': name,
+                    'track': list(payloads),
+                    'index': [ str(index) ] * len(payloads)
+                },
+                files=[
+                    ('chunk', (f'chunk.{index}', payload, 'video/webm'))
+                    for payload in payloads.values()
+                ]
+            )
+            status = response.status_code
+        except httpx.HTTPError:
+            status = 0
+
+        seconds = time.perf_counter() - began
+        size = sum(len(payload) for payload in payloads.values())
+        uploads.append(Upload(seconds=seconds, size=size, status=status))
+
+    for index in range(argv.chunks):
+        if argv.upload_mode == 'batch':
+            await upload_batch(index)
+        else:
+            await asyncio.gather(*(upload(track, index) for track in payloads))
+
+        # keep the pace of a live recording, shortened by the speedup factor
+        next_round = start + (index + 1) * argv.chunk_seconds / argv.speedup
+        await asyncio.sleep(max(0.0, next_round - loop.time()))
+
+async def _wait_until_healthy(client: httpx.AsyncClient, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+
+    while True:
+        try:
+            if (await client.get('/api/health')).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+
+        if time.monotonic() > deadline:
+            raise RuntimeError("Server did not come up")
+
+        await asyncio.sleep(0.1)
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+async def _start_server(destdir: Path, port: int, argv: Namespace) -> Process:
+    # a separate process, so the load generator doesn't compete with the server for its event loop
+    env = dict(os.environ, ISE_RECORD_DESTDIR=str(destdir))
+
+    return await asyncio.create_subprocess_exec(
+        sys.executable, '-m', 'uvicorn',
+        '--host', '127.0.0.1',
+        '--port', str(port),
+        '--workers', str(argv.server_workers),
+        '--log-level', 'warning',
+        '--no-access-log',
+        'ise_record.server:app',
+        env=env
+    )
+
+async def run_benchmark(base_url: str, argv: Namespace) -> Dict[str, Any]:
+    """ Runs the simulated recordings against a server and summarizes the uploads """
+    tracks = track_names(argv.tracks)
+    payloads = { track: os.urandom(chunk_size(track, argv)) for track in tracks }
+    uploads: List[Upload] = []
+    run_id = time.strftime('%Y%m%dT%H%M%S')
+
+    limits = httpx.Limits(max_connections=argv.recordings * len(tracks))
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60.0) as client:
+        await _wait_until_healthy(client)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(
+            simulate_recording(client, f'LOAD_{run_id}_{i:04d}', payloads, argv, uploads)
+            for i in range(argv.recordings)
+        ))
+        elapsed = time.perf_counter() - start
+
+    succeeded = [ u for u in uploads if 200 <= u.status < 300 ]
+    latencies_ms = [ u.seconds * 1000 for u in succeeded ]
+    uploaded = sum(u.size for u in succeeded)
+
+    return {
+        'benchmark': 'upload_load',
+        'system': {
+            'platform': platform.platform(),
+            'python': platform.python_version(),
+            'cpu_count': os.cpu_count()
+        },
+        'config': {
+            'recordings': argv.recordings,
+            'tracks': tracks,
+            'chunks': argv.chunks,
+            'chunk_seconds': argv.chunk_seconds,
+            'speedup': argv.speedup,
+            'upload_mode': argv.upload_mode,
+            'chunk_bytes': { track: len(payload) for track, payload in payloads.items() },
+            'server_workers': argv.server_workers if argv.url is None else None
+        },
+        'results': {
+            'requests': len(uploads),
+            'errors': len(uploads) - len(succeeded),
+            'seconds': elapsed,
+            'requests_per_s': len(uploads) / elapsed,
+            'mb_per_s': uploaded / 1024 / 1024 / elapsed,
+            'latency_ms': {
+                'p50': percentile(latencies_ms, 50),
+                'p95': percentile(latencies_ms, 95),
+                'p99': percentile(latencies_ms, 99),
+                'max': max(latencies_ms),
+                'mean': statistics.fmean(latencies_ms)
+            } if latencies_ms else None,
+            'latency_histogram_ms': histogram(latencies_ms)
+        }
+    }
+
+async def main():
+    """
+    Main function. Parses command line, starts a server unless given one, runs the load and
+    prints the results.
+    """
+
+    parser = ArgumentParser(
+        prog="ise-benchmark-upload",
+        description="Measure throughput and latency of chunk uploads under concurrent recordings"
+    )
+    parser.add_argument(
+        '--recordings', type=int, default=100,
+        help="number of concurrent recordings (default: 100)"
+    )
+    parser.add_argument(
+        '--tracks', type=int, default=2,
+        help="tracks per recording: stream, overlay, then audio tracks (default: 2)"
+    )
+    parser.add_argument(
+        '--chunks', type=int, default=12,
+        help="chunks per track (default: 12, i.e. a minute of recording)"
+    )
+    parser.add_argument(
+        '--chunk-seconds', type=float, default=5.0,
+        help="duration of a chunk (default: 5)"
+    )
+    parser.add_argument(
+        '--speedup', type=float, default=1.0,
+        help="upload this many times faster than a live recording (default: 1, i.e. realtime)"
+    )
+    parser.add_argument(
+        '--upload-mode', choices=[ 'multipart', 'raw', 'batch' ], default='multipart',
+        help=(
+            "POST a multipart form per chunk to /api/chunks, PUT raw bodies, or POST all tracks' "
+            "chunks of a round to /api/chunks/batch (default: multipart)"
+        )
+    )
+    parser.add_argument(
+        '--video-kbps', type=int, default=2500,
+        help="bitrate of the display stream, the camera gets half (default: 2500)"
+    )
+    parser.add_argument(
+        '--audio-kbps', type=int, default=128,
+        help="bitrate of audio (default: 128)"
+    )
+    parser.add_argument(
+        '--url',
+        help="base URL of a running server (default: start one with a temporary data directory)"
+    )
+    parser.add_argument(
+        '--server-workers', type=int, default=1,
+        help="number of uvicorn worker processes of the started server (default: 1)"
+    )
+    parser.add_argument(
+        '-o', '--output', type=Path,
+        help="file to write the results to (default: standard output)"
+    )
+    argv = parser.parse_args()
+
+    if argv.url is not None:
+        report = await run_benchmark(argv.url, argv)
+    else:
+        destdir = Path(tempfile.mkdtemp())
+        port = _free_port()
+        server = await _start_server(destdir, port, argv)
+
+        try:
+            report = await run_benchmark(f'http://127.0.0.1:{port}', argv)
+        finally:
+            server.terminate()
+            await server.wait()
+            shutil.rmtree(destdir, ignore_errors=True)
+
+    output = json.dumps(report, indent=2)
+
+    if argv.output is not None:
+        argv.output.write_text(output, encoding='utf-8')
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    asyncio.run(main())
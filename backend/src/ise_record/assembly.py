@@ -0,0 +1,228 @@
+"""
+    ISE-Recorder track assembly module. Appends uploaded chunks to a growing track file while
+    the recording is still running, so that postprocessing can start from an already assembled
+    file instead of concatenating all chunks after the lecture has ended.
+"""
+
+import asyncio
+import errno
+import json
+import logging
+import os
+from pathlib import Path
+from typing import NamedTuple
+from weakref import WeakValueDictionary
+
+from .fileutil import write_atomically
+
+logger = logging.getLogger(__name__)
+
+ASSEMBLED_FILENAME = 'full.webm'
+ASSEMBLY_STATE_FILENAME = 'full.webm.state'
+
+_COPY_BLOCK_SIZE = 512 * 1024
+
+# errors that mean "this kind of kernel-side copy doesn't work for these files", as opposed to
+# actual I/O errors
+_KERNEL_COPY_UNSUPPORTED = {
+    errno.ENOSYS, errno.EXDEV, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP
+}
+
+_track_locks: WeakValueDictionary[Path, asyncio.Lock] = WeakValueDictionary()
+
+class AssemblyState(NamedTuple):
+    """ Progress of the incremental assembly of a track """
+    next_index: int
+    size: int
+
+def _kernel_copy(src_fd: int, dest_fd: int, count: int) -> int:
+    copy_functions = []
+
+    # copy_file_range shares extents on file systems that support reflinks (btrfs, XFS) and
+    # copies in the kernel elsewhere; sendfile covers older kernels and pipes as destination
+    if hasattr(os, 'copy_file_range'):
+        copy_functions.append(lambda n: os.copy_file_range(src_fd, dest_fd, n))
+    if hasattr(os, 'sendfile'):
+        copy_functions.append(lambda n: os.sendfile(dest_fd, src_fd, None, n))
+
+    copied = 0
+
+    for copy in copy_functions:
+        try:
+            while copied < count and (n := copy(count - copied)) > 0:
+                copied += n
+            break
+        except OSError as ex:
+            if ex.errno not in _KERNEL_COPY_UNSUPPORTED:
+                raise
+
+    return copied
+
+def append_file(dest_fd: int, src_path: Path) -> int:
+    """
+        Copies a file to the current position of an open file descriptor. The data is copied
+        inside the kernel if possible and through a buffer otherwise. This blocks, so call it
+        from a worker thread.
+
+        :param dest_fd file descriptor to write to, must not be opened with O_APPEND
+        :param src_path file to copy
+        :returns number of bytes copied
+    """
+    src_fd = os.open(src_path, os.O_RDONLY)
+
+    try:
+        copied = _kernel_copy(src_fd, dest_fd, os.fstat(src_fd).st_size)
+
+        # remainder, or everything if kernel copies aren't available. The offsets of both
+        # descriptors have moved past whatever was copied already.
+        while content := os.read(src_fd, _COPY_BLOCK_SIZE):
+            view = memoryview(content)
+            while view:
+                view = view[os.write(dest_fd, view):]
+            copied += len(content)
+
+        return copied
+    finally:
+        os.close(src_fd)
+
+def chunk_index(path: Path) -> int | None:
+    """
+        Extracts the running number from a chunk file name.
+
+        :param path path of a file in a track directory
+        :returns the chunk index, or None if the file is not a chunk file
+    """
+    prefix, _, suffix = path.name.partition('.')
+
+    if prefix != 'chunk' or not suffix.isdigit():
+        return None
+
+    return int(suffix)
+
+def _track_lock(track_path: Path) -> asyncio.Lock:
+    lock = _track_locks.get(track_path)
+
+    if lock is None:
+        lock = asyncio.Lock()
+        _track_locks[track_path] = lock
+
+    return lock
+
+def read_assembly_state(track_path: Path) -> AssemblyState:
+    """
+        Reads the persisted assembly progress of a track.
+
+        :param track_path directory that contains the chunks of the track
+        :returns assembly progress, or an empty state if nothing has been assembled yet
+    """
+    try:
+        with open(track_path / ASSEMBLY_STATE_FILENAME, encoding='utf-8') as state_file:
+            raw = json.load(state_file)
+        return AssemblyState(next_index=int(raw['next_index']), size=int(raw['size']))
+    except (OSError, ValueError, KeyError, TypeError):
+        return AssemblyState(next_index=0, size=0)
+
+def _write_assembly_state(track_path: Path, state: AssemblyState) -> None:
+    write_atomically(track_path / ASSEMBLY_STATE_FILENAME, json.dumps(state._asdict()))
+
+def discard_assembly_state(track_path: Path) -> None:
+    """
+        Forgets the assembly progress of a track, e.g. because the assembled file is about to be
+        rewritten by other means.
+
+        :param track_path directory that contains the chunks of the track
+    """
+    (track_path / ASSEMBLY_STATE_FILENAME).unlink(missing_ok=True)
+
+async def append_ready_chunks(track_path: Path, chunk_file_digits: int) -> AssemblyState:
+    """
+        Appends all chunks that directly follow the already assembled part of a track to the
+        assembled file. Chunks that arrive out of order stay on disk until the gap before them
+        is filled by a later upload.
+
+        :param track_path directory that contains the chunks of the track
+        :param chunk_file_digits number of digits in chunk file names
+        :returns the assembly progress after appending
+    """
+    target_path = track_path / ASSEMBLED_FILENAME
+
+    async with _track_lock(track_path):
+        state = read_assembly_state(track_path)
+
+        try:
+            assembled_size = os.path.getsize(target_path)
+        except FileNotFoundError:
+            assembled_size = None
+
+        if assembled_size is None or assembled_size < state.size:
+            # assembled file was removed (e.g. after postprocessing) or damaged: start over
+            state = AssemblyState(next_index=0, size=0)
+
+        next_chunk = track_path / f'chunk.{state.next_index:0{chunk_file_digits}d}'
+
+        if not next_chunk.is_file():
+            return state
+
+        if state.size > 0:
+            # a crash while appending may have left part of a chunk behind. The state only
+            # records completed appends, so cut back to that.
+            os.truncate(target_path, state.size)
+
+        truncate = os.O_TRUNC if state.size == 0 else 0
+        dest_fd = os.open(target_path, os.O_WRONLY | os.O_CREAT | truncate)
+
+        try:
+            os.lseek(dest_fd, state.size, os.SEEK_SET)
+
+            while next_chunk.is_file():
+                chunk_size = await asyncio.to_thread(append_file, dest_fd, next_chunk)
+
+                state = AssemblyState(next_index=state.next_index + 1, size=state.size + chunk_size)
+                _write_assembly_state(track_path, state)
+
+                next_chunk = track_path / f'chunk.{state.next_index:0{chunk_file_digits}d}'
+        finally:
+            os.close(dest_fd)
+
+        logger.debug("%s assembled up to chunk %d", track_path, state.next_index - 1)
+
+        return state
+
+def assembled_chunks(track_path: Path) -> int:
+    """
+        Counts the chunks in the incrementally assembled file of a track, trusting the persisted
+        progress only as long as the file is there and has the size recorded with it.
+
+        :param track_path directory that contains the chunks of the track
+        :returns number of chunks in the assembled file, 0 if there is no intact one
+    """
+    state = read_assembly_state(track_path)
+
+    try:
+        if os.path.getsize(track_path / ASSEMBLED_FILENAME) != state.size:
+            return 0
+    except FileNotFoundError:
+        return 0
+
+    return state.next_index
+
+def assembled_track(track_path: Path) -> Path | None:
+    """
+        Looks for an incrementally assembled file that contains all chunks of a track.
+
+        :param track_path directory that contains the chunks of the track
+        :returns path of the assembled file if it is complete and intact, None otherwise
+    """
+    next_index = assembled_chunks(track_path)
+
+    if next_index == 0:
+        return None
+
+    # chunks behind a gap were never appended, so the assembled file is incomplete
+    if any(
+        (ix := chunk_index(p)) is not None and ix >= next_index
+        for p in track_path.glob('chunk.*')
+    ):
+        return None
+
+    return track_path / ASSEMBLED_FILENAME
@@ -0,0 +1,398 @@
+"""
+    ISE-Recorder crop detection. Finds the part of the main display stream that holds the actual
+    content, either by analyzing the track before rendering or incrementally while its chunks are
+    being uploaded.
+"""
+
+import asyncio
+import json
+import logging
+from pathlib import Path
+from typing import NamedTuple
+
+from .assembly import ASSEMBLED_FILENAME, chunk_index
+from .ffmpeg import run_command
+from .fileutil import write_atomically
+from .metrics import PROBE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+class Rectangle(NamedTuple):
+    """ rectangular area in a video stream, used for cropping """
+    width: int
+    height: int
+    left: int
+    top: int
+
+class VideoProperties(NamedTuple):
+    """ Properties of a video stream that we need for postprocessing """
+    width: int
+    height: int
+    crop: Rectangle
+    duration: float | None = None
+
+    def needs_cropping(self) -> bool:
+        """
+        determines if this video stream needs to be cropped.
+        """
+        return self.width > self.crop.width or self.height > self.crop.height
+
+def determine_crop_area(
+        stream_width: int,
+        stream_height: int,
+        raw_crop: Rectangle
+) -> Rectangle:
+    """ 
+        Determine the effective cropping area for a stream. Will select the full
+        stream rectangle if an insignificant area would be cropped.
+
+        :param stream_width width of the input stream
+        :param stream_height height of the input stream
+        :param raw_crop cropping area as detected by ffmpeg
+        :returns the effective cropping area
+    """
+
+    slack_width = stream_width - raw_crop.width
+    slack_height = stream_height - raw_crop.height
+
+    # less than one percent cropped on each side -> avoid cropping
+    if slack_width * 100 <= stream_width and slack_height * 100 <= stream_height:
+        return Rectangle(width=stream_width, height=stream_height, left=0, top=0)
+
+    return raw_crop
+
+# upper limit for the number of crop detection samples that are analyzed at the same time
+MAX_CONCURRENT_SAMPLES = 4
+
+_CROPDETECT_ENTRIES = (
+    'packet=pts_time:'
+    'packet_tags=lavfi.cropdetect.x1,lavfi.cropdetect.y1,'
+                'lavfi.cropdetect.x2,lavfi.cropdetect.y2'
+)
+
+class CropdetectAggregator:
+    """
+        Consumes ffprobe's compact output line by line while ffprobe is still running and keeps
+        only what we need from it: the geometry of the video stream, the latest timestamp, and
+        the running bounding box of all detected crop areas. Memory use does not depend on the
+        number of frames.
+    """
+
+    def __init__(self):
+        self.width: int | None = None
+        self.height: int | None = None
+        self.duration: float | None = None
+
+        self._left: int | None = None
+        self._top: int | None = None
+        self._right: int | None = None
+        self._bottom: int | None = None
+
+    @staticmethod
+    def _min(current: int | None, value: int) -> int:
+        return value if current is None else min(current, value)
+
+    @staticmethod
+    def _max(current: int | None, value: int) -> int:
+        return value if current is None else max(current, value)
+
+    def __call__(self, line: bytes) -> None:
+        section, *fields = line.decode(errors='replace').rstrip('\r\n').split('|')
+
+        # nested sections are flattened with a prefix, e.g. tag:lavfi.cropdetect.x1=42
+        values = {
+            key.rsplit(':', 1)[-1]: value
+            for key, _, value in (field.partition('=') for field in fields)
+        }
+
+        try:
+            if section == 'stream':
+                # frontend can only generate files with one video stream
+                if self.width is None and values.get('codec_type', 'video') == 'video':
+                    self.width = int(values['width'])
+                    self.height = int(values['height'])
+            elif section == 'packet':
+                if 'pts_time' in values and values['pts_time'] != 'N/A':
+                    pts_time = float(values['pts_time'])
+                    self.duration = (
+                        pts_time if self.duration is None else max(self.duration, pts_time)
+                    )
+
+                if 'lavfi.cropdetect.x1' in values:
+                    self._left = self._min(self._left, int(values['lavfi.cropdetect.x1']))
+                    self._top = self._min(self._top, int(values['lavfi.cropdetect.y1']))
+                    self._right = self._max(self._right, int(values['lavfi.cropdetect.x2']))
+                    self._bottom = self._max(self._bottom, int(values['lavfi.cropdetect.y2']))
+        except (KeyError, ValueError):
+            logger.warning("Unexpected ffprobe output: %s", line)
+
+    @property
+    def detected(self) -> bool:
+        """ whether any crop area has been seen so far """
+        return self._left is not None
+
+    def raw_crop_area(self, width: int, height: int) -> Rectangle:
+        """
+            Bounding box of all crop areas seen so far.
+
+            :param width width of the stream, used if no crop area was detected
+            :param height height of the stream, used if no crop area was detected
+            :returns bounding box of the detected crop areas
+        """
+        crop_left = self._left if self._left is not None else 0
+        crop_top = self._top if self._top is not None else 0
+        crop_right = self._right if self._right is not None else width
+        crop_bottom = self._bottom if self._bottom is not None else height
+
+        return Rectangle(
+            width = crop_right - crop_left + 1,
+            height = crop_bottom - crop_top + 1,
+            left = crop_left,
+            top = crop_top
+        )
+
+async def _full_cropdetect(path: Path, aggregator: CropdetectAggregator) -> None:
+    probe_command = [
+        'ffprobe',
+        '-print_format', 'compact',
+        '-f', 'lavfi',
+        '-i', f'movie={str(path)},cropdetect',
+        '-show_entries', f'stream=codec_type,width,height:{_CROPDETECT_ENTRIES}'
+    ]
+
+    logger.debug("Probe command = %s", probe_command)
+
+    await run_command(probe_command, aggregator)
+
+async def _stream_geometry(path: Path, aggregator: CropdetectAggregator) -> None:
+    # only demuxes the file, which is cheap compared to decoding it
+    probe_command = [
+        'ffprobe',
+        '-print_format', 'compact',
+        '-select_streams', 'v:0',
+        '-show_entries', 'stream=codec_type,width,height:packet=pts_time',
+        str(path)
+    ]
+
+    logger.debug("Probe command = %s", probe_command)
+
+    await run_command(probe_command, aggregator)
+
+async def sampled_cropdetect(
+        path: Path,
+        timestamp: float,
+        frames: int,
+        aggregator: CropdetectAggregator
+) -> None:
+    """
+        Runs crop detection on a few frames at one point in time of a video file.
+
+        :param path input video file
+        :param timestamp where to look, in seconds from the start
+        :param frames number of frames to analyze. cropdetect skips the first two.
+        :param aggregator receives stream geometry and detected crop areas
+    """
+    probe_command = [
+        'ffprobe',
+        '-print_format', 'compact',
+        '-f', 'lavfi',
+        '-i', f'movie={str(path)}:seek_point={timestamp:.3f},cropdetect',
+        '-read_intervals', f'%+#{frames}',
+        '-show_entries', f'stream=codec_type,width,height:{_CROPDETECT_ENTRIES}'
+    ]
+
+    logger.debug("Probe command = %s", probe_command)
+
+    await run_command(probe_command, aggregator)
+
+async def video_properties(
+        path: Path,
+        crop_detect_samples: int = 0,
+        crop_detect_frames: int = 10
+) -> VideoProperties:
+    """
+        Extract the information required for postprocess_picture_in_picture from a video file
+
+        The most involved bit here is the crop detection that figures out what the slide stream
+        can be sensibly cropped to. We use ffmpeg's avfilter plugin for that, which gives us a
+        list of sensible crop dimensions for successive time slices in the video file. We just
+        use the most expansive of these to be on the safe side. We really expect them all to be
+        the same anyway.
+
+        Because of that, it is usually good enough to look at a few evenly spaced samples
+        instead of decoding the whole file, which takes a long time for long lectures.
+
+        :params path input video file
+        :params crop_detect_samples number of points in time to run crop detection at, or 0 to
+                                    analyze every frame
+        :params crop_detect_frames number of frames to analyze per sample. cropdetect skips the
+                                   first two.
+        :returns properties of the input file
+    """
+
+    logger.info("Analyzing %s...", path)
+
+    aggregator = CropdetectAggregator()
+
+    with PROBE_SECONDS.time():
+        if crop_detect_samples <= 0:
+            await _full_cropdetect(path, aggregator)
+        else:
+            await _stream_geometry(path, aggregator)
+
+            # the sampling probes must not clobber the duration of the full stream
+            duration = aggregator.duration
+
+            timestamps = [
+                (duration or 0.0) * (i + 0.5) / crop_detect_samples
+                for i in range(crop_detect_samples)
+            ]
+
+            # every sample is an ffprobe process of its own, don't start all of them at once
+            semaphore = asyncio.Semaphore(MAX_CONCURRENT_SAMPLES)
+
+            async def sample(timestamp: float) -> None:
+                async with semaphore:
+                    await sampled_cropdetect(path, timestamp, crop_detect_frames, aggregator)
+
+            await asyncio.gather(*(sample(t) for t in timestamps))
+
+            aggregator.duration = duration
+
+    if aggregator.width is None or aggregator.height is None:
+        raise ValueError(f'{path} has no video stream')
+
+    width, height = aggregator.width, aggregator.height
+    duration = aggregator.duration
+    raw_crop = aggregator.raw_crop_area(width, height)
+
+    logger.debug('%s: size=%dx%d, crop=%d,%d-%d,%d',
+                 path, width, height, raw_crop.left, raw_crop.top,
+                 raw_crop.left + raw_crop.width - 1, raw_crop.top + raw_crop.height - 1)
+
+    crop = determine_crop_area(
+        stream_width = width,
+        stream_height = height,
+        raw_crop = raw_crop
+    )
+
+    return VideoProperties(
+        width = width,
+        height = height,
+        crop = crop,
+        duration = duration
+    )
+
+CROP_CACHE_FILENAME = 'crop.json'
+
+class CropCache(NamedTuple):
+    """ Crop detection results gathered while a track was being uploaded """
+    width: int
+    height: int
+    crop: Rectangle
+    analyzed_chunks: int
+    chunk_seconds: float
+
+def read_crop_cache(track_path: Path) -> CropCache | None:
+    """
+        Reads the crop detection results gathered during upload.
+
+        :param track_path directory that contains the chunks of the track
+        :returns the cached results, or None if there are none
+    """
+    try:
+        with open(track_path / CROP_CACHE_FILENAME, encoding='utf-8') as cache_file:
+            raw = json.load(cache_file)
+
+        return CropCache(
+            width=int(raw['width']),
+            height=int(raw['height']),
+            crop=Rectangle(*(int(v) for v in raw['crop'])),
+            analyzed_chunks=int(raw['analyzed_chunks']),
+            chunk_seconds=float(raw['chunk_seconds'])
+        )
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+def _write_crop_cache(track_path: Path, cache: CropCache) -> None:
+    write_atomically(track_path / CROP_CACHE_FILENAME, json.dumps(cache._asdict()))
+
+def _bounding_box(a: Rectangle, b: Rectangle) -> Rectangle:
+    left = min(a.left, b.left)
+    top = min(a.top, b.top)
+    right = max(a.left + a.width, b.left + b.width)
+    bottom = max(a.top + a.height, b.top + b.height)
+
+    return Rectangle(width=right - left, height=bottom - top, left=left, top=top)
+
+async def update_crop_cache(
+        track_path: Path,
+        assembled_chunks: int,
+        chunk_seconds: float,
+        frames: int
+) -> CropCache | None:
+    """
+        Runs crop detection on the part of an incrementally assembled track that hasn't been
+        analyzed yet and merges the result into the track's crop cache. Samples a few frames in
+        the middle of the new part rather than all of it; the slide area rarely changes.
+
+        :param track_path directory that contains the chunks of the track
+        :param assembled_chunks number of chunks in the assembled file
+        :param chunk_seconds approximate duration of a chunk, used to find the new part
+        :param frames number of frames to analyze
+        :returns the updated cache
+    """
+    cache = read_crop_cache(track_path)
+    analyzed_chunks = cache.analyzed_chunks if cache is not None else 0
+
+    if assembled_chunks <= analyzed_chunks:
+        return cache
+
+    timestamp = (analyzed_chunks + assembled_chunks) / 2 * chunk_seconds
+    aggregator = CropdetectAggregator()
+
+    logger.debug("Detecting crop area of %s at %.1fs", track_path, timestamp)
+    await sampled_cropdetect(track_path / ASSEMBLED_FILENAME, timestamp, frames, aggregator)
+
+    if aggregator.width is None or aggregator.height is None or not aggregator.detected:
+        logger.debug("No crop area detected in %s at %.1fs", track_path, timestamp)
+        return cache
+
+    crop = aggregator.raw_crop_area(aggregator.width, aggregator.height)
+
+    if cache is not None:
+        crop = _bounding_box(cache.crop, crop)
+
+    cache = CropCache(
+        width=aggregator.width,
+        height=aggregator.height,
+        crop=crop,
+        analyzed_chunks=assembled_chunks,
+        chunk_seconds=chunk_seconds
+    )
+    _write_crop_cache(track_path, cache)
+
+    return cache
+
+def cached_video_properties(track_path: Path) -> VideoProperties | None:
+    """
+        Derives the video properties of a track from the crop detection results gathered during
+        upload, so that the track need not be analyzed again.
+
+        :param track_path directory that contains the chunks of the track
+        :returns the video properties, or None if there are no cached results
+    """
+    cache = read_crop_cache(track_path)
+
+    if cache is None:
+        return None
+
+    # we only know the duration from the chunks' nominal length
+    chunks = sum(1 for p in track_path.glob('chunk.*') if chunk_index(p) is not None)
+
+    return VideoProperties(
+        width=cache.width,
+        height=cache.height,
+        crop=determine_crop_area(cache.width, cache.height, cache.crop),
+        duration=max(chunks, cache.analyzed_chunks) * cache.chunk_seconds
+    )
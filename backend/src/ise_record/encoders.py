@@ -0,0 +1,97 @@
+"""
+    ISE-Recorder encoder profiles. Named sets of ffmpeg codec options for the rendered
+    presentation, so that encode speed can be traded against file size per job instead of
+    leaving the choice to ffmpeg's defaults.
+"""
+
+from typing import Dict, List, NamedTuple, Tuple
+
+class EncoderProfile(NamedTuple):
+    """ Output container, codec and muxer options for rendering """
+
+    container: str
+    video: List[str]
+    audio: List[str]
+    # options of the output file rather than its streams, e.g. for the container format
+    muxer: Tuple[str, ...] = ()
+
+_OPUS = [ '-c:a', 'libopus', '-b:a', '96k' ]
+
+ENCODER_PROFILES: Dict[str, EncoderProfile] = {
+    # libvpx only uses more than one core with row-based multithreading and tiles; four tile
+    # columns suit 1080p output
+    'vp9': EncoderProfile(
+        container='webm',
+        video=[
+            '-c:v', 'libvpx-vp9',
+            '-deadline', 'good', '-cpu-used', '4',
+            '-row-mt', '1', '-tile-columns', '2', '-frame-parallel', '0',
+            '-crf', '32', '-b:v', '0'
+        ],
+        audio=_OPUS
+    ),
+    'vp9-fast': EncoderProfile(
+        container='webm',
+        video=[
+            '-c:v', 'libvpx-vp9',
+            '-deadline', 'realtime', '-cpu-used', '8',
+            '-row-mt', '1', '-tile-columns', '2', '-frame-parallel', '0',
+            '-crf', '36', '-b:v', '0'
+        ],
+        audio=_OPUS
+    ),
+    'av1': EncoderProfile(
+        container='webm',
+        video=[ '-c:v', 'libsvtav1', '-preset', '8', '-crf', '35' ],
+        audio=_OPUS
+    ),
+    'h264': EncoderProfile(
+        container='mp4',
+        video=[ '-c:v', 'libx264', '-preset', 'veryfast', '-crf', '23', '-pix_fmt', 'yuv420p' ],
+        audio=[ '-c:a', 'aac', '-b:a', '128k' ],
+        # moves the index to the front of the MP4 so that playback can start while downloading
+        muxer=( '-movflags', '+faststart' )
+    ),
+}
+
+DEFAULT_ENCODER_PROFILE = 'vp9'
+
+def video_encoder_args(
+        profile: EncoderProfile,
+        threads: int = 0,
+        keyframe_interval: int = 0
+) -> List[str]:
+    """
+        Generates the ffmpeg output options for the video part of an encoder profile.
+
+        :param profile the encoder profile
+        :param threads number of encoder threads, 0 to let ffmpeg decide
+        :param keyframe_interval maximum number of frames between keyframes, 0 to leave it to
+                                 the encoder
+        :returns ffmpeg command-line options
+    """
+    args = list(profile.video)
+
+    if threads > 0:
+        args += [ '-threads', str(threads) ]
+
+    if keyframe_interval > 0:
+        args += [ '-g', str(keyframe_interval) ]
+
+    return args
+
+def encoder_args(
+        profile: EncoderProfile,
+        threads: int = 0,
+        keyframe_interval: int = 0
+) -> List[str]:
+    """
+        Generates the ffmpeg output options for an encoder profile.
+
+        :param profile the encoder profile
+        :param threads number of encoder threads, 0 to let ffmpeg decide
+        :param keyframe_interval maximum number of frames between keyframes, 0 to leave it to
+                                 the encoder
+        :returns ffmpeg command-line options
+    """
+    return video_encoder_args(profile, threads, keyframe_interval) + profile.audio
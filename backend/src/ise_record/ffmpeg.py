@@ -0,0 +1,135 @@
+"""
+    ISE-Recorder ffmpeg runner. Runs ffmpeg and ffprobe and reads what the pipeline needs to know
+    about the files they work on.
+"""
+
+import asyncio
+import logging
+import os
+from pathlib import Path
+from subprocess import CalledProcessError
+from typing import Callable, List, Optional
+
+from .metrics import SUBPROCESS_FAILURES
+
+logger = logging.getLogger(__name__)
+
+_STDERR_TAIL_SIZE = 64 * 1024
+
+def log_error(err: CalledProcessError) -> None:
+    """ Logs a failed ffmpeg or ffprobe run with its command line and output """
+    logger.error("Failed with return code %d.\n" \
+                 "command = %s\n\n" \
+                 "stdout\n------\n%s\n\n" \
+                 "stderr\n------\n%s\n",
+                 err.returncode, err.cmd, err.stdout, err.stderr)
+
+async def run_command(
+        command: List[str],
+        on_output_line: Optional[Callable[[bytes], None]] = None
+) -> bytes:
+    """
+        Runs a program to completion.
+
+        :param command program and its arguments
+        :param on_output_line receives stdout line by line as it arrives instead of having it
+                              buffered until the program exits
+        :returns stdout, empty if it was handed to on_output_line
+        :raises CalledProcessError if the program fails
+    """
+    proc = await asyncio.create_subprocess_exec(
+        *command,
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE
+    )
+
+    if on_output_line is None:
+        out, err = await proc.communicate()
+    else:
+        async def consume_stdout() -> bytes:
+            assert proc.stdout is not None
+            async for line in proc.stdout:
+                on_output_line(line)
+            return b''
+
+        # keep only the end of stderr for error reports, long runs can write a lot of warnings
+        async def consume_stderr() -> bytes:
+            assert proc.stderr is not None
+            tail = b''
+            while content := await proc.stderr.read(64 * 1024):
+                tail = (tail + content)[-_STDERR_TAIL_SIZE:]
+            return tail
+
+        try:
+            out, err = await asyncio.gather(consume_stdout(), consume_stderr())
+        except:
+            proc.kill()
+            await proc.wait()
+            raise
+
+        await proc.wait()
+
+    if proc.returncode != 0:
+        SUBPROCESS_FAILURES.inc(program=os.path.basename(command[0]))
+        raise CalledProcessError(
+            returncode = proc.returncode if proc.returncode is not None else -65535,
+            cmd = command,
+            output = out,
+            stderr = err
+        )
+
+    return out
+
+async def keyframe_times(path: Path) -> List[float]:
+    """
+        Finds the keyframes of the first video stream in a file. This only demuxes the file.
+
+        :param path input video file
+        :returns presentation times of the keyframes in seconds, in ascending order
+    """
+    probe_command = [
+        'ffprobe',
+        '-v', 'error',
+        '-select_streams', 'v:0',
+        '-show_entries', 'packet=pts_time,flags',
+        '-of', 'csv=p=0',
+        str(path)
+    ]
+
+    logger.debug("Probe command = %s", probe_command)
+
+    times: List[float] = []
+
+    def collect(line: bytes) -> None:
+        pts_time, _, flags = line.decode(errors='replace').strip().partition(',')
+
+        if flags.startswith('K'):
+            try:
+                times.append(float(pts_time))
+            except ValueError:
+                pass
+
+    await run_command(probe_command, collect)
+
+    return sorted(times)
+
+async def media_duration(path: Path) -> float | None:
+    """
+        Reads the duration of a file that ffmpeg wrote, i.e. one with a duration in its header.
+
+        :param path input file
+        :returns the duration in seconds, or None if the file doesn't state one
+    """
+    probe_command = [
+        'ffprobe',
+        '-v', 'error',
+        '-show_entries', 'format=duration',
+        '-of', 'csv=p=0',
+        str(path)
+    ]
+
+    try:
+        return float((await run_command(probe_command)).strip())
+    except ValueError:
+        return None
@@ -0,0 +1,27 @@
+"""
+    ISE-Recorder file helpers shared by the modules that keep their state on disk.
+"""
+
+import os
+from pathlib import Path
+import tempfile
+
+def write_atomically(path: Path, text: str) -> None:
+    """
+        Replaces the content of a file. The text is written to a temporary file next to the
+        target and renamed over it, so readers see either the old or the new content, never a
+        partially written file, even if the process dies while writing.
+
+        :param path file to write
+        :param text new content of the file
+    """
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=f'.{path.name}.', suffix='.tmp')
+
+    try:
+        with open(fd, 'w', encoding='utf-8') as tmp_file:
+            tmp_file.write(text)
+
+        os.replace(tmp_name, path)
+    except BaseException:
+        os.unlink(tmp_name)
+        raise
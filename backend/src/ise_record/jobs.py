@@ -0,0 +1,376 @@
+"""
+    ISE-Recorder job queue. Keeps postprocessing jobs on disk so they survive restarts and runs
+    them on a bounded number of workers, so that a dozen lectures ending at the same time don't
+    start a dozen concurrent renders.
+"""
+
+import asyncio
+from datetime import datetime, timedelta, timezone
+from enum import Enum
+import logging
+import os
+from pathlib import Path
+import time
+from typing import Awaitable, Callable, Dict, List, Literal, Optional, Set, Tuple
+from uuid import uuid4
+
+from pydantic import BaseModel, ValidationError
+
+from .fileutil import write_atomically
+from .postprocess import Result, ResultReason
+from .progress import Phase, Progress, ProgressCallback
+
+logger = logging.getLogger(__name__)
+
+JobOrdering = Literal["fifo", "priority"]
+
+class JobState(Enum):
+    """ Lifecycle state of a postprocessing job """
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+class JobProgress(BaseModel):
+    """ Last known progress of a running postprocessing job """
+
+    phase: Phase
+    percent: Optional[float] = None
+    fps: Optional[float] = None
+    speed: Optional[float] = None
+    eta: Optional[float] = None
+    updated: datetime
+
+class JobStage(BaseModel):
+    """ Time and resources a phase of a finished postprocessing job took """
+
+    phase: Phase
+    wall_seconds: float
+    cpu_seconds: float
+    bitrate: Optional[float] = None
+    bytes_read: int
+    bytes_written: int
+
+class JobRecord(BaseModel):
+    """ Persistent state of a postprocessing job """
+
+    id: str
+    seq: int
+    recording: str
+    recipient: Optional[str] = None
+    # recipients of identical submissions that were merged into this job
+    merged_recipients: List[str] = []
+    priority: int = 0
+    encoder_profile: Optional[str] = None
+    state: JobState = JobState.PENDING
+    submitted: datetime
+    started: Optional[datetime] = None
+    finished: Optional[datetime] = None
+    progress: Optional[JobProgress] = None
+    stages: List[JobStage] = []
+
+JobRunner = Callable[[JobRecord, ProgressCallback], Awaitable[Result | None]]
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+class ProgressWriter: # pylint: disable=too-few-public-methods
+    """
+        Progress callback that publishes the progress of a job through a file, so that it can
+        be read back no matter which process runs the job. Updates within the same phase are
+        rate-limited because ffmpeg reports progress several times per second.
+    """
+
+    def __init__(self, path: Path, min_interval: float = 1.0):
+        """
+            :param path file to publish the progress in
+            :param min_interval minimum number of seconds between updates in the same phase
+        """
+        self._path = path
+        self._min_interval = min_interval
+        self._last_phase: Phase | None = None
+        self._last_write = 0.0
+
+    def __call__(self, progress: Progress) -> None:
+        now = time.monotonic()
+
+        if (
+            progress.phase == self._last_phase
+            and progress.percent != 100.0
+            and now - self._last_write < self._min_interval
+        ):
+            return
+
+        self._last_phase = progress.phase
+        self._last_write = now
+
+        os.makedirs(self._path.parent, exist_ok=True)
+        write_atomically(
+            self._path,
+            JobProgress(**progress._asdict(), updated=_now()).model_dump_json()
+        )
+
+class JobQueue: # pylint: disable=too-many-instance-attributes
+    """
+        Queue of postprocessing jobs. Every job is stored as a JSON file in the state directory
+        and updated as it progresses; jobs that were pending or running when the server went
+        down are picked up again when the queue is started.
+    """
+
+    def __init__( # pylint: disable=too-many-arguments,too-many-positional-arguments
+            self,
+            state_dir: Path,
+            workers: int,
+            ordering: JobOrdering,
+            runner: JobRunner,
+            retention: timedelta | None = None,
+            default_encoder_profile: str | None = None
+    ):
+        """
+            :param state_dir directory to keep the job files in
+            :param workers number of jobs to run concurrently
+            :param ordering "fifo" to run jobs in order of submission, "priority" to run jobs
+                            with higher priority first (and in order of submission among equals)
+            :param runner coroutine function that executes a job
+            :param retention how long to keep finished jobs, None to keep them forever
+            :param default_encoder_profile encoder profile that jobs without one are rendered
+                                           with, so that they are recognized as the same job as
+                                           ones that name it
+        """
+        self._state_dir = state_dir
+        self._workers = workers
+        self._ordering = ordering
+        self._runner = runner
+        self._retention = retention
+        self._default_encoder_profile = default_encoder_profile
+
+        self._records: Dict[str, JobRecord] | None = None
+        self._queue: asyncio.PriorityQueue[Tuple[Tuple[int, int], str]]
+        self._queue = asyncio.PriorityQueue()
+        self._queued: Set[str] = set()
+        self._tasks: List[asyncio.Task[None]] = []
+        # recordings with a running job, and jobs waiting for it as they'd write the same files
+        self._running: Set[str] = set()
+        self._deferred: Dict[str, List[JobRecord]] = {}
+
+    def _job_path(self, job_id: str) -> Path:
+        return self._state_dir / f'{job_id}.json'
+
+    def _progress_path(self, job_id: str) -> Path:
+        return self._state_dir / 'progress' / f'{job_id}.json'
+
+    def _save(self, record: JobRecord) -> None:
+        os.makedirs(self._state_dir, exist_ok=True)
+        write_atomically(self._job_path(record.id), record.model_dump_json())
+
+    def _read_progress(self, job_id: str) -> JobProgress | None:
+        try:
+            return JobProgress.model_validate_json(
+                self._progress_path(job_id).read_text(encoding='utf-8')
+            )
+        except (OSError, ValidationError):
+            return None
+
+    def _with_progress(self, record: JobRecord) -> JobRecord:
+        if record.state != JobState.RUNNING:
+            return record
+
+        return record.model_copy(update={ 'progress': self._read_progress(record.id) })
+
+    def _loaded_records(self) -> Dict[str, JobRecord]:
+        if self._records is None:
+            self._records = {}
+
+            for job_path in sorted(self._state_dir.glob('*.json')):
+                try:
+                    record = JobRecord.model_validate_json(job_path.read_text(encoding='utf-8'))
+                    self._records[record.id] = record
+                except (OSError, ValidationError) as ex:
+                    logger.warning("Ignoring unreadable job file %s: %s", job_path, ex)
+
+        return self._records
+
+    def _prune(self) -> None:
+        if self._retention is None:
+            return
+
+        cutoff = _now() - self._retention
+        records = self._loaded_records()
+
+        for record in list(records.values()):
+            if record.finished is not None and record.finished < cutoff:
+                logger.debug("Removing job %s for %s", record.id, record.recording)
+                self._job_path(record.id).unlink(missing_ok=True)
+                del records[record.id]
+
+    def _enqueue(self, record: JobRecord) -> None:
+        if record.id in self._queued:
+            return
+
+        self._queued.add(record.id)
+        priority = -record.priority if self._ordering == "priority" else 0
+        self._queue.put_nowait(((priority, record.seq), record.id))
+
+    def jobs(self) -> List[JobRecord]:
+        """ All known jobs in order of submission, with the progress of running jobs """
+        return [
+            self._with_progress(r)
+            for r in sorted(self._loaded_records().values(), key=lambda r: r.seq)
+        ]
+
+    def get(self, job_id: str) -> JobRecord | None:
+        """ Looks up a job by its id """
+        record = self._loaded_records().get(job_id)
+        return self._with_progress(record) if record is not None else None
+
+    def latest_for(self, recording: str) -> JobRecord | None:
+        """ Looks up the most recently submitted job for a recording """
+        return next((r for r in reversed(self.jobs()) if r.recording == recording), None)
+
+    def submit(
+            self,
+            recording: str,
+            recipient: str | None,
+            priority: int = 0,
+            encoder_profile: str | None = None
+    ) -> JobRecord:
+        """
+            Adds a job to the queue. If a job for the recording with the same encoder profile is
+            already pending or running, e.g. because the client retried the request, that job is
+            returned instead and the recipient is added to the ones it notifies.
+
+            :param recording name of the recording to postprocess
+            :param recipient recipient of the completion notification, if any
+            :param priority scheduling priority, only relevant with priority ordering
+            :param encoder_profile encoder profile to render with, None for the server's default
+            :returns the persisted job record
+        """
+        records = self._loaded_records()
+        encoder_profile = encoder_profile or self._default_encoder_profile
+
+        duplicate = next((
+            r for r in records.values()
+            if r.state in (JobState.PENDING, JobState.RUNNING)
+            and (r.recording, r.encoder_profile) == (recording, encoder_profile)
+        ), None)
+
+        if duplicate is not None:
+            logger.info(
+                "Job %s for %s is already %s", duplicate.id, recording, duplicate.state.value
+            )
+
+            if recipient is not None and recipient not in (
+                duplicate.recipient, *duplicate.merged_recipients
+            ):
+                # appended in place, a running job reads the list when it sends its notifications
+                duplicate.merged_recipients.append(recipient)
+                self._save(duplicate)
+
+            return self._with_progress(duplicate)
+
+        record = JobRecord(
+            id=uuid4().hex,
+            seq=max((r.seq for r in records.values()), default=0) + 1,
+            recording=recording,
+            recipient=recipient,
+            priority=priority,
+            encoder_profile=encoder_profile,
+            submitted=_now()
+        )
+
+        self._save(record)
+        records[record.id] = record
+        self._enqueue(record)
+
+        logger.info("Queued job %s for %s", record.id, recording)
+
+        return record
+
+    async def start(self) -> None:
+        """ Resumes unfinished jobs from disk and starts the workers """
+        self._prune()
+
+        # the stored records themselves, jobs() hands out copies of running ones
+        for record in sorted(self._loaded_records().values(), key=lambda r: r.seq):
+            if record.state == JobState.RUNNING:
+                logger.info("Resuming interrupted job %s for %s", record.id, record.recording)
+                record.state = JobState.PENDING
+                record.started = None
+                self._save(record)
+                self._enqueue(record)
+            elif record.state == JobState.PENDING:
+                self._enqueue(record)
+
+        self._tasks = [ asyncio.create_task(self._work()) for _ in range(self._workers) ]
+
+    async def stop(self) -> None:
+        """ Stops the workers. Jobs that are running at this point will be resumed on start. """
+        for task in self._tasks:
+            task.cancel()
+
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _work(self) -> None:
+        while True:
+            _, job_id = await self._queue.get()
+            self._queued.discard(job_id)
+            record = self._loaded_records()[job_id]
+
+            if record.recording in self._running:
+                # e.g. another encoder profile, both would write the recording's segments
+                logger.info("Job %s waits for the running job for %s", job_id, record.recording)
+                self._deferred.setdefault(record.recording, []).append(record)
+                continue
+
+            self._running.add(record.recording)
+
+            try:
+                await self._run(record)
+            finally:
+                self._running.discard(record.recording)
+
+                for deferred in self._deferred.pop(record.recording, []):
+                    self._enqueue(deferred)
+
+            self._prune()
+
+    async def _run(self, record: JobRecord) -> None:
+        job_id = record.id
+
+        record.state = JobState.RUNNING
+        record.started = _now()
+        record.progress = None
+        self._save(record)
+
+        progress_path = self._progress_path(job_id)
+        progress_path.unlink(missing_ok=True)
+
+        record.stages = []
+
+        try:
+            result = await self._runner(record, ProgressWriter(progress_path))
+
+            if result is not None:
+                record.stages = [ JobStage(**stage._asdict()) for stage in result.stages ]
+
+            # postprocessing reports failed renders in its result rather than raising
+            if result is not None and result.reason != ResultReason.SUCCESS:
+                logger.warning(
+                    "Job %s for %s failed: %s", record.id, record.recording, result.reason.name
+                )
+                record.state = JobState.FAILED
+            else:
+                record.state = JobState.DONE
+        except Exception: # pylint: disable=broad-exception-caught
+            # CancelledError isn't caught, so a cancelled job stays marked as running and is
+            # resumed after a restart
+            logger.exception("Job %s for %s failed", record.id, record.recording)
+            record.state = JobState.FAILED
+
+        # keep the last progress report with the job, it shows where a failed job gave up
+        record.progress = self._read_progress(job_id)
+        progress_path.unlink(missing_ok=True)
+
+        record.finished = _now()
+        self._save(record)
@@ -0,0 +1,154 @@
+"""
+    ISE-Recorder live rendering. Renders a recording in segments while it is still being
+    uploaded, so that the final render only has to encode what comes after the last one.
+"""
+
+import logging
+from pathlib import Path
+from typing import List
+
+from .assembly import ASSEMBLED_FILENAME, assembled_chunks
+from .cropdetect import cached_video_properties, update_crop_cache
+from .ffmpeg import media_duration, run_command
+from .options import OUTPUT_FPS, output_path_for, PostprocessingOptions
+from .postprocess import generate_ffmpeg_filter, rendition_heights
+from .segments import (
+    locked_segment_dir,
+    next_segment_number,
+    record_segment,
+    render_key,
+    RenderedSegment,
+    segment_command,
+    segment_dir_for,
+    segment_end,
+    usable_segments,
+    VideoRender
+)
+
+logger = logging.getLogger(__name__)
+
+# a segment may come out a frame short of its window because of where the seek lands
+_SEGMENT_LENGTH_TOLERANCE = 2 / OUTPUT_FPS
+
+def _track_covers(track_path: Path, end: float, chunk_seconds: float) -> bool:
+    # one chunk of slack because chunk boundaries are only nominally chunk_seconds apart. Chunk
+    # lengths drift, so the rendered segment is checked, too.
+    return assembled_chunks(track_path) * chunk_seconds >= end + chunk_seconds
+
+def _discard_output(_: bytes) -> None:
+    # streams ffmpeg's output away instead of collecting all of it until it exits
+    pass
+
+async def _live_render(
+        video_dirs: List[Path],
+        chunk_seconds: float,
+        options: PostprocessingOptions
+) -> VideoRender | None:
+    stream_dir = video_dirs[0]
+    stream_props = cached_video_properties(stream_dir)
+
+    if stream_props is None:
+        # crop detection during upload is off or hasn't run yet
+        await update_crop_cache(
+            stream_dir,
+            assembled_chunks(stream_dir),
+            chunk_seconds,
+            options.crop_detect_frames
+        )
+        stream_props = cached_video_properties(stream_dir)
+
+    if stream_props is None:
+        return None
+
+    # only renditions below the output height, like the final render, so it can reuse them
+    heights = rendition_heights(stream_props, options.renditions)
+
+    return VideoRender(
+        video_inputs=[ d / ASSEMBLED_FILENAME for d in video_dirs ],
+        filter_graph=generate_ffmpeg_filter(stream_props, len(video_dirs) > 1, heights),
+        heights=heights,
+        options=options
+    )
+
+async def _render_live_segment(
+        render: VideoRender,
+        segment_dir: Path,
+        segment: RenderedSegment
+) -> bool:
+    segment_path = segment_dir / segment.filename
+    await run_command(
+        segment_command(render, segment.start, segment.length, segment_path),
+        _discard_output
+    )
+
+    # a short segment means a track ended before the window did after all
+    duration = await media_duration(segment_path)
+
+    if duration is None or duration < segment.length - _SEGMENT_LENGTH_TOLERANCE:
+        for path in segment_dir.glob(f'{segment_path.stem}.*'):
+            path.unlink()
+        return False
+
+    record_segment(segment_dir, segment)
+    return True
+
+async def render_live_segments(
+        recording_path: Path,
+        chunk_seconds: float,
+        window_chunks: int,
+        options: PostprocessingOptions = PostprocessingOptions()
+) -> List[RenderedSegment]:
+    """
+        Renders the time windows of a recording that is still being uploaded once all of its
+        video tracks have been assembled past them. The final render reuses these segments and
+        only has to encode what comes after the last one.
+
+        :param recording_path directory that contains the tracks of the recording
+        :param chunk_seconds approximate duration of a chunk
+        :param window_chunks length of a window in chunks
+        :param options pipeline tunables. Segments are only reused by a final render with the
+                       same encoder settings.
+        :returns the segments rendered so far
+    """
+    overlay_dir = recording_path / "overlay"
+    video_dirs = [ recording_path / "stream" ]
+    video_dirs += [ overlay_dir ] if overlay_dir.is_dir() else []
+    window_seconds = window_chunks * chunk_seconds
+
+    segment_dir = segment_dir_for(output_path_for(recording_path, options))
+
+    async with locked_segment_dir(segment_dir, wait=False) as locked:
+        if not locked:
+            # the final render or another live render is busy with the segments
+            return []
+
+        render = await _live_render(video_dirs, chunk_seconds, options)
+
+        if render is None:
+            return []
+
+        # a changed crop area invalidates everything rendered so far
+        rendered = usable_segments(segment_dir, render_key(render.filter_graph, options))
+        start = segment_end(rendered)
+
+        while all(_track_covers(d, start + window_seconds, chunk_seconds) for d in video_dirs):
+            segment = RenderedSegment(
+                start=start,
+                length=window_seconds,
+                filename=f'segment.{next_segment_number(rendered):04d}.{options.encoder.container}'
+            )
+
+            logger.info("Rendering %s from %.1fs live", recording_path, start)
+
+            if not await _render_live_segment(render, segment_dir, segment):
+                logger.info(
+                    "Live segment of %s from %.1fs came out short, rendering it again later",
+                    recording_path,
+                    start
+                )
+                break
+
+            rendered.append(segment)
+            start += window_seconds
+
+        return rendered
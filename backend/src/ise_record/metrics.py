@@ -0,0 +1,292 @@
+"""
+    ISE-Recorder metrics. A small registry of counters, gauges and histograms that renders the
+    Prometheus text exposition format, so that throughput and failures can be monitored without
+    pulling in a client library.
+
+    Postprocessing may run in worker processes, whose metrics never reach the server's registry by
+    themselves. Workers therefore hand their accumulated counts back with every job result (see
+    drain and merge).
+"""
+
+import bisect
+from contextlib import contextmanager
+import time
+from typing import Callable, Dict, Iterator, List, Sequence, Tuple
+
+LabelValues = Tuple[str, ...]
+MetricState = Dict[LabelValues, List[float]]
+
+# upper bounds in seconds, from a chunk upload to a render of a long lecture
+DEFAULT_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 1800.0, 7200.0
+)
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ''
+
+    return '{' + ','.join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + '}'
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if value == int(value) else repr(value)
+
+class Metric:
+    """ Base class of metrics with a fixed set of label names """
+
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        """
+            :param name metric name
+            :param documentation help text
+            :param labelnames names of the labels that distinguish samples
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._state: MetricState = {}
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'{self.name} expects labels {self.labelnames}, got {tuple(labels)}')
+
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def _state_size(self) -> int:
+        return 1
+
+    def _items(self) -> List[Tuple[LabelValues, List[float]]]:
+        # a metric without labels is exposed as zero before anything happened, so that rates
+        # can be computed from the start
+        if not self._state and not self.labelnames:
+            return [ ((), [ 0.0 ] * self._state_size()) ]
+
+        return sorted(self._state.items())
+
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        """ Yields (suffix, formatted labels, value) of all samples """
+        for key, state in self._items():
+            yield '', _format_labels(self.labelnames, key), state[0]
+
+    def expose(self) -> str:
+        """ Renders the metric in the text exposition format """
+        lines = [ f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}' ]
+        lines += [
+            f'{self.name}{suffix}{labels} {_format_value(value)}'
+            for suffix, labels, value in self.samples()
+        ]
+        return '\n'.join(lines) + '\n'
+
+    def drain(self) -> MetricState:
+        """ Returns the accumulated state and starts over from zero """
+        state, self._state = self._state, {}
+        return state
+
+    def merge(self, state: MetricState) -> None:
+        """ Adds state drained from the same metric in another process """
+        for key, values in state.items():
+            current = self._state.setdefault(key, [ 0.0 ] * len(values))
+            for i, value in enumerate(values):
+                current[i] += value
+
+class Counter(Metric):
+    """ Monotonically increasing count, e.g. of requests or bytes """
+
+    kind = 'counter'
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        """ Increases the count of the sample with the given labels """
+        state = self._state.setdefault(self._key(labels), [ 0.0 ])
+        state[0] += amount
+
+    def value(self, **labels: str) -> float:
+        """ Current count of the sample with the given labels """
+        return self._state.get(self._key(labels), [ 0.0 ])[0]
+
+class Gauge(Metric):
+    """ Value that is computed when the metrics are collected, e.g. a queue length """
+
+    kind = 'gauge'
+
+    def __init__(
+            self,
+            name: str,
+            documentation: str,
+            labelnames: Sequence[str] = (),
+            collect: Callable[[], Dict[LabelValues, float]] | None = None
+    ):
+        """
+            :param collect returns the current values by label values
+        """
+        super().__init__(name, documentation, labelnames)
+        self.collect = collect
+
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        values = self.collect() if self.collect is not None else {}
+
+        for key, value in sorted(values.items()):
+            yield '', _format_labels(self.labelnames, key), value
+
+    def drain(self) -> MetricState:
+        # gauges describe the process they live in, there is nothing to hand over
+        return {}
+
+class Histogram(Metric):
+    """ Distribution of observed values, e.g. durations, in cumulative buckets """
+
+    kind = 'histogram'
+
+    def __init__(
+            self,
+            name: str,
+            documentation: str,
+            labelnames: Sequence[str] = (),
+            buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        """
+            :param buckets upper bounds of the buckets, ascending
+        """
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels: str) -> None:
+        """ Records a value """
+        # per bucket count (not cumulative), then the overflow count, sum and count
+        state = self._state.setdefault(self._key(labels), [ 0.0 ] * self._state_size())
+        state[bisect.bisect_left(self.buckets, value)] += 1
+        state[-2] += value
+        state[-1] += 1
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        """ Observes the wall time of the enclosed block """
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    @contextmanager
+    def time_outcome(self) -> Iterator[None]:
+        """ Observes the wall time of the enclosed block, labeled by whether it raised """
+        start = time.perf_counter()
+        result = 'failure'
+
+        try:
+            yield
+            result = 'success'
+        finally:
+            self.observe(time.perf_counter() - start, result=result)
+
+    def _state_size(self) -> int:
+        return len(self.buckets) + 3
+
+    def count(self, **labels: str) -> float:
+        """ Number of observations of the sample with the given labels """
+        return self._state.get(self._key(labels), [ 0.0 ])[-1]
+
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        for key, state in self._items():
+            cumulative = 0.0
+
+            for bound, count in zip([ *map(str, self.buckets), '+Inf' ], state):
+                cumulative += count
+                labels = _format_labels((*self.labelnames, 'le'), (*key, bound))
+                yield '_bucket', labels, cumulative
+
+            yield '_sum', _format_labels(self.labelnames, key), state[-2]
+            yield '_count', _format_labels(self.labelnames, key), state[-1]
+
+class Registry:
+    """ Collection of metrics that are exposed together """
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        """ Adds a metric, replacing one of the same name """
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        """ Creates and registers a counter """
+        metric = Counter(name, documentation, labelnames)
+        self.register(metric)
+        return metric
+
+    def gauge(
+            self,
+            name: str,
+            documentation: str,
+            labelnames: Sequence[str] = (),
+            collect: Callable[[], Dict[LabelValues, float]] | None = None
+    ) -> Gauge:
+        """ Creates and registers a gauge """
+        metric = Gauge(name, documentation, labelnames, collect)
+        self.register(metric)
+        return metric
+
+    def histogram(
+            self,
+            name: str,
+            documentation: str,
+            labelnames: Sequence[str] = (),
+            buckets: Sequence[float] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        """ Creates and registers a histogram """
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self.register(metric)
+        return metric
+
+    def expose(self) -> str:
+        """ Renders all metrics in the text exposition format """
+        return ''.join(m.expose() for _, m in sorted(self._metrics.items()))
+
+    def drain(self) -> Dict[str, MetricState]:
+        """ Returns the accumulated state of all metrics and resets them, see merge """
+        return { name: state for name, m in self._metrics.items() if (state := m.drain()) }
+
+    def merge(self, drained: Dict[str, MetricState]) -> None:
+        """ Adds state drained from the registry of another process """
+        for name, state in drained.items():
+            if (metric := self._metrics.get(name)) is not None:
+                metric.merge(state)
+
+REGISTRY = Registry()
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+CHUNK_UPLOADS = REGISTRY.counter(
+    'ise_record_chunk_uploads_total', 'Chunks stored'
+)
+CHUNK_UPLOAD_BYTES = REGISTRY.counter(
+    'ise_record_chunk_upload_bytes_total', 'Bytes of chunks stored'
+)
+CHUNK_UPLOAD_SECONDS = REGISTRY.histogram(
+    'ise_record_chunk_upload_seconds', 'Time to store an uploaded chunk'
+)
+CONCAT_SECONDS = REGISTRY.histogram(
+    'ise_record_concat_seconds', 'Time to concatenate the chunks of a track'
+)
+CONCAT_BYTES = REGISTRY.counter(
+    'ise_record_concat_bytes_total', 'Bytes of tracks concatenated from chunks'
+)
+PROBE_SECONDS = REGISTRY.histogram(
+    'ise_record_probe_seconds', 'Time to analyze the main stream'
+)
+RENDER_SECONDS = REGISTRY.histogram(
+    'ise_record_render_seconds', 'Time to render a presentation, by outcome', [ 'result' ]
+)
+SUBPROCESS_FAILURES = REGISTRY.counter(
+    'ise_record_subprocess_failures_total', 'Failed ffmpeg and ffprobe runs', [ 'program' ]
+)
+POSTPROCESSING_JOBS = REGISTRY.counter(
+    'ise_record_postprocessing_jobs_total', 'Finished postprocessing jobs, by result', [ 'result' ]
+)
+REPORTS = REGISTRY.counter(
+    'ise_record_reports_total', 'Notifications about finished jobs, by outcome', [ 'result' ]
+)
@@ -0,0 +1,61 @@
+"""
+    ISE-Recorder postprocessing options. Tunables of the pipeline that the server and
+    rerender.py hand to postprocessing, and the names of the files a render writes.
+"""
+
+from pathlib import Path
+from typing import List, Literal, NamedTuple, Tuple
+
+from .encoders import (
+    DEFAULT_ENCODER_PROFILE,
+    ENCODER_PROFILES,
+    EncoderProfile,
+    video_encoder_args
+)
+
+StreamingFormat = Literal['hls', 'dash']
+
+OUTPUT_FPS = 30
+STREAMING_SEGMENT_SECONDS = 6
+
+class PostprocessingOptions(NamedTuple):
+    """ Tunables of the postprocessing pipeline (parameter object) """
+    crop_detect_samples: int = 0
+    crop_detect_frames: int = 10
+    use_crop_cache: bool = True
+    pipe_chunks: bool = False
+    io_concurrency: int = 4
+    encoder: EncoderProfile = ENCODER_PROFILES[DEFAULT_ENCODER_PROFILE]
+    encoder_threads: int = 0
+    stream_copy: bool = True
+    render_segments: int = 1
+    renditions: Tuple[int, ...] = ()
+    audio_rendition: bool = False
+    streaming_format: StreamingFormat | None = None
+    checkpoint_seconds: float = 0.0
+    use_render_cache: bool = True
+
+def video_args(options: PostprocessingOptions) -> List[str]:
+    """ ffmpeg output options for the video of a render """
+    # streaming segments can only start at keyframes, so they have to come regularly
+    keyframe_interval = STREAMING_SEGMENT_SECONDS * OUTPUT_FPS if options.streaming_format else 0
+
+    return video_encoder_args(options.encoder, options.encoder_threads, keyframe_interval)
+
+def output_path_for(recording_path: Path, options: PostprocessingOptions) -> Path:
+    """ Path of the rendered presentation of a recording """
+    return recording_path / f'presentation.{options.encoder.container}'
+
+def rendition_path(path: Path, label: str) -> Path:
+    """ Output path of a rendition, e.g. presentation.720p.webm for presentation.webm """
+    return path.with_name(f'{path.stem}.{label}{path.suffix}')
+
+def audio_rendition_args(
+        audio_maps: List[str],
+        output_path: Path,
+        options: PostprocessingOptions
+) -> List[str]:
+    """ ffmpeg output options that write the audio of a render on its own, see rendition_path """
+    return audio_maps + [ '-vn' ] + options.encoder.audio + list(options.encoder.muxer) + [
+        '-y', str(rendition_path(output_path, 'audio'))
+    ]
@@ -5,14 +5,55 @@
 """
 
 import asyncio
+from contextlib import asynccontextmanager, AsyncExitStack, contextmanager
 from enum import Enum
 import json
 import logging
+import os
 from pathlib import Path
+import resource
 from subprocess import CalledProcessError
-from typing import NamedTuple, List, Tuple
-
-import aiofiles
+import tempfile
+import time
+from typing import AsyncIterator, Iterator, NamedTuple, List, Sequence, Set, Tuple
+
+from .assembly import (
+    append_file,
+    ASSEMBLED_FILENAME,
+    assembled_track,
+    discard_assembly_state
+)
+from .cropdetect import (
+    cached_video_properties,
+    Rectangle,
+    video_properties,
+    VideoProperties
+)
+from .ffmpeg import log_error, run_command
+from .metrics import CONCAT_BYTES, CONCAT_SECONDS, RENDER_SECONDS
+from .options import (
+    audio_rendition_args,
+    OUTPUT_FPS,
+    output_path_for,
+    PostprocessingOptions,
+    rendition_path,
+    video_args
+)
+from .progress import FfmpegProgressParser, Phase, Progress, ProgressCallback
+from .render_cache import (
+    discard_cache_entry,
+    is_cached,
+    render_cache_key,
+    store_cache_entry,
+    track_fingerprint
+)
+from .segments import (
+    read_segment_manifest,
+    render_in_segments,
+    segment_dir_for,
+    VideoRender
+)
+from .streaming import package_for_streaming
 
 logger = logging.getLogger(__name__)
 
@@ -22,166 +63,174 @@ class ResultReason(Enum):
     FAILURE = 2
     MAIN_STREAM_MISSING = 3
 
+class StageStats(NamedTuple):
+    """
+        Time and resources a phase of a postprocessing job took. CPU time and I/O include the
+        ffmpeg processes run during the phase. I/O is what reached the storage, reads from the
+        page cache don't count.
+    """
+    phase: Phase
+    wall_seconds: float
+    cpu_seconds: float
+    bytes_read: int
+    bytes_written: int
+    bitrate: float | None = None
+
 class Result(NamedTuple):
     """ Result of a postprocessing job """
     output_file: Path | None
     reason: ResultReason
-
-class Rectangle(NamedTuple):
-    """ rectangular area in a video stream, used for cropping """
-    width: int
-    height: int
-    left: int
-    top: int
-
-class VideoProperties(NamedTuple):
-    """ Properties of a video stream that we need for postprocessing """
-    width: int
-    height: int
-    crop: Rectangle
-
-    def needs_cropping(self) -> bool:
-        """
-        determines if this video stream needs to be cropped.
-        """
-        return self.width > self.crop.width or self.height > self.crop.height
-
-def _log_error(err: CalledProcessError) -> None:
-    logger.error("Failed with return code %d.\n" \
-                 "command = %s\n\n" \
-                 "stdout\n------\n%s\n\n" \
-                 "stderr\n------\n%s\n",
-                 err.returncode, err.cmd, err.stdout, err.stderr)
-
-async def _run_command(command: List[str]) -> bytes:
-    proc = await asyncio.create_subprocess_exec(
-        *command,
-        stdin=asyncio.subprocess.DEVNULL,
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.PIPE
+    stages: Tuple[StageStats, ...] = ()
+
+class _ResourceUsage(NamedTuple):
+    wall: float
+    cpu: float
+    read: int
+    written: int
+
+def _resource_usage() -> _ResourceUsage:
+    # asyncio reaps ffmpeg itself, so its usage is only available summed up over all children.
+    # For the same reason there is no peak RSS per phase: the children's maximum covers every
+    # process the job's process ever ran.
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    return _ResourceUsage(
+        wall=time.perf_counter(),
+        cpu=own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime,
+        # 512 byte blocks on Linux
+        read=(own.ru_inblock + children.ru_inblock) * 512,
+        written=(own.ru_oublock + children.ru_oublock) * 512
     )
 
-    out, err = await proc.communicate()
-
-    if proc.returncode != 0:
-        raise CalledProcessError(
-            returncode = proc.returncode if proc.returncode is not None else -65535,
-            cmd = command,
-            output = out,
-            stderr = err
-        )
-
-    return out
-
-def determine_crop_area(
-        stream_width: int,
-        stream_height: int,
-        raw_crop: Rectangle
-) -> Rectangle:
-    """ 
-        Determine the effective cropping area for a stream. Will select the full
-        stream rectangle if an insignificant area would be cropped.
-
-        :param stream_width width of the input stream
-        :param stream_height height of the input stream
-        :param raw_crop cropping area as detected by ffmpeg
-        :returns the effective cropping area
+class StageMeter:
+    """
+        Measures the phases of a job one after the other. Phases of concurrent jobs in the same
+        process are charged each other's CPU time and I/O, which worker processes avoid.
     """
 
-    slack_width = stream_width - raw_crop.width
-    slack_height = stream_height - raw_crop.height
+    def __init__(self):
+        self.stages: List[StageStats] = []
+
+    @contextmanager
+    def measure(self, phase: Phase) -> Iterator[None]:
+        """ Records the time and resources spent in the enclosed block """
+        start = _resource_usage()
+
+        try:
+            yield
+        finally:
+            end = _resource_usage()
+            self.stages.append(StageStats(
+                phase=phase,
+                wall_seconds=end.wall - start.wall,
+                cpu_seconds=end.cpu - start.cpu,
+                bytes_read=end.read - start.read,
+                bytes_written=end.written - start.written
+            ))
+
+    def set_bitrate(self, phase: Phase, paths: List[Path], duration: float | None) -> None:
+        """
+            Attaches the bitrate of the files a phase produced, once their duration is known.
 
-    # less than one percent cropped on each side -> avoid cropping
-    if slack_width * 100 <= stream_width and slack_height * 100 <= stream_height:
-        return Rectangle(width=stream_width, height=stream_height, left=0, top=0)
+            :param phase phase that produced the files
+            :param paths files that were produced
+            :param duration duration of the files in seconds
+        """
+        if not duration or not paths:
+            return
 
-    return raw_crop
+        try:
+            size = sum(os.stat(p).st_size for p in paths)
+        except OSError:
+            return
 
-async def video_properties(path: Path) -> VideoProperties:
-    """
-        Extract the information required for postprocess_picture_in_picture from a video file
+        self.stages = [
+            stage._replace(bitrate=size * 8 / duration) if stage.phase == phase else stage
+            for stage in self.stages
+        ]
 
-        The most involved bit here is the crop detection that figures out what the slide stream
-        can be sensibly cropped to. We use ffmpeg's avfilter plugin for that, which gives us a
-        list of sensible crop dimensions for successive time slices in the video file. We just
-        use the most expansive of these to be on the safe side. We really expect them all to be
-        the same anyway.
+    def log(self, output_path: Path) -> None:
+        """ Logs the measurements as JSON, for the record and for log processors """
+        logger.info("Stage stats of %s: %s", output_path, json.dumps([
+            { **stage._asdict(), 'phase': stage.phase.value } for stage in self.stages
+        ]))
 
-        :params path input video file
-        :returns properties of the input file
+async def concat_chunks(track_path: Path) -> Path:
     """
+        Concatenates the chunk files supplied by the frontend to get the full stream file that
+        we can feed to ffmpeg. If the server already assembled the track while the chunks were
+        being uploaded, that file is used as-is.
 
-    probe_command = [
-        'ffprobe',
-        '-print_format', 'json',
-        '-f', 'lavfi',
-        '-i', f'movie={str(path)},cropdetect',
-        '-show_streams',
-        '-show_entries', 'packet_tags=lavfi.cropdetect.x1,lavfi.cropdetect.y1,'
-                                     'lavfi.cropdetect.x2,lavfi.cropdetect.y2'
-    ]
-
-    logger.info("Analyzing %s...", path)
-    logger.debug("Probe command = %s", probe_command)
-
-    probe_stdout = await _run_command(probe_command)
+        :params track_path directory that contains the input fragments
+        :returns path of the assembled stream file
+    """
+    if (assembled_path := assembled_track(track_path)) is not None:
+        logger.debug("Using %s assembled during upload", assembled_path)
+        return assembled_path
 
-    info = json.loads(probe_stdout)
+    target_path = track_path / ASSEMBLED_FILENAME
 
-    # frontend can only generate files with one video stream
-    video_stream = next(s for s in info['streams'] if s['codec_type'] == 'video')
+    # we're about to overwrite whatever was assembled during upload
+    discard_assembly_state(track_path)
 
-    width = int(video_stream['width'])
-    height = int(video_stream['height'])
+    try:
+        with CONCAT_SECONDS.time():
+            await asyncio.to_thread(_concat_files, target_path, sorted(track_path.glob('chunk.*')))
+    except:
+        target_path.unlink(missing_ok=True)
+        raise
 
-    packets = [ p for p in info['packets'] if 'tags' in p ]
+    CONCAT_BYTES.inc(target_path.stat().st_size)
 
-    crop_left   = min((int(p['tags']['lavfi.cropdetect.x1']) for p in packets), default=0)
-    crop_top    = min((int(p['tags']['lavfi.cropdetect.y1']) for p in packets), default=0)
-    crop_right  = max((int(p['tags']['lavfi.cropdetect.x2']) for p in packets), default=width)
-    crop_bottom = max((int(p['tags']['lavfi.cropdetect.y2']) for p in packets), default=height)
+    return target_path
 
-    logger.debug('%s: size=%dx%d, crop=%d,%d-%d,%d',
-                 path, width, height, crop_left, crop_top, crop_right, crop_bottom)
+def _concat_files(target_path: Path, chunk_paths: List[Path]) -> None:
+    dest_fd = os.open(target_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC)
 
-    crop = determine_crop_area(
-        stream_width = width,
-        stream_height = height,
-        raw_crop = Rectangle(
-            width = crop_right - crop_left + 1,
-            height = crop_bottom - crop_top + 1,
-            left = crop_left,
-            top = crop_top
-        )
-    )
+    try:
+        for src_path in chunk_paths:
+            append_file(dest_fd, src_path)
+    finally:
+        os.close(dest_fd)
 
-    return VideoProperties(
-        width = width,
-        height = height,
-        crop = crop
-    )
+def _feed_pipe(fifo_path: Path, chunk_paths: List[Path]) -> None:
+    try:
+        _concat_files(fifo_path, chunk_paths)
+    except BrokenPipeError:
+        logger.debug("Reader of %s went away before the end of the track", fifo_path)
 
-async def concat_chunks(track_path: Path) -> Path:
+@asynccontextmanager
+async def chunk_pipe(track_path: Path) -> AsyncIterator[Path]:
     """
-        Concatenates the chunk files supplied by the frontend to get the full stream file that
-        we can feed to ffmpeg.
+        Provides the chunks of a track as one continuous stream through a named pipe, so that
+        ffmpeg can read the track without a concatenated copy of it on disk. The pipe can be
+        read only once, and readers can't seek in it.
 
-        :params track_path directory that contains the input fragments
-        :returns path of the assembled stream file
+        :param track_path directory that contains the input fragments
+        :returns path of the named pipe, valid until the context is left
     """
-    target_path = track_path / "full.webm"
+    chunk_paths = sorted(track_path.glob('chunk.*'))
 
-    try:
-        async with aiofiles.open(target_path, 'wb') as dest:
-            for src_path in sorted(track_path.glob('chunk.*')):
-                async with aiofiles.open(src_path, 'rb') as src:
-                    while content := await src.read(512 * 1024):
-                        await dest.write(content)
-    except:
-        target_path.unlink(missing_ok=True)
-        raise
+    with tempfile.TemporaryDirectory(prefix='ise-record-') as tempdir:
+        fifo_path = Path(tempdir) / 'track.webm'
+        os.mkfifo(fifo_path)
 
-    return target_path
+        # blocking writes to a pipe, so this runs in a thread
+        writer = asyncio.ensure_future(asyncio.to_thread(_feed_pipe, fifo_path, chunk_paths))
+
+        try:
+            yield fifo_path
+        finally:
+            while not writer.done():
+                # The writer is stuck if nobody ever opened the pipe or the reader stopped early.
+                # Opening and closing the read end unblocks it: open() returns, and further
+                # writes fail with a broken pipe.
+                fd = os.open(fifo_path, os.O_RDONLY | os.O_NONBLOCK)
+                os.close(fd)
+                await asyncio.wait([ writer ], timeout=0.1)
+
+            await writer
 
 def pick_target_geometry(content: Rectangle) -> Tuple[int, int]:
     """
@@ -244,14 +293,46 @@ def generate_overlay_scale(crop: Rectangle, outer_width: int, outer_height: int)
 
     return scale_filter
 
-def generate_ffmpeg_filter(stream: VideoProperties, has_overlay: bool) -> str:
+def rendition_heights(stream: VideoProperties, renditions: Sequence[int]) -> List[int]:
+    """
+        Picks the renditions that make sense for a main stream, i.e. those that are smaller than
+        the output geometry.
+
+        :param stream properties of the main video stream
+        :param renditions desired heights of additional renditions
+        :returns the heights of the renditions to generate, largest first
+    """
+    _, outer_height = pick_target_geometry(stream.crop)
+    return sorted({ h for h in renditions if 0 < h < outer_height }, reverse=True)
+
+def _split_renditions(filter_graph: str, heights: List[int]) -> str:
+    # one decode and composition, then one scaler per rendition. The outputs are labeled [v]
+    # and [v<height>].
+    outputs = ''.join(f'[s{h}]' for h in heights)
+    scalers = ''.join(f';[s{h}]scale=-2:{h}[v{h}]' for h in heights)
+
+    return f'{filter_graph},split={len(heights) + 1}[v]{outputs}{scalers}'
+
+def generate_ffmpeg_filter(
+        stream: VideoProperties,
+        has_overlay: bool,
+        renditions: Sequence[int] = ()
+) -> str:
     """
         Assembles the picture-in-picture rendering filter for ffmpeg
 
         :param stream properties of the main video stream
         :param has_overlay whether there is an overlay stream
+        :param renditions heights of additional, smaller renditions. If there are any, the outputs
+                          of the filter are labeled [v] for the full-size video and [v<height>]
+                          for the renditions.
         :return ffmpeg filter for use with -filter_complex
     """
+    heights = rendition_heights(stream, renditions)
+
+    if heights:
+        return _split_renditions(generate_ffmpeg_filter(stream, has_overlay), heights)
+
     outer_width, outer_height = pick_target_geometry(stream.crop)
 
     # crop if the main stream is something like 4:3 slides captured on a 16:9 screen (or vice versa)
@@ -271,21 +352,319 @@ def generate_ffmpeg_filter(stream: VideoProperties, has_overlay: bool) -> str:
     )
 
     if not has_overlay:
-        return f'[0:v]{crop_filter}{scale_filter},fps=30'
+        return f'[0:v]{crop_filter}{scale_filter},fps={OUTPUT_FPS}'
 
     overlay_scale = generate_overlay_scale(stream.crop, outer_width, outer_height)
 
-    stream_filter = f'[0:v]{crop_filter}{scale_filter},fps=30[main]'
+    stream_filter = f'[0:v]{crop_filter}{scale_filter},fps={OUTPUT_FPS}[main]'
     overlay_filter = f'[1:v]{overlay_scale}[overlay]'
     combine_filter = '[main][overlay]overlay=(main_w-overlay_w):0'
 
     return f'{stream_filter};{overlay_filter};{combine_filter}'
 
-async def postprocess_tracks(
+def can_stream_copy(stream: VideoProperties, has_overlay: bool) -> bool:
+    """
+        Checks whether the main stream can be used as-is, i.e. whether the rendering filter would
+        do nothing but re-encode it.
+
+        :param stream properties of the main video stream
+        :param has_overlay whether there is an overlay stream
+        :returns True if the main stream needs no cropping, scaling or overlay
+    """
+    return (
+        not has_overlay
+        and not stream.needs_cropping()
+        and (stream.width, stream.height) == pick_target_geometry(stream.crop)
+    )
+
+class _TrackInputs:
+    """
+        Provides the tracks of a recording as ffmpeg inputs and removes the temporary files when
+        the context is left. Concatenating tracks and probing the stream are independent, so
+        tracks are concatenated in the background, with a cap so that a recording with many
+        audio tracks doesn't thrash the disk.
+    """
+
+    def __init__(self, io_concurrency: int, pipe_chunks: bool):
+        """
+            :param io_concurrency number of tracks to concatenate at once
+            :param pipe_chunks whether tracks without a complete assembled file are piped
+        """
+        self._io_slots = asyncio.Semaphore(io_concurrency)
+        self._pipe_chunks = pipe_chunks
+        self._pipes = AsyncExitStack()
+        self._pending: List[asyncio.Task[Path]] = []
+        self.piped: Set[Path] = set()
+
+    async def __aenter__(self) -> '_TrackInputs':
+        await self._pipes.__aenter__()
+        return self
+
+    async def __aexit__(self, *exc_info) -> bool | None:
+        try:
+            return await self._pipes.__aexit__(*exc_info)
+        finally:
+            # on failure, some tracks may still be in the works
+            for task in self._pending:
+                task.cancel()
+
+            track_inputs = await asyncio.gather(*self._pending, return_exceptions=True)
+
+            # unlink temporaries to save disk space and limit the number of expected states
+            for p in track_inputs:
+                if isinstance(p, Path) and p not in self.piped:
+                    p.unlink()
+
+    async def get(self, track_dir: Path) -> Path:
+        """ Provides a track as a file or a named pipe, the latter can be read only once """
+        # without a complete assembled file, piping the chunks saves writing a concatenated copy
+        if self._pipe_chunks and assembled_track(track_dir) is None:
+            fifo_path = await self._pipes.enter_async_context(chunk_pipe(track_dir))
+            self.piped.add(fifo_path)
+            return fifo_path
+
+        async with self._io_slots:
+            return await concat_chunks(track_dir)
+
+    def start(self, track_dir: Path) -> asyncio.Task[Path]:
+        """ Starts providing a track in the background, see get """
+        task = asyncio.create_task(self.get(track_dir))
+        self._pending.append(task)
+        return task
+
+async def _probe_stream(
+        inputs: _TrackInputs,
+        stream_dir: Path,
+        stream_input: Path,
+        options: PostprocessingOptions
+) -> Tuple[VideoProperties, Path]:
+    # returns the input to render from, too, which is a new one if the probe used it up
+    if stream_input in inputs.piped:
+        # pipes can't seek, so sampling is not an option, and the probe uses up the pipe
+        stream_props = await video_properties(stream_input, 0, options.crop_detect_frames)
+        return stream_props, await inputs.get(stream_dir)
+
+    # decoding rather than disk-bound, so the probe doesn't take an I/O slot
+    stream_props = await video_properties(
+        stream_input,
+        options.crop_detect_samples,
+        options.crop_detect_frames
+    )
+    return stream_props, stream_input
+
+def _render_command(
+        render: VideoRender,
+        audio_inputs: List[Path],
+        stream_copy: bool,
+        output_path: Path
+) -> List[str]:
+    # all renditions come out of the same decode and composition
+    encoder = render.options.encoder
+
+    if stream_copy:
+        video_maps = [ '-map', '0:v' ]
+        codec_args = [ '-c', 'copy' ]
+    else:
+        video_maps = [ '-filter_complex', render.filter_graph ]
+        video_maps += [ '-map', '[v]' ] if render.heights else []
+        codec_args = video_args(render.options) + encoder.audio
+
+    audio_maps = [ '-map', '0:a?' ] + [
+        arg for i in range(len(render.video_inputs), len(render.video_inputs) + len(audio_inputs))
+        for arg in [ '-map', f'{i}:a' ]
+    ]
+
+    return [
+        'ffmpeg'
+    ] + [
+        arg for path in render.video_inputs + audio_inputs for arg in [ '-i', str(path) ]
+    ] + video_maps + audio_maps + codec_args + list(encoder.muxer) + [
+        '-progress', 'pipe:1',
+        '-nostats',
+        '-y', str(output_path)
+    ] + [
+        arg for h in render.heights for arg in [
+            '-map', f'[v{h}]', *audio_maps, *codec_args, *encoder.muxer,
+            '-y', str(rendition_path(output_path, f'{h}p'))
+        ]
+    ] + (
+        audio_rendition_args(audio_maps, output_path, render.options)
+        if render.options.audio_rendition else []
+    )
+
+class _RenderJob(NamedTuple):
+    output_path: Path
+    options: PostprocessingOptions
+    report: ProgressCallback
+    meter: StageMeter
+    segmented: bool
+
+def _renders_in_segments(output_path: Path, options: PostprocessingOptions) -> bool:
+    # segments that were rendered before (live, or by an interrupted run of this job) are picked
+    # up, too
+    manifest = read_segment_manifest(segment_dir_for(output_path))
+    return (
+        options.render_segments > 1
+        or options.checkpoint_seconds > 0
+        or (manifest is not None and bool(manifest.segments))
+    )
+
+async def _render(
+        job: _RenderJob,
+        stream_props: VideoProperties,
+        video_inputs: List[Path],
+        audio_inputs: List[Path]
+) -> List[Path]:
+    # returns the files written, the streaming manifest being the last one if there is one
+    has_overlay = len(video_inputs) > 1
+    heights = rendition_heights(stream_props, job.options.renditions)
+
+    # the chunks are WebM, so remuxing only yields the profile's container if that is WebM.
+    # Smaller renditions need the decoded picture anyway, and streaming needs keyframes at
+    # the segment length (and HLS can't carry the recorded VP8 in its fragmented MP4).
+    stream_copy = (
+        job.options.stream_copy
+        and not heights
+        and job.options.streaming_format is None
+        and job.options.encoder.container == 'webm'
+        and can_stream_copy(stream_props, has_overlay)
+    )
+    render = VideoRender(
+        video_inputs=video_inputs,
+        filter_graph=generate_ffmpeg_filter(stream_props, has_overlay, heights),
+        heights=heights,
+        options=job.options
+    )
+
+    if stream_copy:
+        logger.info("Main stream needs no processing, remuxing instead of re-encoding")
+
+    with RENDER_SECONDS.time_outcome(), job.meter.measure(Phase.RENDER):
+        if job.segmented and stream_props.duration and not stream_copy:
+            await render_in_segments(
+                render,
+                # the main stream carries audio, too
+                video_inputs[:1] + audio_inputs,
+                stream_props.duration,
+                job.output_path,
+                job.report
+            )
+        else:
+            render_command = _render_command(render, audio_inputs, stream_copy, job.output_path)
+
+            logger.info("Rendering %s...", job.output_path)
+            logger.debug("Render command = %s", render_command)
+
+            job.report(Progress(phase=Phase.RENDER, percent=0.0))
+            await run_command(
+                render_command,
+                FfmpegProgressParser(stream_props.duration, job.report)
+            )
+
+    outputs = [ job.output_path ] + [
+        rendition_path(job.output_path, f'{h}p') for h in heights
+    ]
+
+    if job.options.audio_rendition:
+        outputs.append(rendition_path(job.output_path, 'audio'))
+
+    if job.options.streaming_format is not None:
+        with job.meter.measure(Phase.PACKAGE):
+            outputs.append(await package_for_streaming(
+                outputs[:len(heights) + 1],
+                job.options.streaming_format,
+                job.output_path,
+                stream_props.duration,
+                job.report
+            ))
+
+    return outputs
+
+async def _render_tracks(
+        job: _RenderJob,
+        inputs: _TrackInputs,
+        video_dirs: List[Path],
+        audio_dirs: List[Path],
+        stream_props: VideoProperties | None
+) -> List[Path]:
+    job.report(Progress(phase=Phase.CONCAT))
+
+    with job.meter.measure(Phase.CONCAT):
+        video_tasks = [ inputs.start(d) for d in video_dirs ]
+        audio_tasks = [ inputs.start(d) for d in audio_dirs ]
+
+        stream_input = await video_tasks[0]
+
+    job.report(Progress(phase=Phase.PROBE))
+
+    # the other tracks are still being concatenated while the main stream is probed, which is
+    # charged to the probe
+    with job.meter.measure(Phase.PROBE):
+        if stream_props is not None:
+            logger.info("Using crop detection results gathered during upload")
+        else:
+            stream_props, stream_input = await _probe_stream(
+                inputs,
+                video_dirs[0],
+                stream_input,
+                job.options
+            )
+
+    # render inputs keep their order, no matter which track was ready first
+    video_inputs = [ stream_input ] + [ await task for task in video_tasks[1:] ]
+    audio_inputs = [ await task for task in audio_tasks ]
+
+    outputs = await _render(job, stream_props, video_inputs, audio_inputs)
+
+    job.meter.set_bitrate(
+        Phase.CONCAT,
+        [ p for p in video_inputs + audio_inputs if p not in inputs.piped ],
+        stream_props.duration
+    )
+    job.meter.set_bitrate(Phase.RENDER, [ job.output_path ], stream_props.duration)
+
+    return outputs
+
+# bump when the pipeline changes in a way that the settings don't reflect, to invalidate the cache
+_RENDER_CACHE_VERSION = 1
+
+def _render_cache_key(
+        video_dirs: List[Path],
+        audio_dirs: List[Path],
+        stream_props: VideoProperties | None,
+        options: PostprocessingOptions
+) -> str:
+    # the crop area and filter graph are a function of the inputs and crop detection settings,
+    # they are part of the key if crop detection ran during upload and they're known in advance
+    filter_graph = generate_ffmpeg_filter(
+        stream_props,
+        len(video_dirs) > 1,
+        rendition_heights(stream_props, options.renditions)
+    ) if stream_props is not None else None
+
+    # performance tunables like render_segments don't change the result
+    return render_cache_key(
+        _RENDER_CACHE_VERSION,
+        [ track_fingerprint(d) for d in video_dirs + audio_dirs ],
+        stream_props,
+        filter_graph,
+        options.encoder,
+        options.crop_detect_samples,
+        options.crop_detect_frames,
+        options.use_crop_cache,
+        options.stream_copy,
+        options.renditions,
+        options.audio_rendition,
+        options.streaming_format
+    )
+
+async def postprocess_tracks( # pylint: disable=too-many-arguments,too-many-positional-arguments
         stream_dir: Path,
         overlay_dir: Path,
         audio_dirs: List[Path],
-        output_path: Path
+        output_path: Path,
+        progress: ProgressCallback | None = None,
+        options: PostprocessingOptions = PostprocessingOptions()
 ) -> Result:
     """
         Render the (first) camera stream as an overlay onto the (first) display stream.
@@ -301,59 +680,77 @@ async def postprocess_tracks(
         :param overlay_dir path of the overlay video stream (usually the speaker)
         :param audio_dirs paths of additional audio streams, if available
         :param output_path where to write the result
+        :param progress receives progress reports while the job is running
+        :param options tunables of the pipeline
         :returns whether the job succeeded, plus info for the e-mail report
     """
 
-    inputs: list[Path] = []
+    def report(update: Progress) -> None:
+        if progress is not None:
+            progress(update)
 
     has_overlay = overlay_dir.is_dir()
     logger.debug("Recording %s an overlay track", "has" if has_overlay else "doesn't have")
 
-    try:
-        inputs.append(await concat_chunks(stream_dir))
-        stream_props = await video_properties(inputs[0])
-
-        ffmpeg_maps = [
-            '-filter_complex', generate_ffmpeg_filter(stream_props, has_overlay),
-            '-map', '0:a?'
-        ]
-
-        if has_overlay:
-            inputs.append(await concat_chunks(overlay_dir))
+    video_dirs = [ stream_dir, overlay_dir ] if has_overlay else [ stream_dir ]
+    cached_props = cached_video_properties(stream_dir) if options.use_crop_cache else None
+    cache_key = _render_cache_key(
+        video_dirs,
+        audio_dirs,
+        cached_props,
+        options
+    ) if options.use_render_cache else None
+
+    if cache_key is not None and is_cached(output_path, cache_key):
+        logger.info("%s is up to date, nothing to do", output_path)
+        return Result(output_file=output_path, reason=ResultReason.SUCCESS)
 
-        for audio_dir in audio_dirs:
-            ffmpeg_maps.extend([ '-map', f'{len(inputs)}:a' ])
-            inputs.append(await concat_chunks(audio_dir))
+    # the files are about to be overwritten
+    discard_cache_entry(output_path)
 
-        render_command = [
-            'ffmpeg'
-        ] + [
-            arg for path in inputs for arg in [ '-i', str(path) ]
-        ] + ffmpeg_maps + [
-            '-y', str(output_path)
-        ]
+    job = _RenderJob(
+        output_path=output_path,
+        options=options,
+        report=report,
+        meter=StageMeter(),
+        segmented=_renders_in_segments(output_path, options)
+    )
 
-        logger.info("Rendering %s...", output_path)
-        logger.debug("Render command = %s", render_command)
+    try:
+        # segments are rendered by processes that seek in the inputs, which pipes don't allow
+        async with _TrackInputs(
+            options.io_concurrency,
+            options.pipe_chunks and not job.segmented
+        ) as inputs:
+            outputs = await _render_tracks(job, inputs, video_dirs, audio_dirs, cached_props)
 
-        await _run_command(render_command)
+        if cache_key is not None:
+            store_cache_entry(output_path, cache_key, outputs)
 
         logger.info("Render completed")
+        job.meter.log(output_path)
 
-        return Result(output_file=output_path, reason=ResultReason.SUCCESS)
+        return Result(
+            output_file=output_path,
+            reason=ResultReason.SUCCESS,
+            stages=tuple(job.meter.stages)
+        )
     except CalledProcessError as err:
-        _log_error(err)
-        return Result(output_file=None, reason=ResultReason.FAILURE)
-    finally:
-        # unlink temporaries to save disk space and limit the number of expected states
-        for p in inputs:
-            p.unlink()
-
-async def postprocess_recording(recording_path: Path) -> Result:
+        log_error(err)
+        job.meter.log(output_path)
+        return Result(output_file=None, reason=ResultReason.FAILURE, stages=tuple(job.meter.stages))
+
+async def postprocess_recording(
+        recording_path: Path,
+        progress: ProgressCallback | None = None,
+        options: PostprocessingOptions = PostprocessingOptions()
+) -> Result:
     """
         Postprocess the chunks of a recording. Output will be written to recording_path
 
         :param recording_path directory that contains the input streams in chunks
+        :param progress receives progress reports while the job is running
+        :param options tunables of the pipeline
         :returns whether postprocessing succeeded and path of the result file
     """
 
@@ -364,11 +761,13 @@ async def postprocess_recording(recording_path: Path) -> Result:
     stream_dir = recording_path / "stream"
     overlay_dir = recording_path / "overlay"
     audio_dirs = sorted(recording_path.glob('audio-*'))
-    output_path = recording_path / 'presentation.webm'
+    output_path = output_path_for(recording_path, options)
 
     if not stream_dir.is_dir():
         logger.info("%s has no main display stream, nothing to do.", recording_path)
         return Result(output_file=None, reason=ResultReason.MAIN_STREAM_MISSING)
 
     logger.info("Postprocessing %s", recording_path)
-    return await postprocess_tracks(stream_dir, overlay_dir, audio_dirs, output_path)
+    return await postprocess_tracks(
+        stream_dir, overlay_dir, audio_dirs, output_path, progress, options
+    )
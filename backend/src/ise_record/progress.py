@@ -0,0 +1,89 @@
+"""
+    ISE-Recorder progress reporting. Phases of a postprocessing job and the progress reports
+    ffmpeg's -progress output is turned into while a job runs.
+"""
+
+from enum import Enum
+from typing import Callable, Dict, NamedTuple
+
+class Phase(Enum):
+    """ Phase of a running postprocessing job """
+    CONCAT = "concat"
+    PROBE = "probe"
+    RENDER = "render"
+    MUX = "mux"
+    PACKAGE = "package"
+
+class Progress(NamedTuple):
+    """ Progress report of a running postprocessing job """
+    phase: Phase
+    percent: float | None = None
+    fps: float | None = None
+    speed: float | None = None
+    eta: float | None = None
+
+ProgressCallback = Callable[[Progress], None]
+
+class FfmpegProgressParser: # pylint: disable=too-few-public-methods
+    """
+        Consumes the output of ffmpeg's -progress option line by line and turns each completed
+        block into a progress report.
+    """
+
+    def __init__(
+            self,
+            duration: float | None,
+            callback: ProgressCallback,
+            phase: Phase = Phase.RENDER
+    ):
+        """
+            :param duration expected duration of the output in seconds, if known
+            :param callback receives a progress report for every block ffmpeg emits
+            :param phase job phase to report
+        """
+        self._duration = duration
+        self._callback = callback
+        self._phase = phase
+        self._values: Dict[str, str] = {}
+
+    def _float(self, key: str, suffix: str = '') -> float | None:
+        try:
+            return float(self._values.get(key, '').removesuffix(suffix))
+        except ValueError:
+            # ffmpeg writes N/A until it knows a value
+            return None
+
+    def __call__(self, line: bytes) -> None:
+        key, sep, value = line.decode(errors='replace').strip().partition('=')
+
+        if not sep:
+            return
+
+        self._values[key] = value
+
+        if key != 'progress':
+            return
+
+        out_time_us = self._float('out_time_us')
+        speed = self._float('speed', 'x')
+        percent = None
+        eta = None
+
+        if self._duration and out_time_us is not None:
+            out_time = out_time_us / 1_000_000
+            percent = min(100.0, max(0.0, out_time * 100 / self._duration))
+
+            if speed:
+                eta = max(0.0, self._duration - out_time) / speed
+
+        if value == 'end':
+            percent, eta = 100.0, 0.0
+
+        self._callback(Progress(
+            phase=self._phase,
+            percent=percent,
+            fps=self._float('fps'),
+            speed=speed,
+            eta=eta
+        ))
+        self._values = {}
@@ -0,0 +1,118 @@
+"""
+    ISE-Recorder render cache. Remembers what the rendered files of a recording were made from, so
+    that rendering a recording again with unchanged inputs and settings, e.g. in a bulk re-render
+    after a configuration change, can be skipped.
+"""
+
+from contextlib import suppress
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Any, List, NamedTuple
+
+from .assembly import chunk_index
+from .fileutil import write_atomically
+
+logger = logging.getLogger(__name__)
+
+class RenderCacheEntry(NamedTuple):
+    """ Key of a completed render and the files it produced, relative to the output directory """
+    key: str
+    outputs: List[str]
+
+def track_fingerprint(track_path: Path) -> List[Any]:
+    """
+        Describes the chunks of a track by name, size and modification time, which is a lot
+        cheaper than hashing their content and good enough for files that are written once.
+
+        :param track_path directory that contains the chunks
+        :returns a JSON-serializable description
+    """
+    try:
+        names = os.listdir(track_path)
+    except FileNotFoundError:
+        names = []
+
+    fingerprint: List[Any] = [ track_path.name ]
+
+    for name in sorted(names):
+        if chunk_index(Path(name)) is not None:
+            stat = (track_path / name).stat()
+            fingerprint.append([ name, stat.st_size, stat.st_mtime_ns ])
+
+    return fingerprint
+
+def render_cache_key(*parts: Any) -> str:
+    """
+        Combines everything a render depends on into a key.
+
+        :param parts JSON-serializable inputs and settings of the render
+        :returns a hex digest
+    """
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode('utf-8')).hexdigest()
+
+def cache_path_for(output_path: Path) -> Path:
+    """ Path of the cache entry that describes a rendered presentation """
+    return output_path.with_name(f'.{output_path.name}.cache.json')
+
+def read_cache_entry(output_path: Path) -> RenderCacheEntry | None:
+    """
+        Reads the cache entry of a rendered presentation.
+
+        :param output_path path of the rendered presentation
+        :returns the entry, or None if there is none or it can't be read
+    """
+    try:
+        with open(cache_path_for(output_path), 'r', encoding='utf-8') as entry_file:
+            raw = json.load(entry_file)
+
+        return RenderCacheEntry(key=str(raw['key']), outputs=[ str(o) for o in raw['outputs'] ])
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+def is_cached(output_path: Path, key: str) -> bool:
+    """
+        Checks whether a presentation was rendered with the given key and all of its files are
+        still there.
+
+        :param output_path path of the rendered presentation
+        :param key key of the render that is about to start
+        :returns True if the render can be skipped
+    """
+    entry = read_cache_entry(output_path)
+
+    return (
+        entry is not None
+        and entry.key == key
+        and all((output_path.parent / name).is_file() for name in entry.outputs)
+    )
+
+def store_cache_entry(output_path: Path, key: str, outputs: List[Path]) -> None:
+    """
+        Records a completed render. Failing to do so only costs a render later, so errors are
+        logged, not raised.
+
+        :param output_path path of the rendered presentation
+        :param key key of the render
+        :param outputs all files the render produced
+    """
+    entry = RenderCacheEntry(
+        key=key,
+        outputs=[ str(p.relative_to(output_path.parent)) for p in outputs ]
+    )
+
+    try:
+        write_atomically(cache_path_for(output_path), json.dumps(entry._asdict()))
+    except OSError as ex:
+        logger.warning("Could not record render of %s in the cache: %s", output_path, ex)
+
+def discard_cache_entry(output_path: Path) -> None:
+    """
+        Forgets about a render, e.g. because its files are about to be overwritten.
+
+        :param output_path path of the rendered presentation
+    """
+    with suppress(FileNotFoundError):
+        os.unlink(cache_path_for(output_path))
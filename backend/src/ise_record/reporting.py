@@ -11,7 +11,8 @@ from typing import NamedTuple, List
 import aiosmtplib
 from email_validator import validate_email, EmailNotValidError
 
-from .postprocess import Result, ResultReason
+from .metrics import REPORTS
+from .postprocess import Result, ResultReason, StageStats
 
 logger = logging.getLogger(__name__)
 
@@ -58,6 +59,18 @@ def normalize_recipient(address: str | None, domain_whitelist: List[str]) -> str
 
     return None
 
+def _format_stage(stage: StageStats) -> str:
+    mib = 1024 * 1024
+    line = (
+        f'{stage.phase.value}: {stage.wall_seconds:.1f} s, CPU {stage.cpu_seconds:.1f} s, '
+        f'read {stage.bytes_read / mib:.1f} MiB, written {stage.bytes_written / mib:.1f} MiB'
+    )
+
+    if stage.bitrate is not None:
+        line += f', {stage.bitrate / 1000:.0f} kbit/s'
+
+    return line
+
 def generate_report(
         sender: str | None,
         recipient: str | None,
@@ -97,6 +110,9 @@ def generate_report(
             reason=message
         )
 
+    if result.stages:
+        content += '\nstages:\n' + ''.join(f'  {_format_stage(s)}\n' for s in result.stages)
+
     msg = EmailMessage()
 
     msg["From"] = sender
@@ -129,9 +145,11 @@ async def send_report(
 
     if smtp_sink.server is None or sender is None:
         logger.debug("Not sending report: incomplete SMTP configuration.")
+        REPORTS.inc(result='skipped')
         return
     if recipient is None or recipient.strip() == "":
         logger.info("Not sending report: no recipient specified.")
+        REPORTS.inc(result='skipped')
         return
 
     logger.info("Sending report, result = %s", result.reason.name)
@@ -148,5 +166,7 @@ async def send_report(
             username = smtp_sink.username,
             password = smtp_sink.password
         )
+        REPORTS.inc(result='sent')
     except aiosmtplib.errors.SMTPException as ex:
         logger.warning("Unable to send message: %s", ex.message)
+        REPORTS.inc(result='failed')
@@ -0,0 +1,488 @@
+"""
+    ISE-Recorder segmented rendering. Splits the video timeline of a render into segments that
+    are encoded concurrently and joined afterwards. Rendered segments are kept on disk with a
+    manifest, so an interrupted render, or one that had segments rendered live during the
+    lecture, only encodes what is still missing.
+"""
+
+import asyncio
+import bisect
+from contextlib import asynccontextmanager
+import fcntl
+import json
+import logging
+import math
+import os
+from pathlib import Path
+import shutil
+from typing import AsyncIterator, Awaitable, List, NamedTuple, Tuple, TypeVar
+
+from .ffmpeg import keyframe_times, run_command
+from .fileutil import write_atomically
+from .options import audio_rendition_args, PostprocessingOptions, rendition_path, video_args
+from .progress import FfmpegProgressParser, Phase, Progress, ProgressCallback
+
+logger = logging.getLogger(__name__)
+
+# shorter segments aren't worth an extra encoder process
+MIN_SEGMENT_SECONDS = 30.0
+
+SEGMENT_MANIFEST_FILENAME = 'manifest.json'
+
+T = TypeVar('T')
+
+class VideoRender(NamedTuple):
+    """ How the video tracks of a recording are rendered, the same for each of its segments """
+    video_inputs: List[Path]
+    filter_graph: str
+    heights: List[int]
+    options: PostprocessingOptions
+
+class RenderedSegment(NamedTuple):
+    """ A rendered piece of the video timeline """
+    start: float
+    length: float
+    filename: str
+
+class SegmentManifest(NamedTuple):
+    """ Bookkeeping of the segments rendered for an output file """
+    render_key: str
+    segments: List[RenderedSegment]
+
+def segment_starts(duration: float, segments: int, keyframes: List[float]) -> List[float]:
+    """
+        Splits a timeline into roughly equal segments for parallel rendering. Split points are
+        moved to a nearby keyframe of the input if there is one, so that the renderers don't have
+        to decode frames before their segment just to get to its start.
+
+        :param duration length of the timeline in seconds
+        :param segments desired number of segments
+        :param keyframes keyframe times of the input in ascending order
+        :returns start times of the segments, the first one being 0
+    """
+    length = duration / segments
+    starts = [ 0.0 ]
+
+    for i in range(1, segments):
+        ideal = i * length
+        start = ideal
+
+        pos = bisect.bisect_left(keyframes, ideal)
+        nearby = [ keyframes[j] for j in (pos - 1, pos) if 0 <= j < len(keyframes) ]
+
+        if nearby:
+            nearest = min(nearby, key=lambda t, ideal=ideal: abs(t - ideal))
+            if abs(nearest - ideal) <= length / 4:
+                start = nearest
+
+        if start > starts[-1]:
+            starts.append(start)
+
+    return starts
+
+def _segmented_progress(
+        lengths: List[float],
+        callback: ProgressCallback
+) -> List[ProgressCallback]:
+    # combines the progress reports of concurrently rendered segments, one callback per segment
+    done = [ 0.0 ] * len(lengths)
+    fps = [ 0.0 ] * len(lengths)
+    speeds = [ 0.0 ] * len(lengths)
+    total = sum(lengths)
+
+    def segment(index: int) -> ProgressCallback:
+        def update(progress: Progress) -> None:
+            finished = progress.percent == 100.0
+
+            if progress.percent is not None:
+                done[index] = lengths[index] * progress.percent / 100
+
+            # finished renderers no longer contribute to the throughput
+            fps[index] = 0.0 if finished else progress.fps or 0.0
+            speeds[index] = 0.0 if finished else progress.speed or 0.0
+
+            speed = sum(speeds)
+
+            callback(Progress(
+                phase=Phase.RENDER,
+                percent=min(100.0, sum(done) * 100 / total) if total > 0 else None,
+                fps=sum(fps),
+                speed=speed,
+                eta=max(0.0, total - sum(done)) / speed if speed > 0 else None
+            ))
+
+        return update
+
+    return [ segment(i) for i in range(len(lengths)) ]
+
+def segment_command(
+        render: VideoRender,
+        start: float,
+        length: float | None,
+        output_path: Path
+) -> List[str]:
+    """
+        Assembles the ffmpeg command that renders one segment of the video timeline, without
+        audio.
+
+        :param render video inputs and how they are rendered
+        :param start start of the segment in seconds
+        :param length length of the segment in seconds, None to render to the end
+        :param output_path where to write the segment, renditions are written next to it
+        :returns the ffmpeg command
+    """
+    seek = [ '-ss', f'{start:.3f}' ] + ([ '-t', f'{length:.3f}' ] if length is not None else [])
+    encoder_args = video_args(render.options)
+
+    return [
+        'ffmpeg'
+    ] + [
+        arg for path in render.video_inputs for arg in seek + [ '-i', str(path) ]
+    ] + [
+        '-filter_complex', render.filter_graph
+    ] + ([ '-map', '[v]' ] if render.heights else []) + [
+        '-an'
+    ] + encoder_args + [
+        '-progress', 'pipe:1',
+        '-nostats',
+        '-y', str(output_path)
+    ] + [
+        arg for h in render.heights for arg in [
+            '-map', f'[v{h}]', '-an', *encoder_args,
+            '-y', str(rendition_path(output_path, f'{h}p'))
+        ]
+    ]
+
+async def _gather_or_cancel(*aws: Awaitable[T]) -> List[T]:
+    # like gather, but doesn't leave the other renderers running when one of them fails
+    tasks = [ asyncio.ensure_future(aw) for aw in aws ]
+
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+def segment_dir_for(output_path: Path) -> Path:
+    """ Directory that keeps the rendered segments of an output file """
+    return output_path.with_name(f'.{output_path.name}.segments')
+
+def render_key(filter_graph: str, options: PostprocessingOptions) -> str:
+    """
+        Identifies the settings segments were rendered with. Segments only fit together if they
+        were rendered with the same filter graph and encoder settings.
+
+        :param filter_graph ffmpeg filter graph of the render
+        :param options pipeline tunables with the encoder settings
+        :returns an opaque key
+    """
+    return json.dumps([
+        filter_graph,
+        options.encoder.container,
+        video_args(options)
+    ])
+
+def read_segment_manifest(segment_dir: Path) -> SegmentManifest | None:
+    """
+        Reads the list of rendered segments.
+
+        :param segment_dir directory that keeps the segments
+        :returns the manifest, or None if there is none
+    """
+    try:
+        with open(segment_dir / SEGMENT_MANIFEST_FILENAME, encoding='utf-8') as manifest_file:
+            raw = json.load(manifest_file)
+
+        return SegmentManifest(
+            render_key=str(raw['render_key']),
+            segments=[
+                RenderedSegment(start=float(start), length=float(length), filename=str(filename))
+                for start, length, filename in raw['segments']
+            ]
+        )
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+def _write_segment_manifest(segment_dir: Path, manifest: SegmentManifest) -> None:
+    write_atomically(segment_dir / SEGMENT_MANIFEST_FILENAME, json.dumps(manifest._asdict()))
+
+def usable_segments(segment_dir: Path, key: str) -> List[RenderedSegment]:
+    """
+        Finds the segments that were rendered with the given settings and are still there. They
+        needn't continue each other, concurrent renderers finish in any order. Everything else in
+        the directory is removed.
+
+        :param segment_dir directory that keeps the segments
+        :param key render key of the current settings, see render_key
+        :returns the usable segments in order of their start
+    """
+    manifest = read_segment_manifest(segment_dir)
+    usable: List[RenderedSegment] = []
+
+    if manifest is not None and manifest.render_key == key:
+        end = 0.0
+
+        for segment in sorted(manifest.segments, key=lambda s: s.start):
+            if segment.start < end - 0.001 or not (segment_dir / segment.filename).is_file():
+                continue
+
+            usable.append(segment)
+            end = segment.start + segment.length
+
+    keep = { SEGMENT_MANIFEST_FILENAME, '.lock' } | { s.filename for s in usable }
+    # renditions of a segment are named like it, with the rendition inserted before the suffix
+    kept_stems = { Path(s.filename).stem for s in usable }
+
+    for path in segment_dir.iterdir():
+        if path.name not in keep and '.'.join(path.name.split('.')[:2]) not in kept_stems:
+            path.unlink(missing_ok=True)
+
+    _write_segment_manifest(segment_dir, SegmentManifest(render_key=key, segments=usable))
+
+    return usable
+
+def record_segment(segment_dir: Path, segment: RenderedSegment) -> None:
+    """ Adds a completely rendered segment to the manifest, see usable_segments """
+    manifest = read_segment_manifest(segment_dir)
+    assert manifest is not None
+    _write_segment_manifest(
+        segment_dir,
+        manifest._replace(segments=manifest.segments + [ segment ])
+    )
+
+@asynccontextmanager
+async def locked_segment_dir(segment_dir: Path, wait: bool = True) -> AsyncIterator[bool]:
+    """
+        Locks the segments of an output file. Live rendering and the final render may run in
+        different processes, so this lock works across processes.
+
+        :param segment_dir directory that keeps the segments, created if needed
+        :param wait whether to wait for the lock or to give up if it is taken
+        :returns whether the lock was acquired
+    """
+    os.makedirs(segment_dir, exist_ok=True)
+    lock_fd = os.open(segment_dir / '.lock', os.O_RDWR | os.O_CREAT)
+
+    try:
+        if wait:
+            await asyncio.to_thread(fcntl.flock, lock_fd, fcntl.LOCK_EX)
+        else:
+            try:
+                fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+
+        yield True
+    finally:
+        os.close(lock_fd)
+
+def _segment_count(duration: float, options: PostprocessingOptions) -> int:
+    # one segment per renderer, or more if checkpoints are due more often than that
+    wanted = options.render_segments
+
+    if options.checkpoint_seconds > 0:
+        checkpoint_seconds = max(options.checkpoint_seconds, MIN_SEGMENT_SECONDS)
+        wanted = max(wanted, math.ceil(duration / checkpoint_seconds))
+
+    return max(1, min(wanted, int(duration // MIN_SEGMENT_SECONDS)))
+
+def segment_end(segments: List[RenderedSegment]) -> float:
+    """ End of the last of the given segments, 0 if there are none """
+    return segments[-1].start + segments[-1].length if segments else 0.0
+
+def next_segment_number(segments: List[RenderedSegment]) -> int:
+    """
+        Number of the next segment to render. Segments are numbered in the order they were
+        started, which needn't be their order in time.
+    """
+    return max((int(s.filename.split('.')[1]) for s in segments), default=-1) + 1
+
+def _unrendered_ranges(
+        segments: List[RenderedSegment],
+        duration: float
+) -> List[Tuple[float, float]]:
+    ranges: List[Tuple[float, float]] = []
+    end = 0.0
+
+    for segment in segments:
+        if segment.start - end > 0.001:
+            ranges.append((end, segment.start))
+
+        end = segment.start + segment.length
+
+    # the duration may be an estimate, so whatever comes after the last segment is always rendered
+    ranges.append((end, max(end, duration)))
+
+    return ranges
+
+def _write_segment_lists(
+        segment_dir: Path,
+        segment_names: List[str],
+        heights: List[int]
+) -> List[Path]:
+    # concat demuxer input for the main output, then one for each rendition
+    list_paths = [ segment_dir / 'segments.txt' ] + [
+        segment_dir / f'segments.{h}p.txt' for h in heights
+    ]
+    labels = [ None ] + [ f'{h}p' for h in heights ]
+
+    for list_path, label in zip(list_paths, labels):
+        list_path.write_text(
+            ''.join(
+                f"file '{name if label is None else rendition_path(Path(name), label)}'\n"
+                for name in segment_names
+            ),
+            encoding='utf-8'
+        )
+
+    return list_paths
+
+def _mux_command(
+        list_paths: List[Path],
+        audio_inputs: List[Path],
+        heights: List[int],
+        output_path: Path,
+        options: PostprocessingOptions
+) -> List[str]:
+    audio_maps = [ '-map', '1:a?' ] + [
+        arg for i in range(2, len(audio_inputs) + 1) for arg in [ '-map', f'{i}:a' ]
+    ]
+    concat_args = [ '-f', 'concat', '-safe', '0' ]
+    muxer = list(options.encoder.muxer)
+
+    # the segments are joined without re-encoding. Audio is encoded in one go here, cutting
+    # it into segments would produce audible gaps at the seams.
+    return [
+        'ffmpeg'
+    ] + concat_args + [
+        '-i', str(list_paths[0])
+    ] + [
+        arg for path in audio_inputs for arg in [ '-i', str(path) ]
+    ] + [
+        arg for list_path in list_paths[1:] for arg in concat_args + [ '-i', str(list_path) ]
+    ] + [
+        '-map', '0:v'
+    ] + audio_maps + [
+        '-c:v', 'copy'
+    ] + options.encoder.audio + muxer + [
+        '-progress', 'pipe:1',
+        '-nostats',
+        '-y', str(output_path)
+    ] + [
+        arg for i, h in enumerate(heights, start=len(audio_inputs) + 1) for arg in [
+            '-map', f'{i}:v', *audio_maps, '-c:v', 'copy', *options.encoder.audio,
+            *muxer, '-y', str(rendition_path(output_path, f'{h}p'))
+        ]
+    ] + (
+        audio_rendition_args(audio_maps, output_path, options)
+        if options.audio_rendition else []
+    )
+
+async def _plan_segments(
+        render: VideoRender,
+        ranges: List[Tuple[float, float]]
+) -> List[Tuple[float, float]]:
+    # each range the earlier runs left open is split on its own
+    counts = [ _segment_count(end - start, render.options) for start, end in ranges ]
+    keyframes = await keyframe_times(render.video_inputs[0]) if max(counts) > 1 else []
+    planned: List[Tuple[float, float]] = []
+
+    for (range_start, range_end), count in zip(ranges, counts):
+        starts = [
+            range_start + start for start in segment_starts(
+                range_end - range_start,
+                count,
+                [ t - range_start for t in keyframes if range_start <= t < range_end ]
+            )
+        ]
+        planned += zip(starts, starts[1:] + [ range_end ])
+
+    return planned
+
+async def render_in_segments(
+        render: VideoRender,
+        audio_inputs: List[Path],
+        duration: float,
+        output_path: Path,
+        report: ProgressCallback
+) -> None:
+    """
+        Renders the video timeline in segments, options.render_segments of them at a time, and
+        joins them with the audio. Segments rendered before with the same settings, e.g. live
+        during the lecture or by an interrupted run, are reused as they are.
+
+        :param render video inputs and how they are rendered
+        :param audio_inputs tracks to take the audio from, the main stream first
+        :param duration length of the timeline in seconds, may be an estimate
+        :param output_path where to write the presentation, renditions are written next to it
+        :param report receives progress reports
+    """
+    segment_dir = segment_dir_for(output_path)
+
+    async with locked_segment_dir(segment_dir):
+        rendered = usable_segments(segment_dir, render_key(render.filter_graph, render.options))
+
+        if rendered:
+            logger.info("Reusing %d rendered segments", len(rendered))
+
+        planned = await _plan_segments(render, _unrendered_ranges(rendered, duration))
+        first_number = next_segment_number(rendered)
+        segments = [
+            RenderedSegment(
+                start=start,
+                length=end - start,
+                filename=f'segment.{first_number + i:04d}.{render.options.encoder.container}'
+            )
+            for i, (start, end) in enumerate(planned)
+        ]
+
+        logger.info("Rendering %s in %d segments", output_path, len(segments))
+
+        progress = _segmented_progress([ s.length for s in segments ], report)
+        render_slots = asyncio.Semaphore(render.options.render_segments)
+
+        async def render_segment(i: int) -> None:
+            # the last segment runs to the end, the duration may be an estimate
+            last = i == len(segments) - 1
+
+            async with render_slots:
+                await run_command(
+                    segment_command(
+                        render,
+                        segments[i].start,
+                        None if last else segments[i].length,
+                        segment_dir / segments[i].filename
+                    ),
+                    FfmpegProgressParser(segments[i].length, progress[i])
+                )
+
+            if not last:
+                record_segment(segment_dir, segments[i])
+
+        report(Progress(phase=Phase.RENDER, percent=0.0))
+        await _gather_or_cancel(*(render_segment(i) for i in range(len(segments))))
+
+        list_paths = _write_segment_lists(
+            segment_dir,
+            [ s.filename for s in sorted(rendered + segments, key=lambda s: s.start) ],
+            render.heights
+        )
+        mux_command = _mux_command(
+            list_paths,
+            audio_inputs,
+            render.heights,
+            output_path,
+            render.options
+        )
+
+        logger.debug("Mux command = %s", mux_command)
+
+        report(Progress(phase=Phase.MUX, percent=0.0))
+        await run_command(mux_command, FfmpegProgressParser(duration, report, Phase.MUX))
+
+        # only now, a failed render keeps what it completed
+        shutil.rmtree(segment_dir, ignore_errors=True)
@@ -4,24 +4,53 @@
    This module defines the HTTP API endpoints and validates inputs.
 """
 
+from contextlib import asynccontextmanager
+from datetime import timedelta
 import logging
 import os
 from functools import lru_cache
 from pathlib import Path
-from typing import Annotated, List, Optional
+from subprocess import CalledProcessError
+import time
+from typing import Annotated, AsyncIterator, Dict, List, NamedTuple, Optional, Sequence, Set, Tuple
 
 import aiofiles
-from fastapi import APIRouter, BackgroundTasks, Depends, FastAPI, Form, File, HTTPException, UploadFile, status
+from fastapi import APIRouter, BackgroundTasks, Depends, FastAPI, Form, File, HTTPException, Request, UploadFile, status
+from fastapi import Path as PathParam
+from fastapi import Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, EmailStr, Field
+from pydantic import BaseModel, EmailStr, Field, model_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
+from .assembly import append_ready_chunks
+from .cropdetect import read_crop_cache, update_crop_cache
+from .encoders import DEFAULT_ENCODER_PROFILE, ENCODER_PROFILES, EncoderProfile
+from .jobs import JobOrdering, JobQueue, JobRecord, JobState
+from .live import render_live_segments
 from .logconfig import setup_logging
-from .postprocess import postprocess_recording
+from .metrics import (
+    CHUNK_UPLOAD_BYTES,
+    CHUNK_UPLOAD_SECONDS,
+    CHUNK_UPLOADS,
+    CONTENT_TYPE,
+    POSTPROCESSING_JOBS,
+    REGISTRY
+)
+from .options import PostprocessingOptions, StreamingFormat
+from .postprocess import postprocess_recording, Result
+from .progress import ProgressCallback
 from .reporting import normalize_recipient, send_report, SmtpSink
+from .worker import postprocess_in_worker, render_live_in_worker, WorkerPool
 
 SAFE_NAME_REGEX = '^\\w[\\w.-]*$'
 
+# can't collide with a recording because recording names can't start with a dot
+JOBS_DIRNAME = '.jobs'
+
+# the frontend sends the main display stream and the speaker video as these tracks
+STREAM_TRACK = 'stream'
+OVERLAY_TRACK = 'overlay'
+
 class Settings(BaseSettings):
     """
         Configuration settings for the server. Options can be set through ISE_RECORD_VARNAME
@@ -40,11 +69,71 @@ class Settings(BaseSettings):
     smtp_allowed_domains: List[str] = []
 
     chunk_file_digits: int = 4
+    assemble_on_upload: bool = True
+
+    postprocessing_workers: Annotated[int, Field(ge=1)] = 1
+    postprocessing_in_worker_processes: bool = True
+    job_ordering: JobOrdering = "fifo"
+    job_retention_days: Annotated[float, Field(gt=0)] = 30
+
+    crop_detect_samples: Annotated[int, Field(ge=0)] = 0
+    crop_detect_frames: Annotated[int, Field(ge=3)] = 10
+    crop_detect_interval: Annotated[int, Field(ge=0)] = 0
+    chunk_seconds: Annotated[float, Field(gt=0)] = 5.0
+    pipe_chunks: bool = False
+    io_concurrency: Annotated[int, Field(ge=1)] = 4
+
+    encoder_profiles: Dict[str, EncoderProfile] = Field(
+        default_factory=lambda: dict(ENCODER_PROFILES)
+    )
+    encoder_profile: str = DEFAULT_ENCODER_PROFILE
+    encoder_threads: Annotated[int, Field(ge=0)] = 0
+    stream_copy: bool = True
+    render_segments: Annotated[int, Field(ge=1)] = 1
+    render_checkpoint_interval: Annotated[float, Field(ge=0)] = 0
+    render_cache: bool = True
+    renditions: List[Annotated[int, Field(gt=0)]] = []
+    audio_rendition: bool = False
+    streaming_format: Optional[StreamingFormat] = None
+    live_render_window: Annotated[int, Field(ge=0)] = 0
 
     cors_origins: List[str] = []
 
     model_config = SettingsConfigDict(env_prefix="ise_record_")
 
+    @model_validator(mode='after')
+    def _check_encoder_profile(self) -> 'Settings':
+        if self.encoder_profile not in self.encoder_profiles:
+            raise ValueError(f'Unknown encoder profile {self.encoder_profile}')
+        return self
+
+    def postprocessing_options(self, encoder_profile: str | None = None) -> PostprocessingOptions:
+        """
+            Pipeline tunables for the postprocessing module
+
+            :param encoder_profile name of the encoder profile to use instead of the default one
+        """
+        profile_name = encoder_profile or self.encoder_profile
+
+        if profile_name not in self.encoder_profiles:
+            raise ValueError(f'Unknown encoder profile {profile_name}')
+
+        return PostprocessingOptions(
+            crop_detect_samples=self.crop_detect_samples,
+            crop_detect_frames=self.crop_detect_frames,
+            pipe_chunks=self.pipe_chunks,
+            io_concurrency=self.io_concurrency,
+            encoder=self.encoder_profiles[profile_name],
+            encoder_threads=self.encoder_threads,
+            stream_copy=self.stream_copy,
+            render_segments=self.render_segments,
+            renditions=tuple(self.renditions),
+            audio_rendition=self.audio_rendition,
+            streaming_format=self.streaming_format,
+            checkpoint_seconds=self.render_checkpoint_interval,
+            use_render_cache=self.render_cache
+        )
+
 @lru_cache
 def get_settings() -> Settings:
     """ Cached settings loader """
@@ -54,6 +143,180 @@ setup_logging()
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
+_crop_detection_running: Set[Path] = set()
+
+async def _crop_detection_task(track_path: Path, assembled_chunks: int, settings: Settings) -> None:
+    # one analysis per track at a time; whatever is skipped is covered by the next one
+    if track_path in _crop_detection_running:
+        return
+
+    cache = read_crop_cache(track_path)
+    analyzed_chunks = cache.analyzed_chunks if cache is not None else 0
+
+    if assembled_chunks - analyzed_chunks < settings.crop_detect_interval:
+        return
+
+    _crop_detection_running.add(track_path)
+
+    try:
+        await update_crop_cache(
+            track_path,
+            assembled_chunks,
+            settings.chunk_seconds,
+            settings.crop_detect_frames
+        )
+    except CalledProcessError as err:
+        logger.warning("Crop detection for %s failed: %s", track_path, err.stderr)
+    finally:
+        _crop_detection_running.discard(track_path)
+
+_live_rendering_running: Set[Path] = set()
+
+async def _live_render_task(
+    recording_path: Path,
+    settings: Settings,
+    worker_pool: WorkerPool | None = None
+) -> None:
+    # one live render per recording at a time; the running one picks up whatever became ready
+    # in the meantime
+    if recording_path in _live_rendering_running:
+        return
+
+    _live_rendering_running.add(recording_path)
+
+    try:
+        if worker_pool is None:
+            await render_live_segments(
+                recording_path,
+                settings.chunk_seconds,
+                settings.live_render_window,
+                settings.postprocessing_options()
+            )
+        else:
+            await render_live_in_worker(
+                worker_pool,
+                recording_path,
+                settings.chunk_seconds,
+                settings.live_render_window,
+                settings.postprocessing_options()
+            )
+    except CalledProcessError as err:
+        logger.warning("Live rendering of %s failed: %s", recording_path, err.stderr)
+    finally:
+        _live_rendering_running.discard(recording_path)
+
+def get_worker_pool(request: Request) -> WorkerPool | None:
+    """ Dependency that provides the worker processes of the running application, if any """
+    return request.app.state.worker_pool
+
+class UploadContext(NamedTuple):
+    """ What stored chunks are handed on to, shared by the upload endpoints (parameter object) """
+    background_tasks: BackgroundTasks
+    settings: Settings
+    worker_pool: WorkerPool | None = None
+
+def get_upload_context(
+    background_tasks: BackgroundTasks,
+    settings: Annotated[Settings, Depends(get_settings)],
+    worker_pool: Annotated[WorkerPool | None, Depends(get_worker_pool)]
+) -> UploadContext:
+    """ Dependency that provides what storing a chunk needs besides the chunk itself """
+    return UploadContext(background_tasks, settings, worker_pool)
+
+async def _write_chunk(filepath: Path, content: AsyncIterator[bytes]) -> int:
+    # write under a name that doesn't match chunk.* and rename when complete, so the assembler
+    # never picks up a partially written chunk
+    upload_path = filepath.with_name(f'.{filepath.name}.upload')
+    size = 0
+
+    try:
+        async with aiofiles.open(upload_path, "wb") as out:
+            async for data in content:
+                await out.write(data)
+                size += len(data)
+    except:
+        # e.g. the client went away halfway through
+        upload_path.unlink(missing_ok=True)
+        raise
+
+    os.replace(upload_path, filepath)
+
+    return size
+
+async def _store_chunk(
+    recording: str,
+    track: str,
+    index: int,
+    content: AsyncIterator[bytes],
+    context: UploadContext
+) -> dict[str, str | int]:
+    """
+        Stores a chunk and kicks off what happens with new chunks, i.e. assembly, crop detection
+        and live rendering. Shared by the upload endpoints.
+
+        :param recording name of the recording
+        :param track name of the track
+        :param index running number of the chunk in the track
+        :param content data of the chunk
+        :param context background tasks, server configuration and worker processes to render in
+        :returns description of the stored chunk for the response
+    """
+    started = time.perf_counter()
+    settings = context.settings
+    index_limit = 10 ** settings.chunk_file_digits
+    if index >= index_limit:
+        raise HTTPException(
+            status_code=422,
+            detail=(
+                f"Lecture has been going on too long. "
+                f"Attempted to store {index} chunks (max = {index_limit})"
+            )
+        )
+
+    filename = f'chunk.{index:0{settings.chunk_file_digits}d}'
+
+    track_path = settings.destdir / recording / track
+    filepath = track_path / filename
+    logger.debug("saving %s", filepath)
+
+    os.makedirs(track_path, exist_ok=True)
+    size = await _write_chunk(filepath, content)
+
+    CHUNK_UPLOADS.inc()
+    CHUNK_UPLOAD_BYTES.inc(size)
+
+    if settings.assemble_on_upload:
+        assembly = await append_ready_chunks(track_path, settings.chunk_file_digits)
+
+        if track == STREAM_TRACK and settings.crop_detect_interval > 0:
+            context.background_tasks.add_task(
+                _crop_detection_task,
+                track_path,
+                assembly.next_index,
+                settings
+            )
+
+        if track in (STREAM_TRACK, OVERLAY_TRACK) and settings.live_render_window > 0:
+            context.background_tasks.add_task(
+                _live_render_task,
+                settings.destdir / recording,
+                settings,
+                context.worker_pool
+            )
+
+    CHUNK_UPLOAD_SECONDS.observe(time.perf_counter() - started)
+
+    return {
+        "recording": recording,
+        "track": track,
+        "index": index,
+        "filename": filename
+    }
+
+async def _read_upload(upload: UploadFile) -> AsyncIterator[bytes]:
+    while content := await upload.read(128 * 1024):
+        yield content
+
 @router.post('/api/chunks', status_code=status.HTTP_201_CREATED)
 async def upload_chunk(
     recording: Annotated[
@@ -86,40 +349,127 @@ async def upload_chunk(
             description="video/audio blob to store, as file"
         )
     ],
-    settings: Annotated[Settings, Depends(get_settings)]
+    context: Annotated[UploadContext, Depends(get_upload_context)]
 ) -> dict[str, str | int]:
     """
     POST endpoint for the upload of chunk files.
     """
-    index_limit = 10 ** settings.chunk_file_digits
-    if index >= index_limit:
+    return await _store_chunk(recording, track, index, _read_upload(chunk), context)
+
+@router.post('/api/chunks/batch', status_code=status.HTTP_201_CREATED)
+async def upload_chunk_batch(
+    recording: Annotated[
+        str,
+        Form(
+            pattern=SAFE_NAME_REGEX,
+            description="Name of the recording. Usually consists of Lecture Title and Timestamp",
+            examples=["PSU_2026-02-13T164309.313"],
+        )
+    ],
+    track: Annotated[
+        List[Annotated[str, Field(pattern=SAFE_NAME_REGEX)]],
+        Form(
+            description="Name of the track of each chunk, e.g. stream, overlay, audio-0",
+            examples=[["stream", "overlay"]]
+        )
+    ],
+    index: Annotated[
+        List[Annotated[int, Field(ge=0)]],
+        Form(
+            description="Running number of each chunk in its track",
+            examples=[[0, 0]]
+        )
+    ],
+    chunk: Annotated[
+        List[UploadFile],
+        File(
+            description="video/audio blobs to store, as files, in the order of track and index"
+        )
+    ],
+    context: Annotated[UploadContext, Depends(get_upload_context)]
+) -> dict[str, str | List[dict[str, str | int]]]:
+    """
+    POST endpoint for the upload of several chunks of a recording, possibly of different
+    tracks, in one request. The n-th chunk belongs to the n-th track and index.
+    """
+    if not len(track) == len(index) == len(chunk):
+        raise HTTPException(
+            status_code=422,
+            detail=f"Got {len(chunk)} chunks for {len(track)} tracks and {len(index)} indices"
+        )
+
+    if len(set(zip(track, index))) < len(chunk):
+        raise HTTPException(status_code=422, detail="Batch contains a chunk more than once")
+
+    # reject the whole batch up front rather than storing a part of it
+    index_limit = 10 ** context.settings.chunk_file_digits
+    if max(index, default=0) >= index_limit:
         raise HTTPException(
             status_code=422,
             detail=(
                 f"Lecture has been going on too long. "
-                f"Attempted to store {index} chunks (max = {index_limit})"
+                f"Attempted to store {max(index)} chunks (max = {index_limit})"
             )
         )
 
-    filename = f'chunk.{index:0{settings.chunk_file_digits}d}'
-
-    track_path = settings.destdir / recording / track
-    filepath = track_path / filename
-    logger.debug("saving %s", filepath)
-
-    os.makedirs(track_path, exist_ok=True)
-
-    async with aiofiles.open(filepath, "wb") as out:
-        while content := await chunk.read(128 * 1024):
-            await out.write(content)
+    # in order, so that each track can be assembled as far as possible
+    stored = [
+        await _store_chunk(recording, t, i, _read_upload(c), context)
+        for t, i, c in sorted(zip(track, index, chunk), key=lambda batch: batch[:2])
+    ]
 
     return {
         "recording": recording,
-        "track": track,
-        "index": index,
-        "filename": filename
+        "chunks": [ { k: v for k, v in s.items() if k != "recording" } for s in stored ]
     }
 
+@router.put(
+    '/api/recordings/{recording}/{track}/{index}',
+    status_code=status.HTTP_201_CREATED,
+    openapi_extra={
+        "requestBody": {
+            "description": "video/audio blob to store",
+            "required": True,
+            "content": {
+                "application/octet-stream": { "schema": { "type": "string", "format": "binary" } }
+            }
+        }
+    }
+)
+async def put_chunk(
+    recording: Annotated[
+        str,
+        PathParam(
+            pattern=SAFE_NAME_REGEX,
+            description="Name of the recording. Usually consists of Lecture Title and Timestamp",
+            examples=["PSU_2026-02-13T164309.313"],
+        )
+    ],
+    track: Annotated[
+        str,
+        PathParam(
+            pattern=SAFE_NAME_REGEX,
+            description="Name of the track, e.g. stream, overlay, audio-0",
+            examples=["stream", "overlay", "audio-0"]
+        )
+    ],
+    index: Annotated[
+        int,
+        PathParam(
+            ge=0,
+            description="Running number of the chunk in the track. Start at 0.",
+            examples=[0]
+        )
+    ],
+    request: Request,
+    context: Annotated[UploadContext, Depends(get_upload_context)]
+) -> dict[str, str | int]:
+    """
+    PUT endpoint for the upload of a chunk as the raw request body. Unlike with multipart
+    uploads, the body isn't spooled to a temporary file first, so every byte is written once.
+    """
+    return await _store_chunk(recording, track, index, request.stream(), context)
+
 class PostProcessingJob(BaseModel):
     """ DTO for a postprocessing job the client wants to schedule """
 
@@ -142,21 +492,55 @@ class PostProcessingJob(BaseModel):
             examples=["mustermann@vss.uni-hannover.de", None]
         )
     ]
+    priority: Annotated[
+        int,
+        Field(
+            default=0,
+            description=(
+                "Scheduling priority. Higher runs first if the server uses priority ordering"
+            ),
+            examples=[0]
+        )
+    ]
+    encoder_profile: Annotated[
+        Optional[str],
+        Field(
+            default=None,
+            description="Encoder profile to render with. The server's default profile if omitted",
+            examples=["vp9", "h264", None]
+        )
+    ]
 
-async def _postprocessing_task(job: PostProcessingJob, settings: Settings) -> None:
+async def _postprocessing_task(
+    job: PostProcessingJob,
+    settings: Settings,
+    progress: ProgressCallback | None = None,
+    worker_pool: WorkerPool | None = None,
+    merged_recipients: Sequence[str] = ()
+) -> Result:
     recording_path = settings.destdir / job.recording
-    job_result = await postprocess_recording(recording_path)
+    options = settings.postprocessing_options(job.encoder_profile)
+
+    if worker_pool is None:
+        job_result = await postprocess_recording(recording_path, progress, options)
+    else:
+        job_result = await postprocess_in_worker(worker_pool, recording_path, progress, options)
+
+    POSTPROCESSING_JOBS.inc(result=job_result.reason.name.lower())
 
-    normalized_recipient = normalize_recipient(job.recipient, settings.smtp_allowed_domains)
+    smtp_sink = SmtpSink(
+        server = settings.smtp_server,
+        port = settings.smtp_port,
+        local_hostname = settings.smtp_local_hostname,
+        starttls = settings.smtp_starttls,
+        username = settings.smtp_username,
+        password = settings.smtp_password)
 
-    if normalized_recipient is not None:
-        smtp_sink = SmtpSink(
-            server = settings.smtp_server,
-            port = settings.smtp_port,
-            local_hostname = settings.smtp_local_hostname,
-            starttls = settings.smtp_starttls,
-            username = settings.smtp_username,
-            password = settings.smtp_password)
+    for recipient in [ job.recipient, *merged_recipients ]:
+        normalized_recipient = normalize_recipient(recipient, settings.smtp_allowed_domains)
+
+        if normalized_recipient is None:
+            continue
 
         await send_report(
             smtp_sink=smtp_sink,
@@ -165,21 +549,62 @@ async def _postprocessing_task(job: PostProcessingJob, settings: Settings) -> No
             job_title=job.recording,
             result=job_result)
 
+    return job_result
+
+def get_job_queue(request: Request) -> JobQueue:
+    """ Dependency that provides the job queue of the running application """
+    return request.app.state.job_queue
+
 @router.post('/api/jobs', status_code=status.HTTP_202_ACCEPTED)
-def schedule_job(
+async def schedule_job(
     job: PostProcessingJob,
-    background_tasks: BackgroundTasks,
+    job_queue: Annotated[JobQueue, Depends(get_job_queue)],
     settings: Annotated[Settings, Depends(get_settings)]
-):
+) -> JobRecord:
     """ Endpoint for the scheduling of postprocessing jobs """
 
     if not os.path.isdir(settings.destdir / job.recording):
         logger.warning("Bad postprocessing request: Recording %s does not exist", job.recording)
         raise HTTPException(status_code=400, detail=f'Recording {job.recording} does not exist')
 
-    background_tasks.add_task(_postprocessing_task, job, settings)
+    if job.encoder_profile is not None and job.encoder_profile not in settings.encoder_profiles:
+        logger.warning(
+            "Bad postprocessing request: Unknown encoder profile %s",
+            job.encoder_profile
+        )
+        raise HTTPException(
+            status_code=400,
+            detail=f'Unknown encoder profile {job.encoder_profile}'
+        )
+
+    return job_queue.submit(job.recording, job.recipient, job.priority, job.encoder_profile)
+
+@router.get('/api/jobs')
+def list_jobs(
+    job_queue: Annotated[JobQueue, Depends(get_job_queue)]
+) -> List[JobRecord]:
+    """ Endpoint to list all known postprocessing jobs with their state and progress """
+    return job_queue.jobs()
+
+@router.get('/api/jobs/{recording}')
+def get_job(
+    recording: Annotated[
+        str,
+        PathParam(
+            pattern=SAFE_NAME_REGEX,
+            description="Name of the recording",
+            examples=["PSU_2026-02-13T164309.313"]
+        )
+    ],
+    job_queue: Annotated[JobQueue, Depends(get_job_queue)]
+) -> JobRecord:
+    """ Endpoint to query state and progress of the latest postprocessing job of a recording """
+    record = job_queue.latest_for(recording)
+
+    if record is None:
+        raise HTTPException(status_code=404, detail=f'No job for recording {recording}')
 
-    return job
+    return record
 
 @router.get('/api/health')
 def health_check():
@@ -187,19 +612,73 @@ def health_check():
     logger.debug("health check requested")
     return { "status": "healthy" }
 
+@router.get('/metrics', response_class=Response)
+def metrics() -> Response:
+    """ Endpoint for Prometheus to scrape upload and postprocessing metrics from """
+    return Response(content=REGISTRY.expose(), media_type=CONTENT_TYPE)
+
 
 def create_app(
         settings: Settings = get_settings()
 ) -> FastAPI:
     """ Application factory. Creates a FastAPI app configured with the given settings. """
-    application = FastAPI()
+
+    async def run_job(record: JobRecord, progress: ProgressCallback) -> Result:
+        job = PostProcessingJob(
+            recording=record.recording,
+            recipient=record.recipient,
+            priority=record.priority,
+            encoder_profile=record.encoder_profile
+        )
+        return await _postprocessing_task(
+            job, settings, progress, application.state.worker_pool, record.merged_recipients
+        )
+
+    job_queue = JobQueue(
+        state_dir=settings.destdir / JOBS_DIRNAME,
+        workers=settings.postprocessing_workers,
+        ordering=settings.job_ordering,
+        runner=run_job,
+        retention=timedelta(days=settings.job_retention_days),
+        default_encoder_profile=settings.encoder_profile
+    )
+
+    def count_jobs() -> Dict[Tuple[str, ...], float]:
+        counts = { (state.value,): 0.0 for state in JobState }
+
+        for record in job_queue.jobs():
+            counts[(record.state.value,)] += 1
+
+        return counts
+
+    REGISTRY.gauge(
+        'ise_record_postprocessing_jobs', 'Known postprocessing jobs, by state', [ 'state' ],
+        count_jobs
+    )
+
+    @asynccontextmanager
+    async def lifespan(_: FastAPI) -> AsyncIterator[None]:
+        if settings.postprocessing_in_worker_processes:
+            application.state.worker_pool = WorkerPool(settings.postprocessing_workers)
+
+        await job_queue.start()
+        yield
+        await job_queue.stop()
+
+        if application.state.worker_pool is not None:
+            application.state.worker_pool.shutdown()
+            application.state.worker_pool = None
+
+    application = FastAPI(lifespan=lifespan)
+    application.state.job_queue = job_queue
+    application.state.worker_pool = None
 
     if settings.cors_origins:
         application.add_middleware(
             CORSMiddleware,
             allow_origins=settings.cors_origins,
             allow_credentials=False,
-            allow_methods=["GET", "POST"],
+            allow_methods=["GET", "POST", "PUT"],
             allow_headers=["Content-Type"],
         )
     application.include_router(router)
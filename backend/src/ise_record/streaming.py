@@ -0,0 +1,138 @@
+"""
+    ISE-Recorder streaming packaging. Cuts rendered presentations into segments with an HLS or
+    DASH manifest for adaptive streaming, without re-encoding them.
+"""
+
+import logging
+import os
+from pathlib import Path
+import shutil
+from typing import List
+
+from .ffmpeg import run_command
+from .options import STREAMING_SEGMENT_SECONDS, StreamingFormat
+from .progress import FfmpegProgressParser, Phase, Progress, ProgressCallback
+
+logger = logging.getLogger(__name__)
+
+STREAMING_DIRNAME = 'streaming'
+
+async def has_audio(path: Path) -> bool:
+    """
+        Checks whether a file contains any audio streams.
+
+        :param path input file
+        :returns True if there is at least one audio stream
+    """
+    probe_command = [
+        'ffprobe',
+        '-v', 'error',
+        '-select_streams', 'a',
+        '-show_entries', 'stream=index',
+        '-of', 'csv=p=0',
+        str(path)
+    ]
+
+    return bool((await run_command(probe_command)).strip())
+
+def streaming_manifest_path(output_path: Path, streaming_format: StreamingFormat) -> Path:
+    """ Path of the HLS or DASH manifest that is generated along with a rendered presentation """
+    manifest_name = 'master.m3u8' if streaming_format == 'hls' else 'manifest.mpd'
+    return output_path.with_name(STREAMING_DIRNAME) / manifest_name
+
+def streaming_command(
+        video_paths: List[Path],
+        audio: bool,
+        streaming_format: StreamingFormat,
+        manifest_path: Path
+) -> List[str]:
+    """
+        Assembles the ffmpeg command that cuts rendered presentations into segments for HLS or
+        DASH streaming, without re-encoding. Every input is one video variant; the audio is taken
+        from the first input only and shared by all variants.
+
+        :param video_paths rendered presentation and its smaller renditions, if any
+        :param audio whether the presentation has audio
+        :param streaming_format 'hls' for fragmented MP4 segments with HLS playlists, 'dash' for
+                                segments in the container of the input with a DASH manifest
+        :param manifest_path where to write the manifest, segments are written next to it
+        :returns the ffmpeg command
+    """
+    maps = [ arg for i in range(len(video_paths)) for arg in [ '-map', f'{i}:v:0' ] ]
+    maps += [ '-map', '0:a:0' ] if audio else []
+
+    if streaming_format == 'hls':
+        variants = [
+            f'v:{i}' + (',agroup:audio' if audio else '') for i in range(len(video_paths))
+        ]
+        variants += [ 'a:0,agroup:audio' ] if audio else []
+
+        format_args = [
+            '-f', 'hls',
+            '-hls_time', str(STREAMING_SEGMENT_SECONDS),
+            '-hls_playlist_type', 'vod',
+            '-hls_segment_type', 'fmp4',
+            '-hls_segment_filename', str(manifest_path.with_name('segment_%v_%05d.m4s')),
+            '-master_pl_name', manifest_path.name,
+            '-var_stream_map', ' '.join(variants),
+            '-y', str(manifest_path.with_name('playlist_%v.m3u8'))
+        ]
+    else:
+        adaptation_sets = 'id=0,streams=v' + (' id=1,streams=a' if audio else '')
+
+        format_args = [
+            '-f', 'dash',
+            '-seg_duration', str(STREAMING_SEGMENT_SECONDS),
+            '-use_template', '1',
+            '-use_timeline', '1',
+            '-adaptation_sets', adaptation_sets,
+            '-y', str(manifest_path)
+        ]
+
+    return [
+        'ffmpeg'
+    ] + [
+        arg for path in video_paths for arg in [ '-i', str(path) ]
+    ] + maps + [
+        '-c', 'copy',
+        '-progress', 'pipe:1',
+        '-nostats'
+    ] + format_args
+
+async def package_for_streaming(
+        video_paths: List[Path],
+        streaming_format: StreamingFormat,
+        output_path: Path,
+        duration: float | None,
+        report: ProgressCallback
+) -> Path:
+    """
+        Cuts a rendered presentation into segments for HLS or DASH streaming. Output of earlier
+        runs is replaced.
+
+        :param video_paths rendered presentation and its smaller renditions, if any
+        :param streaming_format 'hls' or 'dash'
+        :param output_path path of the rendered presentation
+        :param duration duration of the presentation in seconds, for progress reports
+        :param report receives progress reports
+        :returns path of the manifest
+    """
+    manifest_path = streaming_manifest_path(output_path, streaming_format)
+
+    shutil.rmtree(manifest_path.parent, ignore_errors=True)
+    os.makedirs(manifest_path.parent)
+
+    command = streaming_command(
+        video_paths,
+        await has_audio(video_paths[0]),
+        streaming_format,
+        manifest_path
+    )
+
+    logger.info("Packaging %s for %s streaming", output_path, streaming_format.upper())
+    logger.debug("Streaming command = %s", command)
+
+    report(Progress(phase=Phase.PACKAGE, percent=0.0))
+    await run_command(command, FfmpegProgressParser(duration, report, Phase.PACKAGE))
+
+    return manifest_path
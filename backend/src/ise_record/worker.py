@@ -0,0 +1,140 @@
+"""
+    ISE-Recorder postprocessing workers. Runs postprocessing and live rendering in separate
+    processes so that subprocess plumbing, file I/O and ffmpeg's output don't compete with chunk
+    uploads for the server's event loop.
+"""
+
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import logging
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Tuple, TypeVar
+
+from .live import render_live_segments
+from .metrics import MetricState, REGISTRY
+from .options import PostprocessingOptions
+from .postprocess import postprocess_recording, Result
+from .progress import ProgressCallback
+from .segments import RenderedSegment
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+def _init_worker(log_level: int) -> None:
+    # worker processes don't inherit the server's logging setup
+    logging.basicConfig(level=log_level)
+
+def _create_process() -> ProcessPoolExecutor:
+    return ProcessPoolExecutor(
+        max_workers=1,
+        initializer=_init_worker,
+        initargs=(logging.getLogger().getEffectiveLevel(),)
+    )
+
+class WorkerPool:
+    """
+        Pool of worker processes for postprocessing jobs and live renders. Every process is an
+        executor of its own, so a process that dies (e.g. killed for running out of memory) only
+        fails the work it was running, and is replaced by a fresh process for the work that
+        follows.
+    """
+
+    def __init__(self, processes: int):
+        """
+            :param processes number of worker processes, i.e. of jobs that can run concurrently
+        """
+        self._processes: List[ProcessPoolExecutor] = [
+            _create_process() for _ in range(processes)
+        ]
+        self._idle: asyncio.Queue[ProcessPoolExecutor] = asyncio.Queue()
+
+        for process in self._processes:
+            self._idle.put_nowait(process)
+
+    async def run(self, function: Callable[..., T], *args: Any) -> T:
+        """
+            Runs a function in the next idle worker process.
+
+            :param function function to run. Must be picklable, as must be its arguments.
+            :param args arguments of the function
+            :returns what the function returns
+        """
+        process = await self._idle.get()
+
+        try:
+            return await asyncio.get_running_loop().run_in_executor(process, function, *args)
+        except BrokenProcessPool:
+            logger.error("Worker process died, replacing it")
+            process.shutdown(wait=False)
+            self._processes.remove(process)
+            process = _create_process()
+            self._processes.append(process)
+            raise
+        finally:
+            self._idle.put_nowait(process)
+
+    def shutdown(self) -> None:
+        """ Stops all worker processes, abandoning the work they are running """
+        for process in self._processes:
+            process.shutdown(wait=False, cancel_futures=True)
+
+def _run_sync(
+        function: Callable[..., Awaitable[T]],
+        *args: Any
+) -> Tuple[T, Dict[str, MetricState]]:
+    result = asyncio.run(function(*args))
+
+    # the server's registry only learns about the work's metrics from what is handed back here
+    return result, REGISTRY.drain()
+
+async def _run_in_worker(pool: WorkerPool, function: Callable[..., Awaitable[T]], *args: Any) -> T:
+    result, metrics = await pool.run(_run_sync, function, *args)
+    REGISTRY.merge(metrics)
+    return result
+
+async def postprocess_in_worker(
+        pool: WorkerPool,
+        recording_path: Path,
+        progress: ProgressCallback | None = None,
+        options: PostprocessingOptions = PostprocessingOptions()
+) -> Result:
+    """
+        Postprocess a recording in a worker process. Equivalent to postprocess_recording
+        otherwise.
+
+        :param pool worker processes to run the job in
+        :param recording_path directory that contains the input streams in chunks
+        :param progress receives progress reports while the job is running. Must be picklable.
+        :param options tunables of the pipeline
+        :returns whether postprocessing succeeded and path of the result file
+    """
+    return await _run_in_worker(pool, postprocess_recording, recording_path, progress, options)
+
+async def render_live_in_worker(
+        pool: WorkerPool,
+        recording_path: Path,
+        chunk_seconds: float,
+        window_chunks: int,
+        options: PostprocessingOptions = PostprocessingOptions()
+) -> List[RenderedSegment]:
+    """
+        Renders the windows of a recording that is still being uploaded in a worker process.
+        Equivalent to render_live_segments otherwise.
+
+        :param pool worker processes to render in
+        :param recording_path directory that contains the tracks of the recording
+        :param chunk_seconds approximate duration of a chunk
+        :param window_chunks length of a window in chunks
+        :param options pipeline tunables
+        :returns the segments rendered so far
+    """
+    return await _run_in_worker(
+        pool,
+        render_live_segments,
+        recording_path,
+        chunk_seconds,
+        window_chunks,
+        options
+    )
@@ -9,6 +9,8 @@ from argparse import ArgumentParser
 import logging
 from pathlib import Path
 
+from ise_record.encoders import DEFAULT_ENCODER_PROFILE, ENCODER_PROFILES
+from ise_record.options import PostprocessingOptions
 from ise_record.postprocess import postprocess_recording
 
 async def main():
@@ -22,10 +24,83 @@ async def main():
     )
     parser.add_argument('recording_directory', type=Path)
     parser.add_argument('-l', '--log-level', default="INFO")
+    parser.add_argument(
+        '--crop-detect-samples', type=int, default=0,
+        help="number of points in time to sample for crop detection (default: analyze all frames)"
+    )
+    parser.add_argument(
+        '--crop-detect-frames', type=int, default=10,
+        help="number of frames to analyze per crop detection sample"
+    )
+    parser.add_argument(
+        '--ignore-crop-cache', action='store_true',
+        help="analyze the main stream even if crop detection results were gathered during upload"
+    )
+    parser.add_argument(
+        '--ignore-render-cache', action='store_true',
+        help="render even if the recording was rendered with the same inputs and settings before"
+    )
+    parser.add_argument(
+        '--pipe-chunks', action='store_true',
+        help="stream unassembled tracks to ffmpeg through named pipes instead of concatenating them"
+    )
+    parser.add_argument(
+        '--io-concurrency', type=int, default=4,
+        help="maximum number of tracks to concatenate at the same time"
+    )
+    parser.add_argument(
+        '--encoder-profile', choices=sorted(ENCODER_PROFILES), default=DEFAULT_ENCODER_PROFILE,
+        help="codec settings to render with"
+    )
+    parser.add_argument(
+        '--encoder-threads', type=int, default=0,
+        help="number of encoder threads (default: let ffmpeg decide)"
+    )
+    parser.add_argument(
+        '--no-stream-copy', action='store_true',
+        help="re-encode the main stream even if it could be remuxed as-is"
+    )
+    parser.add_argument(
+        '--render-segments', type=int, default=1,
+        help="number of segments to render in parallel (default: render in one piece)"
+    )
+    parser.add_argument(
+        '--checkpoint-interval', type=float, default=0, metavar='SECONDS',
+        help="keep progress at least this often so an interrupted render can resume (default: off)"
+    )
+    parser.add_argument(
+        '--rendition', type=int, action='append', default=[], metavar='HEIGHT',
+        help="additionally render a smaller rendition of this height (can be repeated)"
+    )
+    parser.add_argument(
+        '--audio-rendition', action='store_true',
+        help="additionally write the audio tracks on their own"
+    )
+    parser.add_argument(
+        '--streaming-format', choices=[ 'hls', 'dash' ],
+        help="additionally cut the result into segments with an HLS or DASH manifest"
+    )
     argv = parser.parse_args()
 
+    options = PostprocessingOptions(
+        crop_detect_samples=argv.crop_detect_samples,
+        crop_detect_frames=argv.crop_detect_frames,
+        use_crop_cache=not argv.ignore_crop_cache,
+        use_render_cache=not argv.ignore_render_cache,
+        pipe_chunks=argv.pipe_chunks,
+        io_concurrency=argv.io_concurrency,
+        encoder=ENCODER_PROFILES[argv.encoder_profile],
+        encoder_threads=argv.encoder_threads,
+        stream_copy=not argv.no_stream_copy,
+        render_segments=argv.render_segments,
+        checkpoint_seconds=argv.checkpoint_interval,
+        renditions=tuple(argv.rendition),
+        audio_rendition=argv.audio_rendition,
+        streaming_format=argv.streaming_format
+    )
+
     logging.basicConfig(level=argv.log_level)
-    result = await postprocess_recording(argv.recording_directory)
+    result = await postprocess_recording(argv.recording_directory, options=options)
     print(f"Result: {result.reason.name}, output = {result.output_file}")
 
 if __name__ == "__main__":
@@ -0,0 +1,215 @@
+# pylint: disable=line-too-long
+# pylint: disable=missing-function-docstring
+# pylint: disable=missing-module-docstring
+
+import errno
+import os
+from pathlib import Path
+import tempfile
+
+import pytest
+from pytest_mock import MockerFixture
+
+from ise_record.assembly import (
+    AssemblyState,
+    append_file,
+    append_ready_chunks,
+    assembled_chunks,
+    assembled_track,
+    chunk_index,
+    read_assembly_state
+)
+
+def _write_chunk(track_path: Path, index: int, data: bytes) -> None:
+    with open(track_path / f"chunk.{index:04d}", "wb") as chunk:
+        chunk.write(data)
+
+def test_chunk_index():
+    assert chunk_index(Path("foo/chunk.0000")) == 0
+    assert chunk_index(Path("foo/chunk.0042")) == 42
+    assert chunk_index(Path("foo/chunk.12345")) == 12345
+    assert chunk_index(Path("foo/full.webm")) is None
+    assert chunk_index(Path("foo/chunk.0001.upload")) is None
+    assert chunk_index(Path("foo/.chunk.0001.upload")) is None
+
+@pytest.mark.asyncio
+async def test_append_in_order():
+    with tempfile.TemporaryDirectory() as tempdir:
+        track_path = Path(tempdir)
+
+        _write_chunk(track_path, 0, b"foo")
+        state = await append_ready_chunks(track_path, 4)
+        assert state == AssemblyState(next_index=1, size=3)
+
+        _write_chunk(track_path, 1, b"bar")
+        state = await append_ready_chunks(track_path, 4)
+        assert state == AssemblyState(next_index=2, size=6)
+
+        assert read_assembly_state(track_path) == state
+        assert assembled_track(track_path) == track_path / "full.webm"
+
+        with open(track_path / "full.webm", "rb") as full:
+            assert full.read() == b"foobar"
+
+@pytest.mark.asyncio
+async def test_append_out_of_order():
+    with tempfile.TemporaryDirectory() as tempdir:
+        track_path = Path(tempdir)
+
+        _write_chunk(track_path, 1, b"bar")
+        _write_chunk(track_path, 2, b"baz")
+        state = await append_ready_chunks(track_path, 4)
+
+        assert state == AssemblyState(next_index=0, size=0)
+        assert not os.path.exists(track_path / "full.webm")
+        assert assembled_track(track_path) is None
+
+        _write_chunk(track_path, 0, b"foo")
+        state = await append_ready_chunks(track_path, 4)
+
+        assert state == AssemblyState(next_index=3, size=9)
+
+        with open(track_path / "full.webm", "rb") as full:
+            assert full.read() == b"foobarbaz"
+
+@pytest.mark.asyncio
+async def test_append_truncates_partial_append():
+    with tempfile.TemporaryDirectory() as tempdir:
+        track_path = Path(tempdir)
+
+        _write_chunk(track_path, 0, b"foo")
+        await append_ready_chunks(track_path, 4)
+
+        # simulate a crash halfway through appending the next chunk
+        with open(track_path / "full.webm", "ab") as full:
+            full.write(b"ba")
+
+        _write_chunk(track_path, 1, b"bar")
+        state = await append_ready_chunks(track_path, 4)
+
+        assert state == AssemblyState(next_index=2, size=6)
+
+        with open(track_path / "full.webm", "rb") as full:
+            assert full.read() == b"foobar"
+
+@pytest.mark.asyncio
+async def test_append_restarts_after_removal():
+    with tempfile.TemporaryDirectory() as tempdir:
+        track_path = Path(tempdir)
+
+        _write_chunk(track_path, 0, b"foo")
+        await append_ready_chunks(track_path, 4)
+        os.unlink(track_path / "full.webm")
+
+        assert assembled_track(track_path) is None
+
+        _write_chunk(track_path, 1, b"bar")
+        state = await append_ready_chunks(track_path, 4)
+
+        assert state == AssemblyState(next_index=2, size=6)
+
+        with open(track_path / "full.webm", "rb") as full:
+            assert full.read() == b"foobar"
+
+@pytest.mark.asyncio
+async def test_assembled_track_with_gap():
+    with tempfile.TemporaryDirectory() as tempdir:
+        track_path = Path(tempdir)
+
+        _write_chunk(track_path, 0, b"foo")
+        _write_chunk(track_path, 2, b"baz")
+        await append_ready_chunks(track_path, 4)
+
+        assert assembled_track(track_path) is None
+
+@pytest.mark.asyncio
+async def test_assembled_chunks():
+    with tempfile.TemporaryDirectory() as tempdir:
+        track_path = Path(tempdir)
+
+        assert assembled_chunks(track_path) == 0
+
+        _write_chunk(track_path, 0, b"foo")
+        _write_chunk(track_path, 1, b"bar")
+        await append_ready_chunks(track_path, 4)
+
+        assert assembled_chunks(track_path) == 2
+
+        # the state alone doesn't count without the file it describes
+        with open(track_path / "full.webm", "ab") as full:
+            full.write(b"baz")
+
+        assert assembled_chunks(track_path) == 0
+
+        os.unlink(track_path / "full.webm")
+
+        assert assembled_chunks(track_path) == 0
+
+def _append_files(target_path: Path, sources: list[Path]) -> int:
+    dest_fd = os.open(target_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC)
+
+    try:
+        return sum(append_file(dest_fd, src) for src in sources)
+    finally:
+        os.close(dest_fd)
+
+def test_append_file():
+    first_data = bytes(range(256)) * 4096
+    second_data = bytes(range(255, -1, -1))
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        track_path = Path(tempdir)
+        (track_path / "chunk.0000").write_bytes(first_data)
+        (track_path / "chunk.0001").write_bytes(second_data)
+
+        copied = _append_files(track_path / "full.webm", [ track_path / "chunk.0000", track_path / "chunk.0001" ])
+
+        assert copied == len(first_data) + len(second_data)
+        assert (track_path / "full.webm").read_bytes() == first_data + second_data
+
+def test_append_file_fallback(mocker: MockerFixture):
+    data = bytes(range(256)) * 4096
+
+    def unsupported(*_):
+        raise OSError(errno.EXDEV, "cross-device link")
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        track_path = Path(tempdir)
+        (track_path / "chunk.0000").write_bytes(data)
+
+        mock_copy_file_range = mocker.patch("os.copy_file_range", side_effect=unsupported, create=True)
+        mock_sendfile = mocker.patch("os.sendfile", side_effect=unsupported, create=True)
+
+        assert _append_files(track_path / "full.webm", [ track_path / "chunk.0000" ]) == len(data)
+        assert (track_path / "full.webm").read_bytes() == data
+
+        mock_copy_file_range.assert_called_once()
+        mock_sendfile.assert_called_once()
+
+def test_append_file_partial_kernel_copy(mocker: MockerFixture):
+    data = bytes(range(256)) * 4096
+    real_copy_file_range = os.copy_file_range
+
+    def stops_early(src_fd: int, dest_fd: int, count: int) -> int:
+        if os.lseek(src_fd, 0, os.SEEK_CUR) >= 1000:
+            return 0
+        return real_copy_file_range(src_fd, dest_fd, min(count, 1000))
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        track_path = Path(tempdir)
+        (track_path / "chunk.0000").write_bytes(data)
+
+        mocker.patch("os.copy_file_range", side_effect=stops_early)
+
+        assert _append_files(track_path / "full.webm", [ track_path / "chunk.0000" ]) == len(data)
+        assert (track_path / "full.webm").read_bytes() == data
+
+def test_append_file_error(mocker: MockerFixture):
+    with tempfile.TemporaryDirectory() as tempdir:
+        track_path = Path(tempdir)
+        (track_path / "chunk.0000").write_bytes(b"foo")
+
+        mocker.patch("os.copy_file_range", side_effect=OSError(errno.ENOSPC, "no space left on device"), create=True)
+
+        with pytest.raises(OSError):
+            _append_files(track_path / "full.webm", [ track_path / "chunk.0000" ])
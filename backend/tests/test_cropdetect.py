@@ -0,0 +1,226 @@
+# pylint: disable=line-too-long
+# pylint: disable=missing-function-docstring
+# pylint: disable=missing-module-docstring
+
+import asyncio
+import os
+from pathlib import Path
+import tempfile
+from typing import Callable
+from unittest.mock import AsyncMock
+
+import pytest
+from pytest_mock import MockerFixture
+
+from ise_record.cropdetect import (
+    cached_video_properties,
+    CropCache,
+    CropdetectAggregator,
+    determine_crop_area,
+    MAX_CONCURRENT_SAMPLES,
+    read_crop_cache,
+    Rectangle,
+    update_crop_cache,
+    video_properties,
+    VideoProperties
+)
+
+def test_determine_crop_area():
+    width, height = 1920, 1080
+    crop_none = Rectangle(width = 1920, height = 1080, left = 0, top = 0)
+    crop_letter = Rectangle(width = 1920, height = 720, left = 0, top = 180)
+    crop_pillar = Rectangle(width = 1600, height = 1080, left = 160, top = 0)
+
+    crop_letter_insignificant = Rectangle(width = 1920, height = 1070, left = 0, top = 5)
+    crop_pillar_insignificant = Rectangle(width = 1901, height = 1080, left = 10, top = 0)
+
+    assert determine_crop_area(width, height, crop_none) == crop_none
+    assert determine_crop_area(width, height, crop_letter) == crop_letter
+    assert determine_crop_area(width, height, crop_pillar) == crop_pillar
+
+    assert determine_crop_area(width, height, crop_letter_insignificant) == crop_none
+    assert determine_crop_area(width, height, crop_pillar_insignificant) == crop_none
+
+@pytest.mark.asyncio
+async def test_video_properties():
+    sample_path = Path(os.path.dirname(__file__)) / "assets" / "sample.webm"
+
+    info = await video_properties(sample_path)
+
+    print(info)
+
+    assert info.width == 480
+    assert info.height == 270
+
+    assert info.needs_cropping()
+    assert info.crop.width == 217
+    assert info.crop.height == 170
+    assert info.crop.left == 125
+    assert info.crop.top == 53
+
+def test_cropdetect_aggregator():
+    aggregator = CropdetectAggregator()
+
+    for line in [
+        b"packet|pts_time=0.000000\n",
+        b"packet|pts_time=0.033000|tag:lavfi.cropdetect.x1=200|tag:lavfi.cropdetect.y1=0|tag:lavfi.cropdetect.x2=1700|tag:lavfi.cropdetect.y2=1079\n",
+        b"packet|pts_time=N/A|tag:lavfi.cropdetect.x1=160|tag:lavfi.cropdetect.y1=2|tag:lavfi.cropdetect.x2=1750|tag:lavfi.cropdetect.y2=1077\n",
+        b"packet|pts_time=99.5\n",
+        b"stream|codec_type=audio\n",
+        b"stream|codec_type=video|width=1920|height=1080\n",
+    ]:
+        aggregator(line)
+
+    assert aggregator.width == 1920
+    assert aggregator.height == 1080
+    assert aggregator.duration == 99.5
+    assert aggregator.raw_crop_area(1920, 1080) == Rectangle(left=160, top=0, width=1591, height=1080)
+
+def test_cropdetect_aggregator_nothing_detected():
+    aggregator = CropdetectAggregator()
+    aggregator(b"stream|width=1920|height=1080\n")
+
+    assert aggregator.width == 1920
+    assert aggregator.duration is None
+    assert determine_crop_area(1920, 1080, aggregator.raw_crop_area(1920, 1080)) == Rectangle(left=0, top=0, width=1920, height=1080)
+
+@pytest.mark.asyncio
+async def test_video_properties_sampled(mocker: MockerFixture):
+    def tags(x1: int, y1: int, x2: int, y2: int):
+        return f"|tag:lavfi.cropdetect.x1={x1}|tag:lavfi.cropdetect.y1={y1}|tag:lavfi.cropdetect.x2={x2}|tag:lavfi.cropdetect.y2={y2}"
+
+    outputs = [
+        [ "packet|pts_time=0.0", "packet|pts_time=100.0", "stream|codec_type=video|width=1920|height=1080" ],
+        [ "packet|pts_time=25.0", "packet|pts_time=25.1" + tags(200, 0, 1700, 1079) ],
+        [ "packet|pts_time=120.0" + tags(160, 2, 1750, 1077) ],
+    ]
+
+    async def mock_command(_: list[str], on_output_line: Callable[[bytes], None]) -> bytes:
+        for line in outputs.pop(0):
+            on_output_line(f"{line}\n".encode())
+        return b""
+
+    mock_run_command = mocker.patch("ise_record.cropdetect.run_command", AsyncMock(side_effect=mock_command))
+
+    info = await video_properties(Path("foo/full.webm"), crop_detect_samples=2, crop_detect_frames=7)
+
+    assert info == VideoProperties(
+        width=1920,
+        height=1080,
+        crop=Rectangle(left=160, top=0, width=1591, height=1080),
+        duration=100.0
+    )
+
+    commands = [ c.args[0] for c in mock_run_command.call_args_list ]
+    assert commands[0][-1] == "foo/full.webm"
+    assert "movie=foo/full.webm:seek_point=25.000,cropdetect" in commands[1]
+    assert "movie=foo/full.webm:seek_point=75.000,cropdetect" in commands[2]
+    assert "%+#7" in commands[1]
+
+@pytest.mark.asyncio
+async def test_video_properties_full_cropdetect(mocker: MockerFixture):
+    async def full_cropdetect(_: Path, aggregator: CropdetectAggregator) -> None:
+        for line in [
+            "stream|codec_type=video|width=1920|height=1080",
+            "packet|pts_time=0.0|tag:lavfi.cropdetect.x1=200|tag:lavfi.cropdetect.y1=0|tag:lavfi.cropdetect.x2=1700|tag:lavfi.cropdetect.y2=1079",
+            "packet|pts_time=90.5|tag:lavfi.cropdetect.x1=160|tag:lavfi.cropdetect.y1=2|tag:lavfi.cropdetect.x2=1750|tag:lavfi.cropdetect.y2=1077"
+        ]:
+            aggregator(f"{line}\n".encode())
+
+    mock_full = mocker.patch("ise_record.cropdetect._full_cropdetect", AsyncMock(side_effect=full_cropdetect))
+    mock_geometry = mocker.patch("ise_record.cropdetect._stream_geometry", AsyncMock())
+
+    info = await video_properties(Path("foo/full.webm"), crop_detect_samples=0)
+
+    assert info == VideoProperties(
+        width=1920,
+        height=1080,
+        crop=Rectangle(left=160, top=0, width=1591, height=1080),
+        duration=90.5
+    )
+    mock_full.assert_called_once()
+    mock_geometry.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_video_properties_sample_concurrency(mocker: MockerFixture):
+    running = 0
+    max_running = 0
+
+    async def sampled_cropdetect(_path: Path, _timestamp: float, _frames: int, _aggregator: CropdetectAggregator) -> None:
+        nonlocal running, max_running
+        running += 1
+        max_running = max(max_running, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+
+    async def stream_geometry(_path: Path, aggregator: CropdetectAggregator) -> None:
+        aggregator(b"stream|codec_type=video|width=1920|height=1080\n")
+        aggregator(b"packet|pts_time=100.0\n")
+
+    mocker.patch("ise_record.cropdetect._stream_geometry", stream_geometry)
+    mocker.patch("ise_record.cropdetect.sampled_cropdetect", sampled_cropdetect)
+
+    info = await video_properties(Path("foo/full.webm"), crop_detect_samples=20)
+
+    assert info.width == 1920
+    assert max_running == MAX_CONCURRENT_SAMPLES
+
+@pytest.mark.asyncio
+async def test_update_crop_cache(mocker: MockerFixture):
+    def probe_output(x1: int, y1: int, x2: int, y2: int):
+        return [
+            "stream|codec_type=video|width=1920|height=1080",
+            f"packet|pts_time=1.0|tag:lavfi.cropdetect.x1={x1}|tag:lavfi.cropdetect.y1={y1}|tag:lavfi.cropdetect.x2={x2}|tag:lavfi.cropdetect.y2={y2}"
+        ]
+
+    outputs = [ probe_output(200, 0, 1700, 1079), probe_output(160, 2, 1750, 1077) ]
+
+    async def mock_command(_: list[str], on_output_line: Callable[[bytes], None]) -> bytes:
+        for line in outputs.pop(0):
+            on_output_line(f"{line}\n".encode())
+        return b""
+
+    mock_run_command = mocker.patch("ise_record.cropdetect.run_command", AsyncMock(side_effect=mock_command))
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        track_path = Path(tempdir)
+
+        assert read_crop_cache(track_path) is None
+        assert cached_video_properties(track_path) is None
+
+        cache = await update_crop_cache(track_path, 12, 5.0, 10)
+
+        assert cache == CropCache(width=1920, height=1080, crop=Rectangle(left=200, top=0, width=1501, height=1080), analyzed_chunks=12, chunk_seconds=5.0)
+        assert read_crop_cache(track_path) == cache
+        assert "movie=" + str(track_path / "full.webm") + ":seek_point=30.000,cropdetect" in mock_run_command.call_args.args[0]
+
+        # nothing new to analyze
+        assert await update_crop_cache(track_path, 12, 5.0, 10) == cache
+        assert mock_run_command.call_count == 1
+
+        cache = await update_crop_cache(track_path, 24, 5.0, 10)
+
+        assert cache == CropCache(width=1920, height=1080, crop=Rectangle(left=160, top=0, width=1591, height=1080), analyzed_chunks=24, chunk_seconds=5.0)
+        assert "movie=" + str(track_path / "full.webm") + ":seek_point=90.000,cropdetect" in mock_run_command.call_args.args[0]
+
+        for ix in range(25):
+            (track_path / f"chunk.{ix:04d}").touch()
+
+        assert cached_video_properties(track_path) == VideoProperties(
+            width=1920,
+            height=1080,
+            crop=Rectangle(left=160, top=0, width=1591, height=1080),
+            duration=125.0
+        )
+
+@pytest.mark.asyncio
+async def test_update_crop_cache_nothing_detected(mocker: MockerFixture):
+    async def mock_command(_: list[str], on_output_line: Callable[[bytes], None]) -> bytes:
+        on_output_line(b"stream|codec_type=video|width=1920|height=1080\n")
+        return b""
+
+    mocker.patch("ise_record.cropdetect.run_command", AsyncMock(side_effect=mock_command))
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        assert await update_crop_cache(Path(tempdir), 12, 5.0, 10) is None
+        assert read_crop_cache(Path(tempdir)) is None
@@ -0,0 +1,31 @@
+# pylint: disable=line-too-long
+# pylint: disable=missing-function-docstring
+# pylint: disable=missing-module-docstring
+
+from ise_record.encoders import DEFAULT_ENCODER_PROFILE, encoder_args, EncoderProfile, ENCODER_PROFILES, video_encoder_args
+
+def test_encoder_args():
+    profile = EncoderProfile(container="webm", video=[ "-c:v", "libvpx-vp9" ], audio=[ "-c:a", "libopus" ])
+
+    assert encoder_args(profile) == [ "-c:v", "libvpx-vp9", "-c:a", "libopus" ]
+    assert encoder_args(profile, 8) == [ "-c:v", "libvpx-vp9", "-threads", "8", "-c:a", "libopus" ]
+
+def test_video_encoder_args():
+    profile = EncoderProfile(container="webm", video=[ "-c:v", "libvpx-vp9" ], audio=[ "-c:a", "libopus" ])
+
+    assert video_encoder_args(profile) == [ "-c:v", "libvpx-vp9" ]
+    assert video_encoder_args(profile, 8) == [ "-c:v", "libvpx-vp9", "-threads", "8" ]
+    assert video_encoder_args(profile, keyframe_interval=180) == [ "-c:v", "libvpx-vp9", "-g", "180" ]
+
+def test_builtin_profiles():
+    assert DEFAULT_ENCODER_PROFILE in ENCODER_PROFILES
+
+    for profile in ENCODER_PROFILES.values():
+        assert "-c:v" in profile.video
+        assert "-c:a" in profile.audio
+
+    # faststart is an option of the MP4 muxer, not of the audio stream
+    assert ENCODER_PROFILES["h264"].container == "mp4"
+    assert ENCODER_PROFILES["h264"].muxer == ( "-movflags", "+faststart" )
+    assert "-movflags" not in ENCODER_PROFILES["h264"].audio
+    assert ENCODER_PROFILES["vp9"].muxer == ()
@@ -0,0 +1,56 @@
+# pylint: disable=line-too-long
+# pylint: disable=missing-function-docstring
+# pylint: disable=missing-module-docstring
+
+from pathlib import Path
+from subprocess import CalledProcessError
+from typing import Callable
+from unittest.mock import AsyncMock
+
+import pytest
+from pytest_mock import MockerFixture
+
+from ise_record.ffmpeg import keyframe_times, media_duration, run_command
+
+@pytest.mark.asyncio
+async def testrun_command():
+    res = await run_command([ "/usr/bin/env", "echo", "Hello, world." ])
+    assert res == b"Hello, world.\n"
+
+@pytest.mark.asyncio
+async def test_run_command_error():
+    with pytest.raises(CalledProcessError) as ex:
+        await run_command([ "/usr/bin/env", "false", "foo", "bar" ])
+
+    assert ex.value.stdout == b""
+    assert ex.value.stderr == b""
+    assert ex.value.cmd == [ "/usr/bin/env", "false", "foo", "bar" ]
+    assert ex.value.returncode != 0
+
+@pytest.mark.asyncio
+async def test_run_command_line_callback():
+    lines: list[bytes] = []
+
+    res = await run_command([ "/usr/bin/env", "printf", "foo\\nbar\\n" ], lines.append)
+
+    assert res == b""
+    assert lines == [ b"foo\n", b"bar\n" ]
+
+@pytest.mark.asyncio
+async def test_keyframe_times(mocker: MockerFixture):
+    async def mock_command(_: list[str], on_output_line: Callable[[bytes], None]) -> bytes:
+        for line in [ "0.000000,K__", "0.033000,___", "10.000000,K__", "N/A,K__", "5.000000,K_D" ]:
+            on_output_line(f"{line}\n".encode())
+        return b""
+
+    mocker.patch("ise_record.ffmpeg.run_command", AsyncMock(side_effect=mock_command))
+
+    assert await keyframe_times(Path("foo/full.webm")) == [ 0.0, 5.0, 10.0 ]
+
+@pytest.mark.asyncio
+async def test_media_duration(mocker: MockerFixture):
+    mock_run_command = mocker.patch("ise_record.ffmpeg.run_command", AsyncMock(side_effect=[ b"9.966000\n", b"N/A\n" ]))
+
+    assert await media_duration(Path("foo/segment.webm")) == 9.966
+    assert await media_duration(Path("foo/segment.webm")) is None
+    assert mock_run_command.call_args.args[0] == [ "ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "csv=p=0", "foo/segment.webm" ]
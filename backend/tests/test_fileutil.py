@@ -0,0 +1,37 @@
+# pylint: disable=missing-function-docstring
+# pylint: disable=missing-module-docstring
+
+import os
+from pathlib import Path
+import tempfile
+
+import pytest
+from pytest_mock import MockerFixture
+
+from ise_record.fileutil import write_atomically
+
+def test_write_atomically():
+    with tempfile.TemporaryDirectory() as tempdir:
+        path = Path(tempdir) / "state.json"
+
+        write_atomically(path, "foo")
+        assert path.read_text(encoding="utf-8") == "foo"
+
+        write_atomically(path, "bar")
+        assert path.read_text(encoding="utf-8") == "bar"
+
+        assert os.listdir(tempdir) == [ "state.json" ]
+
+def test_write_atomically_failure(mocker: MockerFixture):
+    with tempfile.TemporaryDirectory() as tempdir:
+        path = Path(tempdir) / "state.json"
+        path.write_text("foo", encoding="utf-8")
+
+        mocker.patch("os.replace", side_effect=OSError("disk full"))
+
+        with pytest.raises(OSError):
+            write_atomically(path, "bar")
+
+        # the old content survives and the temporary file is cleaned up
+        assert path.read_text(encoding="utf-8") == "foo"
+        assert os.listdir(tempdir) == [ "state.json" ]
@@ -0,0 +1,391 @@
+# pylint: disable=line-too-long
+# pylint: disable=missing-function-docstring
+# pylint: disable=missing-module-docstring
+
+import asyncio
+from datetime import datetime, timedelta, timezone
+import json
+from pathlib import Path
+import tempfile
+from typing import List
+
+import pytest
+
+from ise_record.jobs import JobQueue, JobRecord, JobState, ProgressWriter
+from ise_record.postprocess import Result, ResultReason, StageStats
+from ise_record.progress import Phase, Progress, ProgressCallback
+
+class RecordingRunner: # pylint: disable=too-few-public-methods
+    """ Job runner that remembers the jobs it ran and can be held up """
+
+    def __init__(self):
+        self.ran: List[str] = []
+        self.release = asyncio.Event()
+        self.release.set()
+
+    async def __call__(self, record: JobRecord, _: ProgressCallback) -> None:
+        await self.release.wait()
+        self.ran.append(record.recording)
+
+async def _drain(queue: JobQueue, count: int) -> None:
+    for _ in range(100):
+        if sum(1 for r in queue.jobs() if r.state in (JobState.DONE, JobState.FAILED)) >= count:
+            return
+        await asyncio.sleep(0.01)
+
+    raise AssertionError("jobs did not finish")
+
+@pytest.mark.asyncio
+async def test_fifo_order():
+    with tempfile.TemporaryDirectory() as tempdir:
+        runner = RecordingRunner()
+        queue = JobQueue(Path(tempdir), workers=1, ordering="fifo", runner=runner)
+
+        queue.submit("foo", None, 0)
+        queue.submit("bar", None, 10)
+        queue.submit("baz", None, 5)
+
+        await queue.start()
+        await _drain(queue, 3)
+        await queue.stop()
+
+        assert runner.ran == [ "foo", "bar", "baz" ]
+        assert all(r.state == JobState.DONE for r in queue.jobs())
+
+@pytest.mark.asyncio
+async def test_priority_order():
+    with tempfile.TemporaryDirectory() as tempdir:
+        runner = RecordingRunner()
+        queue = JobQueue(Path(tempdir), workers=1, ordering="priority", runner=runner)
+
+        queue.submit("foo", None, 0)
+        queue.submit("bar", None, 10)
+        queue.submit("baz", None, 5)
+        queue.submit("qux", None, 10)
+
+        await queue.start()
+        await _drain(queue, 4)
+        await queue.stop()
+
+        assert runner.ran == [ "bar", "qux", "baz", "foo" ]
+
+@pytest.mark.asyncio
+async def test_worker_limit():
+    with tempfile.TemporaryDirectory() as tempdir:
+        runner = RecordingRunner()
+        runner.release.clear()
+        queue = JobQueue(Path(tempdir), workers=2, ordering="fifo", runner=runner)
+
+        for name in [ "foo", "bar", "baz" ]:
+            queue.submit(name, None, 0)
+
+        await queue.start()
+        await asyncio.sleep(0.05)
+
+        assert [ r.state for r in queue.jobs() ] == [ JobState.RUNNING, JobState.RUNNING, JobState.PENDING ]
+
+        runner.release.set()
+        await _drain(queue, 3)
+        await queue.stop()
+
+@pytest.mark.asyncio
+async def test_failed_job():
+    with tempfile.TemporaryDirectory() as tempdir:
+        async def failing_runner(_record: JobRecord, _progress: ProgressCallback) -> None:
+            raise RuntimeError("oops")
+
+        queue = JobQueue(Path(tempdir), workers=1, ordering="fifo", runner=failing_runner)
+        record = queue.submit("foo", None, 0)
+
+        await queue.start()
+        await _drain(queue, 1)
+        await queue.stop()
+
+        failed = queue.get(record.id)
+        assert failed is not None
+        assert failed.state == JobState.FAILED
+        assert failed.finished is not None
+
+@pytest.mark.asyncio
+async def test_failed_result():
+    with tempfile.TemporaryDirectory() as tempdir:
+        reasons = [ ResultReason.FAILURE, ResultReason.MAIN_STREAM_MISSING, ResultReason.SUCCESS ]
+
+        async def runner(_record: JobRecord, _progress: ProgressCallback) -> Result:
+            return Result(output_file=None, reason=reasons.pop(0))
+
+        queue = JobQueue(Path(tempdir), workers=1, ordering="fifo", runner=runner)
+        records = [ queue.submit(recording, None, 0) for recording in [ "foo", "bar", "baz" ] ]
+
+        await queue.start()
+        await _drain(queue, 3)
+        await queue.stop()
+
+        states = [ queue.get(r.id).state for r in records ] # type: ignore[union-attr]
+        assert states == [ JobState.FAILED, JobState.FAILED, JobState.DONE ]
+
+@pytest.mark.asyncio
+async def test_stage_stats_kept_with_job():
+    stages = (
+        StageStats(phase=Phase.CONCAT, wall_seconds=1.5, cpu_seconds=0.5, bytes_read=0, bytes_written=4096, bitrate=2000.0),
+        StageStats(phase=Phase.RENDER, wall_seconds=60.0, cpu_seconds=240.0, bytes_read=4096, bytes_written=2048)
+    )
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        async def runner(_record: JobRecord, _progress: ProgressCallback) -> Result:
+            return Result(output_file=Path("foo/presentation.webm"), reason=ResultReason.SUCCESS, stages=stages)
+
+        queue = JobQueue(Path(tempdir), workers=1, ordering="fifo", runner=runner)
+        record = queue.submit("foo", None, 0)
+
+        await queue.start()
+        await _drain(queue, 1)
+        await queue.stop()
+
+        # stages survive a restart, too
+        done = JobQueue(Path(tempdir), workers=1, ordering="fifo", runner=runner).get(record.id)
+        assert done is not None
+        assert [ (s.phase, s.cpu_seconds, s.bitrate) for s in done.stages ] == [ (Phase.CONCAT, 0.5, 2000.0), (Phase.RENDER, 240.0, None) ]
+
+@pytest.mark.asyncio
+async def test_resume_after_restart():
+    with tempfile.TemporaryDirectory() as tempdir:
+        runner = RecordingRunner()
+        runner.release.clear()
+        queue = JobQueue(Path(tempdir), workers=1, ordering="fifo", runner=runner)
+
+        first = queue.submit("foo", "foo@bar.de", 0, "h264")
+        second = queue.submit("bar", None, 0)
+
+        await queue.start()
+        await asyncio.sleep(0.05)
+        await queue.stop()
+
+        assert not runner.ran
+
+        # job files survive, the interrupted job is resumed first
+        restarted_runner = RecordingRunner()
+        restarted = JobQueue(Path(tempdir), workers=1, ordering="fifo", runner=restarted_runner)
+
+        interrupted = restarted.get(first.id)
+        assert interrupted is not None
+        assert interrupted.state == JobState.RUNNING
+        assert interrupted.recipient == "foo@bar.de"
+        assert interrupted.encoder_profile == "h264"
+
+        await restarted.start()
+        await _drain(restarted, 2)
+        await restarted.stop()
+
+        assert restarted_runner.ran == [ "foo", "bar" ]
+        assert restarted.get(second.id).state == JobState.DONE # type: ignore
+
+@pytest.mark.asyncio
+async def test_resumed_job_is_pending():
+    with tempfile.TemporaryDirectory() as tempdir:
+        runner = RecordingRunner()
+        runner.release.clear()
+        queue = JobQueue(Path(tempdir), workers=1, ordering="fifo", runner=runner)
+
+        first = queue.submit("foo", None, 0)
+        queue.submit("bar", None, 0)
+
+        await queue.start()
+        await asyncio.sleep(0.05)
+        await queue.stop()
+
+        restarted = JobQueue(Path(tempdir), workers=0, ordering="fifo", runner=RecordingRunner())
+
+        await restarted.start()
+
+        # the job is pending until a worker picks it up again, as seen by every lookup
+        resumed = restarted.get(first.id)
+        assert resumed is not None
+        assert resumed.state == JobState.PENDING
+        assert resumed.started is None
+        assert restarted.latest_for("foo") == resumed
+        assert [ r.state for r in restarted.jobs() ] == [ JobState.PENDING, JobState.PENDING ]
+
+        await restarted.stop()
+
+@pytest.mark.asyncio
+async def test_finished_jobs_expire():
+    with tempfile.TemporaryDirectory() as tempdir:
+        queue = JobQueue(Path(tempdir), workers=1, ordering="fifo", runner=RecordingRunner())
+
+        old = queue.submit("foo", None, 0)
+        recent = queue.submit("bar", None, 0)
+
+        await queue.start()
+        await _drain(queue, 2)
+        await queue.stop()
+
+        # backdate the first job as if it had finished long ago
+        job_path = Path(tempdir) / f"{old.id}.json"
+        raw = json.loads(job_path.read_text(encoding="utf-8"))
+        raw["finished"] = (datetime.now(timezone.utc) - timedelta(days=31)).isoformat()
+        job_path.write_text(json.dumps(raw), encoding="utf-8")
+
+        restarted_runner = RecordingRunner()
+        restarted_runner.release.clear()
+        restarted = JobQueue(
+            Path(tempdir), workers=1, ordering="fifo", runner=restarted_runner,
+            retention=timedelta(days=30)
+        )
+        pending = restarted.submit("baz", None, 0)
+
+        await restarted.start()
+
+        # finished jobs past the retention period are gone, recent and unfinished ones are kept
+        assert not job_path.exists()
+        assert restarted.get(old.id) is None
+        assert [ r.id for r in restarted.jobs() ] == [ recent.id, pending.id ]
+
+        restarted_runner.release.set()
+        await _drain(restarted, 2)
+        await restarted.stop()
+
+@pytest.mark.asyncio
+async def test_progress_of_running_job():
+    with tempfile.TemporaryDirectory() as tempdir:
+        release = asyncio.Event()
+
+        async def runner(_: JobRecord, progress: ProgressCallback) -> None:
+            progress(Progress(phase=Phase.RENDER, percent=40.0, fps=50.0, speed=1.5, eta=60.0))
+            await release.wait()
+
+        queue = JobQueue(Path(tempdir), workers=1, ordering="fifo", runner=runner)
+        record = queue.submit("foo", None, 0)
+
+        assert queue.latest_for("foo").progress is None # type: ignore
+
+        await queue.start()
+        await asyncio.sleep(0.05)
+
+        running = queue.latest_for("foo")
+        assert running is not None
+        assert running.state == JobState.RUNNING
+        assert running.progress is not None
+        assert running.progress.phase == Phase.RENDER
+        assert running.progress.percent == 40.0
+        assert running.progress.eta == 60.0
+
+        release.set()
+        await _drain(queue, 1)
+        await queue.stop()
+
+        finished = queue.get(record.id)
+        assert finished is not None
+        assert finished.progress is not None
+        assert finished.progress.percent == 40.0
+        assert not (Path(tempdir) / "progress" / f"{record.id}.json").exists()
+
+def test_progress_writer_rate_limit():
+    with tempfile.TemporaryDirectory() as tempdir:
+        path = Path(tempdir) / "progress.json"
+        writer = ProgressWriter(path, min_interval=3600)
+
+        writer(Progress(phase=Phase.RENDER, percent=10.0))
+        writer(Progress(phase=Phase.RENDER, percent=20.0))
+        assert '"percent":10.0' in path.read_text()
+
+        writer(Progress(phase=Phase.RENDER, percent=100.0))
+        assert '"percent":100.0' in path.read_text()
+
+def test_latest_for():
+    with tempfile.TemporaryDirectory() as tempdir:
+        queue = JobQueue(Path(tempdir), workers=1, ordering="fifo", runner=RecordingRunner())
+
+        assert queue.latest_for("foo") is None
+
+        queue.submit("foo", None, 0)
+        queue.submit("bar", None, 0)
+        latest = queue.submit("foo", None, 0, "h264")
+
+        assert queue.latest_for("foo") == latest
+
+@pytest.mark.asyncio
+async def test_duplicate_submission():
+    with tempfile.TemporaryDirectory() as tempdir:
+        runner = RecordingRunner()
+        runner.release.clear()
+        queue = JobQueue(Path(tempdir), workers=2, ordering="fifo", runner=runner)
+
+        first = queue.submit("foo", "foo@bar.de", 0)
+
+        # a retried request gets the pending job
+        assert queue.submit("foo", "foo@bar.de", 5).id == first.id
+
+        # another recipient is notified by the same job
+        assert queue.submit("foo", "baz@bar.de", 0).id == first.id
+        assert queue.submit("foo", None, 0).id == first.id
+
+        # another encoder profile is a different job
+        other_profile = queue.submit("foo", "foo@bar.de", 0, "h264")
+        assert other_profile.id != first.id
+
+        await queue.start()
+        await asyncio.sleep(0.05)
+
+        # ... and the running one
+        assert queue.submit("foo", "qux@bar.de", 0).id == first.id
+        assert len(queue.jobs()) == 2
+
+        merged = queue.get(first.id)
+        assert merged is not None
+        assert merged.recipient == "foo@bar.de"
+        assert merged.merged_recipients == [ "baz@bar.de", "qux@bar.de" ]
+
+        runner.release.set()
+        await _drain(queue, 2)
+
+        # finished jobs can be resubmitted
+        assert queue.submit("foo", "foo@bar.de", 0).id != first.id
+
+        await _drain(queue, 3)
+        await queue.stop()
+
+        assert runner.ran == [ "foo" ] * 3
+
+def test_duplicate_submission_default_profile():
+    with tempfile.TemporaryDirectory() as tempdir:
+        queue = JobQueue(Path(tempdir), workers=1, ordering="fifo", runner=RecordingRunner(), default_encoder_profile="vp9")
+
+        first = queue.submit("foo", None, 0)
+
+        # naming the default profile is the same job as leaving it out, and vice versa
+        assert first.encoder_profile == "vp9"
+        assert queue.submit("foo", None, 0, "vp9").id == first.id
+
+        other = queue.submit("bar", None, 0, "vp9")
+        assert queue.submit("bar", None, 0).id == other.id
+
+        assert len(queue.jobs()) == 2
+
+@pytest.mark.asyncio
+async def test_one_job_per_recording():
+    with tempfile.TemporaryDirectory() as tempdir:
+        runner = RecordingRunner()
+        runner.release.clear()
+        queue = JobQueue(Path(tempdir), workers=2, ordering="fifo", runner=runner)
+
+        first = queue.submit("foo", None, 0)
+        other_profile = queue.submit("foo", None, 0, "h264")
+        other_recording = queue.submit("bar", None, 0)
+
+        await queue.start()
+        await asyncio.sleep(0.05)
+
+        # the second job for foo waits, the free worker goes on with bar
+        states = { r.id: r.state for r in queue.jobs() }
+        assert states == {
+            first.id: JobState.RUNNING,
+            other_profile.id: JobState.PENDING,
+            other_recording.id: JobState.RUNNING
+        }
+
+        runner.release.set()
+        await _drain(queue, 3)
+        await queue.stop()
+
+        assert sorted(runner.ran) == [ "bar", "foo", "foo" ]
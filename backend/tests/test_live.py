@@ -0,0 +1,226 @@
+# pylint: disable=line-too-long
+# pylint: disable=missing-function-docstring
+# pylint: disable=missing-module-docstring
+
+import os
+from pathlib import Path
+import tempfile
+from unittest.mock import AsyncMock, call
+
+import pytest
+from pytest_mock import MockerFixture
+
+from ise_record.assembly import append_ready_chunks
+from ise_record.cropdetect import Rectangle, VideoProperties
+from ise_record.live import render_live_segments
+from ise_record.options import PostprocessingOptions
+from ise_record.postprocess import generate_ffmpeg_filter, postprocess_tracks, ResultReason
+from ise_record.segments import read_segment_manifest, render_key, RenderedSegment, SegmentManifest
+
+STREAM_PROPS = VideoProperties(width=1440, height=810, crop=Rectangle(left=0, top=0, width=1440, height=810))
+
+async def _upload_chunks(track_path: Path, indexes: range) -> None:
+    os.makedirs(track_path, exist_ok=True)
+
+    for i in indexes:
+        (track_path / f"chunk.{i:04d}").write_bytes(b"foo")
+
+    await append_ready_chunks(track_path, 4)
+
+async def _touch_output(command: list[str], *_) -> bytes:
+    Path(command[-1]).write_bytes(b"segment")
+    return b""
+
+@pytest.mark.asyncio
+async def test_render_live_segments(mocker: MockerFixture):
+    mock_run_command = mocker.patch("ise_record.live.run_command", AsyncMock(side_effect=_touch_output))
+    mocker.patch("ise_record.live.media_duration", AsyncMock(return_value=10.0))
+    mocker.patch("ise_record.live.cached_video_properties", return_value=STREAM_PROPS)
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        recording_path = Path(tempdir)
+        segment_dir = recording_path / ".presentation.webm.segments"
+
+        await _upload_chunks(recording_path / "stream", range(5))
+        await _upload_chunks(recording_path / "overlay", range(4))
+
+        # the overlay only covers the first window (with one chunk of slack)
+        rendered = await render_live_segments(recording_path, 5.0, 2)
+
+        assert rendered == [ RenderedSegment(start=0.0, length=10.0, filename="segment.0000.webm") ]
+        assert mock_run_command.call_args.args[0][:9] == [
+            "ffmpeg",
+            "-ss", "0.000", "-t", "10.000", "-i", str(recording_path / "stream" / "full.webm"),
+            "-ss", "0.000"
+        ]
+
+        # ffmpeg's output is streamed rather than collected
+        assert mock_run_command.call_args.args[1] is not None
+
+        await _upload_chunks(recording_path / "overlay", range(4, 7))
+        rendered = await render_live_segments(recording_path, 5.0, 2)
+
+        assert [ s.start for s in rendered ] == [ 0.0, 10.0 ]
+        assert (segment_dir / "segment.0001.webm").is_file()
+        assert read_segment_manifest(segment_dir) == SegmentManifest(
+            render_key=render_key(generate_ffmpeg_filter(STREAM_PROPS, True), PostprocessingOptions()),
+            segments=rendered
+        )
+
+        # nothing new to render
+        mock_run_command.reset_mock()
+        assert await render_live_segments(recording_path, 5.0, 2) == rendered
+        mock_run_command.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_render_live_segments_needs_intact_track(mocker: MockerFixture):
+    mock_run_command = mocker.patch("ise_record.live.run_command", AsyncMock(side_effect=_touch_output))
+    mocker.patch("ise_record.live.media_duration", AsyncMock(return_value=10.0))
+    mocker.patch("ise_record.live.cached_video_properties", return_value=STREAM_PROPS)
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        recording_path = Path(tempdir)
+        stream_path = recording_path / "stream"
+
+        await _upload_chunks(stream_path, range(5))
+
+        # the assembly state claims five chunks, but the file doesn't hold them
+        with open(stream_path / "full.webm", "r+b") as full:
+            full.truncate(3)
+
+        assert await render_live_segments(recording_path, 5.0, 2) == []
+
+        os.unlink(stream_path / "full.webm")
+
+        assert await render_live_segments(recording_path, 5.0, 2) == []
+        mock_run_command.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_render_live_segments_short_segment(mocker: MockerFixture):
+    mocker.patch("ise_record.live.run_command", AsyncMock(side_effect=_touch_output))
+    mocker.patch("ise_record.live.cached_video_properties", return_value=STREAM_PROPS)
+    mock_duration = mocker.patch("ise_record.live.media_duration", AsyncMock(side_effect=[ 8.0, 7.1 ]))
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        recording_path = Path(tempdir)
+        segment_dir = recording_path / ".presentation.webm.segments"
+
+        await _upload_chunks(recording_path / "stream", range(5))
+
+        # the chunks were shorter than nominal, the second window isn't fully there yet
+        rendered = await render_live_segments(recording_path, 4.0, 2)
+
+        assert rendered == [ RenderedSegment(start=0.0, length=8.0, filename="segment.0000.webm") ]
+        assert read_segment_manifest(segment_dir).segments == rendered # type: ignore[union-attr]
+        assert not (segment_dir / "segment.0001.webm").exists()
+        assert mock_duration.call_args_list == [ call(segment_dir / "segment.0000.webm"), call(segment_dir / "segment.0001.webm") ]
+
+        # the window is tried again later
+        mock_duration.side_effect = [ 8.0 ]
+        assert [ s.start for s in await render_live_segments(recording_path, 4.0, 2) ] == [ 0.0, 8.0 ]
+
+@pytest.mark.asyncio
+async def test_render_live_segments_renditions(mocker: MockerFixture):
+    async def touch_outputs(command: list[str], *_) -> bytes:
+        for i, arg in enumerate(command):
+            if arg == "-y":
+                Path(command[i + 1]).write_bytes(b"segment")
+        return b""
+
+    options = PostprocessingOptions(renditions=(1080, 720))
+
+    mocker.patch("ise_record.live.run_command", AsyncMock(side_effect=touch_outputs))
+    mocker.patch("ise_record.live.cached_video_properties", return_value=STREAM_PROPS)
+    mocker.patch("ise_record.live.media_duration", AsyncMock(side_effect=[ 10.0, 7.0 ]))
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        recording_path = Path(tempdir)
+        segment_dir = recording_path / ".presentation.webm.segments"
+        await _upload_chunks(recording_path / "stream", range(5))
+
+        assert len(await render_live_segments(recording_path, 5.0, 2, options)) == 1
+
+        # the short second window is discarded along with its rendition
+        assert sorted(p.name for p in segment_dir.glob("segment.*")) == [ "segment.0000.720p.webm", "segment.0000.webm" ]
+
+        # only renditions below the output height, like the final render, so it can reuse them
+        manifest = read_segment_manifest(segment_dir)
+        assert manifest is not None
+        assert manifest.render_key == render_key(generate_ffmpeg_filter(STREAM_PROPS, False, [ 720 ]), options)
+
+@pytest.mark.asyncio
+async def test_render_live_segments_crop_change(mocker: MockerFixture):
+    cropped_props = VideoProperties(width=1440, height=810, crop=Rectangle(left=120, top=0, width=1200, height=810))
+
+    mocker.patch("ise_record.live.run_command", AsyncMock(side_effect=_touch_output))
+    mocker.patch("ise_record.live.media_duration", AsyncMock(return_value=10.0))
+    mock_cached = mocker.patch("ise_record.live.cached_video_properties", return_value=STREAM_PROPS)
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        recording_path = Path(tempdir)
+
+        await _upload_chunks(recording_path / "stream", range(3))
+        assert len(await render_live_segments(recording_path, 5.0, 2)) == 1
+
+        # everything is rendered again with the new filter
+        mock_cached.return_value = cropped_props
+        await _upload_chunks(recording_path / "stream", range(3, 5))
+        rendered = await render_live_segments(recording_path, 5.0, 2)
+
+        assert [ s.start for s in rendered ] == [ 0.0, 10.0 ]
+        assert read_segment_manifest(recording_path / ".presentation.webm.segments").render_key == render_key(generate_ffmpeg_filter(cropped_props, False), PostprocessingOptions()) # type: ignore
+
+@pytest.mark.asyncio
+async def test_render_live_segments_needs_crop_area(mocker: MockerFixture):
+    mock_run_command = mocker.patch("ise_record.live.run_command")
+    mocker.patch("ise_record.live.cached_video_properties", return_value=None)
+    mock_update = mocker.patch("ise_record.live.update_crop_cache", AsyncMock(return_value=None))
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        recording_path = Path(tempdir)
+        await _upload_chunks(recording_path / "stream", range(5))
+
+        assert await render_live_segments(recording_path, 5.0, 2, PostprocessingOptions(crop_detect_frames=5)) == []
+
+        mock_update.assert_called_once_with(recording_path / "stream", 5, 5.0, 5)
+        mock_run_command.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_postprocess_tracks_reuses_live_segments(mocker: MockerFixture):
+    async def mock_concat(p: Path):
+        return p / "full.webm"
+
+    stream_props = STREAM_PROPS._replace(duration=65.0)
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        output_path = Path(tempdir) / "presentation.webm"
+        segment_dir = Path(tempdir) / ".presentation.webm.segments"
+
+        mocker.patch("ise_record.live.cached_video_properties", return_value=stream_props)
+        mocker.patch("ise_record.live.run_command", AsyncMock(side_effect=_touch_output))
+        mocker.patch("ise_record.live.media_duration", AsyncMock(return_value=10.0))
+
+        for i in range(3):
+            await _upload_chunks(Path(tempdir) / "stream", range(i * 4, i * 4 + 4))
+            await render_live_segments(Path(tempdir), 5.0, 2)
+
+        # a stale segment from an earlier attempt
+        (segment_dir / "segment.0009.webm").write_bytes(b"stale")
+
+        mocker.patch("ise_record.postprocess.cached_video_properties", return_value=stream_props)
+        mocker.patch("ise_record.postprocess.concat_chunks", wraps=mock_concat)
+        mock_run_command = mocker.patch("ise_record.segments.run_command", AsyncMock(side_effect=_touch_output))
+        mocker.patch("pathlib.Path.is_dir", return_value=False)
+
+        result = await postprocess_tracks(Path(tempdir) / "stream", Path(tempdir) / "overlay", [], output_path)
+
+        assert result.reason == ResultReason.SUCCESS
+        assert not segment_dir.exists()
+
+    commands = [ c.args[0] for c in mock_run_command.call_args_list ]
+
+    # live windows covered 50s, only the rest is rendered now
+    assert len(commands) == 2
+    assert commands[0][:5] == [ "ffmpeg", "-ss", "50.000", "-i", str(Path(tempdir) / "stream" / "full.webm") ]
+    assert commands[0][-1] == str(segment_dir / "segment.0005.webm")
+    assert commands[1][:7] == [ "ffmpeg", "-f", "concat", "-safe", "0", "-i", str(segment_dir / "segments.txt") ]
@@ -0,0 +1,118 @@
+# pylint: disable=line-too-long
+# pylint: disable=missing-function-docstring
+# pylint: disable=missing-module-docstring
+
+import pytest
+
+from ise_record.metrics import Counter, Gauge, Histogram, Registry
+
+def test_counter_exposition():
+    registry = Registry()
+    counter = registry.counter("foo_total", "Foos seen", [ "kind" ])
+
+    counter.inc(kind="a")
+    counter.inc(2, kind="b")
+    counter.inc(kind="a")
+
+    assert counter.value(kind="a") == 2
+    assert registry.expose() == (
+        '# HELP foo_total Foos seen\n'
+        '# TYPE foo_total counter\n'
+        'foo_total{kind="a"} 2\n'
+        'foo_total{kind="b"} 2\n'
+    )
+
+def test_counter_labels_checked():
+    counter = Counter("foo_total", "Foos seen", [ "kind" ])
+
+    with pytest.raises(ValueError):
+        counter.inc()
+
+    with pytest.raises(ValueError):
+        counter.inc(kind="a", other="b")
+
+def test_label_values_escaped():
+    counter = Counter("foo_total", "Foos seen", [ "program" ])
+    counter.inc(program='a"b\\c')
+
+    assert 'foo_total{program="a\\"b\\\\c"} 1' in counter.expose()
+
+def test_histogram_exposition():
+    histogram = Histogram("bar_seconds", "Bar duration", buckets=(1.0, 5.0))
+
+    histogram.observe(0.5)
+    histogram.observe(1.0)
+    histogram.observe(3.0)
+    histogram.observe(10.0)
+
+    assert histogram.count() == 4
+    assert histogram.expose() == (
+        '# HELP bar_seconds Bar duration\n'
+        '# TYPE bar_seconds histogram\n'
+        'bar_seconds_bucket{le="1.0"} 2\n'
+        'bar_seconds_bucket{le="5.0"} 3\n'
+        'bar_seconds_bucket{le="+Inf"} 4\n'
+        'bar_seconds_sum 14.5\n'
+        'bar_seconds_count 4\n'
+    )
+
+def test_histogram_time_outcome():
+    histogram = Histogram("bar_seconds", "Bar duration", [ "result" ])
+
+    with histogram.time_outcome():
+        pass
+
+    with pytest.raises(RuntimeError), histogram.time_outcome():
+        raise RuntimeError("boom")
+
+    assert histogram.count(result="success") == 1
+    assert histogram.count(result="failure") == 1
+
+def test_gauge_collects_on_exposition():
+    values = { ("pending",): 1.0 }
+    gauge = Gauge("jobs", "Jobs by state", [ "state" ], lambda: values)
+
+    assert 'jobs{state="pending"} 1' in gauge.expose()
+
+    values[("pending",)] = 3.0
+
+    assert 'jobs{state="pending"} 3' in gauge.expose()
+
+def test_drain_and_merge():
+    worker = Registry()
+    worker_counter = worker.counter("foo_total", "Foos seen")
+    worker_histogram = worker.histogram("bar_seconds", "Bar duration", buckets=(1.0,))
+    worker.gauge("jobs", "Jobs", collect=lambda: { (): 1.0 })
+
+    server = Registry()
+    server_counter = server.counter("foo_total", "Foos seen")
+    server_histogram = server.histogram("bar_seconds", "Bar duration", buckets=(1.0,))
+
+    server_counter.inc()
+    worker_counter.inc(2)
+    worker_histogram.observe(0.5)
+
+    drained = worker.drain()
+
+    assert worker_counter.value() == 0
+    assert worker_histogram.count() == 0
+    assert "jobs" not in drained
+
+    server.merge(drained)
+
+    assert server_counter.value() == 3
+    assert server_histogram.count() == 1
+    assert 'bar_seconds_bucket{le="1.0"} 1' in server.expose()
+
+def test_unlabeled_metrics_start_at_zero():
+    registry = Registry()
+    registry.counter("foo_total", "Foos seen")
+    registry.histogram("bar_seconds", "Bar duration", buckets=(1.0,))
+    registry.counter("baz_total", "Bazs seen", [ "kind" ])
+
+    exposition = registry.expose()
+
+    assert 'foo_total 0\n' in exposition
+    assert 'bar_seconds_bucket{le="1.0"} 0\n' in exposition
+    assert 'bar_seconds_count 0\n' in exposition
+    assert 'baz_total{' not in exposition
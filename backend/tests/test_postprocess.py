@@ -5,82 +5,82 @@
 # pylint: disable=protected-access
 # pylint: disable=no-member
 
+import asyncio
+from contextlib import asynccontextmanager
 import os
 from pathlib import Path
 from subprocess import CalledProcessError
 import tempfile
-from unittest.mock import AsyncMock, call
+from typing import AsyncIterator
+from unittest.mock import ANY, AsyncMock, call
 
 import pytest
 from pytest_mock import MockerFixture
 
+from ise_record.assembly import append_ready_chunks
+from ise_record.cropdetect import Rectangle, VideoProperties
+from ise_record.encoders import encoder_args, EncoderProfile, ENCODER_PROFILES
+from ise_record.options import PostprocessingOptions, rendition_path
 from ise_record.postprocess import (
-    _run_command, # pyright: ignore[reportPrivateUsage]
+    can_stream_copy,
+    chunk_pipe,
     concat_chunks,
-    determine_crop_area,
     generate_overlay_scale,
     generate_ffmpeg_filter,
     pick_target_geometry,
+    rendition_heights,
     postprocess_recording,
     postprocess_tracks,
-    Rectangle,
     Result,
-    ResultReason,
-    video_properties,
-    VideoProperties
+    ResultReason
 )
+from ise_record.progress import Phase, Progress
 
 @pytest.mark.asyncio
-async def test_run_command():
-    res = await _run_command([ "/usr/bin/env", "echo", "Hello, world." ])
-    assert res == b"Hello, world.\n"
-
-@pytest.mark.asyncio
-async def test_run_command_error():
-    with pytest.raises(CalledProcessError) as ex:
-        await _run_command([ "/usr/bin/env", "false", "foo", "bar" ])
+async def test_concat_chunks():
+    first_data = bytes(range(256))
+    second_data = bytes(range(255, -1, -1))
 
-    assert ex.value.stdout == b""
-    assert ex.value.stderr == b""
-    assert ex.value.cmd == [ "/usr/bin/env", "false", "foo", "bar" ]
-    assert ex.value.returncode != 0
+    with tempfile.TemporaryDirectory() as tempdir:
+        temp_path = Path(tempdir)
 
-def test_determine_crop_area():
-    width, height = 1920, 1080
-    crop_none = Rectangle(width = 1920, height = 1080, left = 0, top = 0)
-    crop_letter = Rectangle(width = 1920, height = 720, left = 0, top = 180)
-    crop_pillar = Rectangle(width = 1600, height = 1080, left = 160, top = 0)
+        with open(temp_path / "chunk.0000", "wb") as chunk1:
+            chunk1.write(first_data)
+        with open(temp_path / "chunk.0001", "wb") as chunk2:
+            chunk2.write(second_data)
 
-    crop_letter_insignificant = Rectangle(width = 1920, height = 1070, left = 0, top = 5)
-    crop_pillar_insignificant = Rectangle(width = 1901, height = 1080, left = 10, top = 0)
+        await concat_chunks(temp_path)
 
-    assert determine_crop_area(width, height, crop_none) == crop_none
-    assert determine_crop_area(width, height, crop_letter) == crop_letter
-    assert determine_crop_area(width, height, crop_pillar) == crop_pillar
+        assert os.path.isfile(temp_path / "full.webm")
 
-    assert determine_crop_area(width, height, crop_letter_insignificant) == crop_none
-    assert determine_crop_area(width, height, crop_pillar_insignificant) == crop_none
+        with open(temp_path / "full.webm", "rb") as full:
+            content = full.read()
+            assert content == first_data + second_data
 
 @pytest.mark.asyncio
-async def test_video_properties():
-    sample_path = Path(os.path.dirname(__file__)) / "assets" / "sample.webm"
+async def test_concat_chunks_uses_assembled_track():
+    with tempfile.TemporaryDirectory() as tempdir:
+        temp_path = Path(tempdir)
+
+        with open(temp_path / "chunk.0000", "wb") as chunk1:
+            chunk1.write(b"foo")
+        with open(temp_path / "chunk.0001", "wb") as chunk2:
+            chunk2.write(b"bar")
 
-    info = await video_properties(sample_path)
+        await append_ready_chunks(temp_path, 4)
+        full_mtime = os.stat(temp_path / "full.webm").st_mtime_ns
 
-    print(info)
+        result = await concat_chunks(temp_path)
 
-    assert info.width == 480
-    assert info.height == 270
+        assert result == temp_path / "full.webm"
+        assert os.stat(result).st_mtime_ns == full_mtime
 
-    assert info.needs_cropping()
-    assert info.crop.width == 217
-    assert info.crop.height == 170
-    assert info.crop.left == 125
-    assert info.crop.top == 53
+        with open(result, "rb") as full:
+            assert full.read() == b"foobar"
 
 @pytest.mark.asyncio
-async def test_concat_chunks():
-    first_data = bytes(range(256))
+async def test_chunk_pipe():
+    first_data = bytes(range(256)) * 4096
     second_data = bytes(range(255, -1, -1))
 
     with tempfile.TemporaryDirectory() as tempdir:
@@ -91,13 +91,32 @@ async def test_concat_chunks():
         with open(temp_path / "chunk.0001", "wb") as chunk2:
             chunk2.write(second_data)
 
-        await concat_chunks(temp_path)
+        async with chunk_pipe(temp_path) as fifo_path:
+            content = await asyncio.to_thread(fifo_path.read_bytes)
+            assert content == first_data + second_data
 
-        assert os.path.isfile(temp_path / "full.webm")
+        assert not fifo_path.exists()
+        assert not os.path.exists(temp_path / "full.webm")
 
-        with open(temp_path / "full.webm", "rb") as full:
-            content = full.read()
-            assert content == first_data + second_data
+@pytest.mark.asyncio
+async def test_chunk_pipe_abandoned():
+    with tempfile.TemporaryDirectory() as tempdir:
+        temp_path = Path(tempdir)
+
+        with open(temp_path / "chunk.0000", "wb") as chunk1:
+            chunk1.write(bytes(1024 * 1024))
+
+        # never opened
+        async with chunk_pipe(temp_path):
+            pass
+
+        # reader stops early
+        async with chunk_pipe(temp_path) as fifo_path:
+            def read_some():
+                with open(fifo_path, "rb") as fifo:
+                    return fifo.read(16)
+
+            assert await asyncio.to_thread(read_some) == bytes(16)
 
 def test_pick_target_geometry():
     assert pick_target_geometry(Rectangle(left=0, top=0, width=   1, height=   1)) == (1280,  720)
@@ -150,6 +169,30 @@ def test_generate_ffmpeg_filter():
     assert filter_pillar    == f"{filter_pillar_nooverlay   }[main];[1:v]{overlay_pillar   }[overlay];[main][overlay]overlay=(main_w-overlay_w):0"
     assert filter_letterbox == f"{filter_letterbox_nooverlay}[main];[1:v]{overlay_letterbox}[overlay];[main][overlay]overlay=(main_w-overlay_w):0"
 
+def test_generate_ffmpeg_filter_renditions():
+    stream = VideoProperties(width=1440, height=810, crop=Rectangle(left=0, top=0, width=1440, height=810))
+    filter_single = generate_ffmpeg_filter(stream, True)
+
+    # renditions that aren't smaller than the output are dropped
+    assert rendition_heights(stream, [ 480, 1080, 720, 2160, 480 ]) == [ 720, 480 ]
+    assert generate_ffmpeg_filter(stream, True, [ 1080 ]) == filter_single
+
+    assert generate_ffmpeg_filter(stream, True, [ 480, 720 ]) == f"{filter_single},split=3[v][s720][s480];[s720]scale=-2:720[v720];[s480]scale=-2:480[v480]"
+
+def test_rendition_path():
+    assert rendition_path(Path("foo/presentation.webm"), "720p") == Path("foo/presentation.720p.webm")
+    assert rendition_path(Path("foo/segment.0001.mp4"), "audio") == Path("foo/segment.0001.audio.mp4")
+
+def test_can_stream_copy():
+    target_nocrop = VideoProperties(width=1920, height=1080, crop=Rectangle(left=  0, top=0, width=1920, height=1080))
+    target_pillar = VideoProperties(width=1920, height=1080, crop=Rectangle(left=240, top=0, width=1440, height=1080))
+    other_nocrop  = VideoProperties(width=1440, height= 810, crop=Rectangle(left=  0, top=0, width=1440, height= 810))
+
+    assert can_stream_copy(target_nocrop, False)
+    assert not can_stream_copy(target_nocrop, True)
+    assert not can_stream_copy(target_pillar, False)
+    assert not can_stream_copy(other_nocrop, False)
+
 @pytest.mark.asyncio
 async def test_postprocess_tracks(mocker: MockerFixture):
     async def mock_concat(p: Path):
@@ -157,30 +200,38 @@ async def test_postprocess_tracks(mocker: MockerFixture):
 
     stream_props = VideoProperties(width=1920, height=1080, crop=Rectangle(left=0, top=0, width=1920, height=1080))
 
-    mock_run_command = mocker.patch("ise_record.postprocess._run_command")
+    mock_run_command = mocker.patch("ise_record.postprocess.run_command")
     mock_concat_chunks = mocker.patch("ise_record.postprocess.concat_chunks", wraps=mock_concat)
     mocker.patch("ise_record.postprocess.video_properties", AsyncMock(return_value=stream_props))
     mock_unlink = mocker.patch("pathlib.Path.unlink", autospec=True)
     mocker.patch("pathlib.Path.is_dir", return_value=True)
 
+    reports: list[Progress] = []
+
     result = await postprocess_tracks(
         Path("foo/stream"),
         Path("foo/overlay"),
         [],
-        Path("foo/presentation.webm")
+        Path("foo/presentation.webm"),
+        reports.append
     )
 
     assert result.reason == ResultReason.SUCCESS
     assert result.output_file == Path("foo/presentation.webm")
 
+    assert [ r.phase for r in reports ] == [ Phase.CONCAT, Phase.PROBE, Phase.RENDER ]
+
     mock_run_command.assert_called_once_with([
         "ffmpeg",
         "-i", "foo/stream/full.webm",
         "-i", "foo/overlay/full.webm",
         "-filter_complex", generate_ffmpeg_filter(stream_props, True),
         "-map", "0:a?",
+        *encoder_args(ENCODER_PROFILES["vp9"]),
+        "-progress", "pipe:1",
+        "-nostats",
         "-y", "foo/presentation.webm"
-    ])
+    ], ANY)
 
     mock_concat_chunks.assert_has_calls([
         call(Path("foo/stream")),
@@ -192,6 +243,321 @@ async def test_postprocess_tracks(mocker: MockerFixture):
         call(Path("foo/overlay/full.webm"))
     ])
 
+@pytest.mark.asyncio
+async def test_postprocess_tracks_crop_cache(mocker: MockerFixture):
+    async def mock_concat(p: Path):
+        return p / "full.webm"
+
+    cached_props = VideoProperties(width=1920, height=1080, crop=Rectangle(left=0, top=0, width=1920, height=1080), duration=60.0)
+
+    mocker.patch("ise_record.postprocess.run_command")
+    mocker.patch("ise_record.postprocess.concat_chunks", wraps=mock_concat)
+    mock_cached = mocker.patch("ise_record.postprocess.cached_video_properties", return_value=cached_props)
+    mock_props = mocker.patch("ise_record.postprocess.video_properties", AsyncMock(return_value=cached_props))
+    mocker.patch("pathlib.Path.unlink", autospec=True)
+    mocker.patch("pathlib.Path.is_dir", return_value=True)
+
+    result = await postprocess_tracks(Path("foo/stream"), Path("foo/overlay"), [], Path("foo/presentation.webm"))
+
+    assert result.reason == ResultReason.SUCCESS
+    mock_cached.assert_called_once_with(Path("foo/stream"))
+    mock_props.assert_not_called()
+
+    mock_cached.reset_mock()
+
+    await postprocess_tracks(
+        Path("foo/stream"), Path("foo/overlay"), [], Path("foo/presentation.webm"),
+        options=PostprocessingOptions(use_crop_cache=False)
+    )
+
+    mock_cached.assert_not_called()
+    mock_props.assert_called_once()
+
+@pytest.mark.asyncio
+async def test_postprocess_tracks_pipe_chunks(mocker: MockerFixture):
+    opened_pipes: list[Path] = []
+
+    @asynccontextmanager
+    async def mock_pipe(p: Path) -> AsyncIterator[Path]:
+        fifo_path = p / f"pipe.{len(opened_pipes)}"
+        opened_pipes.append(fifo_path)
+        yield fifo_path
+
+    props = VideoProperties(width=1920, height=1080, crop=Rectangle(left=0, top=0, width=1920, height=1080), duration=60.0)
+
+    mock_run = mocker.patch("ise_record.postprocess.run_command")
+    mock_concat = mocker.patch("ise_record.postprocess.concat_chunks")
+    mocker.patch("ise_record.postprocess.chunk_pipe", wraps=mock_pipe)
+    mocker.patch("ise_record.postprocess.assembled_track", side_effect=lambda p: p / "full.webm" if p.name == "overlay" else None)
+    mocker.patch("ise_record.postprocess.cached_video_properties", return_value=None)
+    mock_props = mocker.patch("ise_record.postprocess.video_properties", AsyncMock(return_value=props))
+    mock_unlink = mocker.patch("pathlib.Path.unlink", autospec=True)
+    mocker.patch("pathlib.Path.is_dir", return_value=True)
+
+    mock_concat.side_effect = lambda p: p / "full.webm"
+
+    result = await postprocess_tracks(
+        Path("foo/stream"), Path("foo/overlay"), [ Path("foo/audio") ], Path("foo/presentation.webm"),
+        options=PostprocessingOptions(crop_detect_samples=8, pipe_chunks=True)
+    )
+
+    assert result.reason == ResultReason.SUCCESS
+
+    # the probe uses up the first pipe, sampling is not possible on a pipe
+    assert opened_pipes == [ Path("foo/stream/pipe.0"), Path("foo/audio/pipe.1"), Path("foo/stream/pipe.2") ]
+    mock_props.assert_called_once_with(Path("foo/stream/pipe.0"), 0, 10)
+
+    # only the assembled overlay track is used as a file
+    mock_concat.assert_called_once_with(Path("foo/overlay"))
+    mock_unlink.assert_called_once_with(Path("foo/overlay/full.webm"))
+
+    render_command = mock_run.call_args.args[0]
+    assert render_command[:7] == [ 'ffmpeg', '-i', 'foo/stream/pipe.2', '-i', 'foo/overlay/full.webm', '-i', 'foo/audio/pipe.1' ]
+
+@pytest.mark.asyncio
+async def test_postprocess_tracks_concurrency(mocker: MockerFixture):
+    active = 0
+    max_active = 0
+    events: list[str] = []
+
+    async def mock_concat(p: Path):
+        nonlocal active, max_active
+        active += 1
+        max_active = max(max_active, active)
+        await asyncio.sleep(0.01)
+        active -= 1
+        events.append(f"concat {p}")
+        return p / "full.webm"
+
+    stream_props = VideoProperties(width=1920, height=1080, crop=Rectangle(left=0, top=0, width=1920, height=1080))
+
+    async def mock_video_properties(*_):
+        events.append("probe")
+        return stream_props
+
+    mock_run_command = mocker.patch("ise_record.postprocess.run_command")
+    mocker.patch("ise_record.postprocess.concat_chunks", wraps=mock_concat)
+    mocker.patch("ise_record.postprocess.video_properties", wraps=mock_video_properties)
+    mocker.patch("ise_record.postprocess.cached_video_properties", return_value=None)
+    mock_unlink = mocker.patch("pathlib.Path.unlink", autospec=True)
+    mocker.patch("pathlib.Path.is_dir", return_value=True)
+
+    audio_dirs = [ Path(f"foo/audio-{i}") for i in range(4) ]
+
+    result = await postprocess_tracks(
+        Path("foo/stream"), Path("foo/overlay"), audio_dirs, Path("foo/presentation.webm"),
+        options=PostprocessingOptions(io_concurrency=2)
+    )
+
+    assert result.reason == ResultReason.SUCCESS
+    assert max_active == 2
+
+    # the stream is probed while other tracks are still being concatenated
+    assert events.index("probe") < events.index("concat foo/audio-3")
+
+    # input order doesn't depend on which concatenation finished first
+    assert mock_run_command.call_args.args[0][:13] == [
+        "ffmpeg",
+        "-i", "foo/stream/full.webm",
+        "-i", "foo/overlay/full.webm",
+        "-i", "foo/audio-0/full.webm",
+        "-i", "foo/audio-1/full.webm",
+        "-i", "foo/audio-2/full.webm",
+        "-i", "foo/audio-3/full.webm"
+    ]
+    assert mock_unlink.call_count == 6
+
+@pytest.mark.asyncio
+async def test_postprocess_tracks_concat_failure(mocker: MockerFixture):
+    async def mock_concat(p: Path):
+        if p == Path("foo/audio-0"):
+            raise OSError("disk full")
+        return p / "full.webm"
+
+    mocker.patch("ise_record.postprocess.run_command")
+    mocker.patch("ise_record.postprocess.concat_chunks", wraps=mock_concat)
+    mocker.patch("ise_record.postprocess.video_properties", AsyncMock(return_value=VideoProperties(width=1920, height=1080, crop=Rectangle(left=0, top=0, width=1920, height=1080))))
+    mocker.patch("ise_record.postprocess.cached_video_properties", return_value=None)
+    mock_unlink = mocker.patch("pathlib.Path.unlink", autospec=True)
+    mocker.patch("pathlib.Path.is_dir", return_value=True)
+
+    with pytest.raises(OSError):
+        await postprocess_tracks(Path("foo/stream"), Path("foo/overlay"), [ Path("foo/audio-0") ], Path("foo/presentation.webm"))
+
+    # whatever was concatenated is cleaned up
+    mock_unlink.assert_has_calls([
+        call(Path("foo/stream/full.webm")),
+        call(Path("foo/overlay/full.webm"))
+    ])
+
+@pytest.mark.asyncio
+async def test_postprocess_tracks_encoder(mocker: MockerFixture):
+    async def mock_concat(p: Path):
+        return p / "full.webm"
+
+    stream_props = VideoProperties(width=1920, height=1080, crop=Rectangle(left=0, top=0, width=1920, height=1080))
+    profile = EncoderProfile(container="mkv", video=[ "-c:v", "libfoo" ], audio=[ "-c:a", "copy" ], muxer=( "-cluster_size_limit", "2M" ))
+
+    mock_run_command = mocker.patch("ise_record.postprocess.run_command")
+    mocker.patch("ise_record.postprocess.concat_chunks", wraps=mock_concat)
+    mocker.patch("ise_record.postprocess.video_properties", AsyncMock(return_value=stream_props))
+    mocker.patch("pathlib.Path.unlink", autospec=True)
+    mocker.patch("pathlib.Path.is_dir", return_value=False)
+
+    await postprocess_tracks(
+        Path("foo/stream"), Path("foo/overlay"), [], Path("foo/presentation.mkv"),
+        options=PostprocessingOptions(encoder=profile, encoder_threads=6)
+    )
+
+    # muxer options follow the codec options, just before the output
+    assert mock_run_command.call_args.args[0][-13:] == [
+        "-c:v", "libfoo",
+        "-threads", "6",
+        "-c:a", "copy",
+        "-cluster_size_limit", "2M",
+        "-progress", "pipe:1",
+        "-nostats",
+        "-y", "foo/presentation.mkv"
+    ]
+
+@pytest.mark.asyncio
+async def test_postprocess_tracks_stream_copy(mocker: MockerFixture):
+    async def mock_concat(p: Path):
+        return p / "full.webm"
+
+    def mock_isdir(self: Path):
+        return self != Path("foo/overlay")
+
+    stream_props = VideoProperties(width=1280, height=720, crop=Rectangle(left=0, top=0, width=1280, height=720))
+
+    mock_run_command = mocker.patch("ise_record.postprocess.run_command")
+    mocker.patch("ise_record.postprocess.concat_chunks", wraps=mock_concat)
+    mocker.patch("ise_record.postprocess.video_properties", AsyncMock(return_value=stream_props))
+    mocker.patch("pathlib.Path.unlink", autospec=True)
+    mocker.patch("pathlib.Path.is_dir", new=mock_isdir)
+
+    result = await postprocess_tracks(Path("foo/stream"), Path("foo/overlay"), [ Path("foo/audio-0") ], Path("foo/presentation.webm"))
+
+    assert result.reason == ResultReason.SUCCESS
+
+    mock_run_command.assert_called_once_with([
+        "ffmpeg",
+        "-i", "foo/stream/full.webm",
+        "-i", "foo/audio-0/full.webm",
+        "-map", "0:v",
+        "-map", "0:a?",
+        "-map", "1:a",
+        "-c", "copy",
+        "-progress", "pipe:1",
+        "-nostats",
+        "-y", "foo/presentation.webm"
+    ], ANY)
+
+    # disabled, or not possible because the output container differs
+    for options in [ PostprocessingOptions(stream_copy=False), PostprocessingOptions(encoder=ENCODER_PROFILES["h264"]) ]:
+        mock_run_command.reset_mock()
+        await postprocess_tracks(Path("foo/stream"), Path("foo/overlay"), [], Path("foo/presentation.webm"), options=options)
+        assert "-filter_complex" in mock_run_command.call_args.args[0]
+        assert "copy" not in mock_run_command.call_args.args[0]
+
+@pytest.mark.asyncio
+async def test_postprocess_tracks_renditions(mocker: MockerFixture):
+    async def mock_concat(p: Path):
+        return p / "full.webm"
+
+    def mock_isdir(self: Path):
+        return self != Path("foo/overlay")
+
+    stream_props = VideoProperties(width=1440, height=810, crop=Rectangle(left=0, top=0, width=1440, height=810))
+    codec_args = encoder_args(ENCODER_PROFILES["vp9"])
+    audio_maps = [ "-map", "0:a?", "-map", "1:a" ]
+
+    mock_run_command = mocker.patch("ise_record.postprocess.run_command")
+    mocker.patch("ise_record.postprocess.concat_chunks", wraps=mock_concat)
+    mocker.patch("ise_record.postprocess.video_properties", AsyncMock(return_value=stream_props))
+    mocker.patch("pathlib.Path.unlink", autospec=True)
+    mocker.patch("pathlib.Path.is_dir", new=mock_isdir)
+
+    result = await postprocess_tracks(
+        Path("foo/stream"), Path("foo/overlay"), [ Path("foo/audio-0") ], Path("foo/presentation.webm"),
+        options=PostprocessingOptions(renditions=(720, 1080, 480), audio_rendition=True)
+    )
+
+    assert result.reason == ResultReason.SUCCESS
+
+    # one decode, one output per rendition
+    mock_run_command.assert_called_once_with([
+        "ffmpeg",
+        "-i", "foo/stream/full.webm",
+        "-i", "foo/audio-0/full.webm",
+        "-filter_complex", generate_ffmpeg_filter(stream_props, False, [ 720, 480 ]),
+        "-map", "[v]", *audio_maps, *codec_args,
+        "-progress", "pipe:1",
+        "-nostats",
+        "-y", "foo/presentation.webm",
+        "-map", "[v720]", *audio_maps, *codec_args, "-y", "foo/presentation.720p.webm",
+        "-map", "[v480]", *audio_maps, *codec_args, "-y", "foo/presentation.480p.webm",
+        *audio_maps, "-vn", *ENCODER_PROFILES["vp9"].audio, "-y", "foo/presentation.audio.webm"
+    ], ANY)
+
+@pytest.mark.asyncio
+async def test_postprocess_tracks_renditions_muxer(mocker: MockerFixture):
+    async def mock_concat(p: Path):
+        return p / "full.webm"
+
+    stream_props = VideoProperties(width=1440, height=810, crop=Rectangle(left=0, top=0, width=1440, height=810))
+    h264 = ENCODER_PROFILES["h264"]
+
+    mock_run_command = mocker.patch("ise_record.postprocess.run_command")
+    mocker.patch("ise_record.postprocess.concat_chunks", wraps=mock_concat)
+    mocker.patch("ise_record.postprocess.video_properties", AsyncMock(return_value=stream_props))
+    mocker.patch("pathlib.Path.unlink", autospec=True)
+    mocker.patch("pathlib.Path.is_dir", new=lambda self: self != Path("foo/overlay"))
+
+    await postprocess_tracks(
+        Path("foo/stream"), Path("foo/overlay"), [], Path("foo/presentation.mp4"),
+        options=PostprocessingOptions(encoder=h264, renditions=(480,), audio_rendition=True)
+    )
+
+    # every output file gets the muxer options
+    command = mock_run_command.call_args.args[0]
+    assert command[-2 - len(h264.muxer):] == [ *h264.muxer, "-y", "foo/presentation.audio.mp4" ]
+    assert command[command.index("foo/presentation.480p.mp4") - 1 - len(h264.muxer):command.index("foo/presentation.480p.mp4")] == [ *h264.muxer, "-y" ]
+
+@pytest.mark.asyncio
+async def test_postprocess_tracks_renditions_stream_copy(mocker: MockerFixture):
+    async def mock_concat(p: Path):
+        return p / "full.webm"
+
+    stream_props = VideoProperties(width=1920, height=1080, crop=Rectangle(left=0, top=0, width=1920, height=1080))
+
+    mock_run_command = mocker.patch("ise_record.postprocess.run_command")
+    mocker.patch("ise_record.postprocess.concat_chunks", wraps=mock_concat)
+    mocker.patch("ise_record.postprocess.video_properties", AsyncMock(return_value=stream_props))
+    mocker.patch("pathlib.Path.unlink", autospec=True)
+    mocker.patch("pathlib.Path.is_dir", new=lambda self: self != Path("foo/overlay"))
+
+    # smaller renditions need the decoded picture
+    await postprocess_tracks(
+        Path("foo/stream"), Path("foo/overlay"), [], Path("foo/presentation.webm"),
+        options=PostprocessingOptions(renditions=(720,))
+    )
+    assert "-filter_complex" in mock_run_command.call_args.args[0]
+
+    # the audio alone doesn't
+    mock_run_command.reset_mock()
+    await postprocess_tracks(
+        Path("foo/stream"), Path("foo/overlay"), [], Path("foo/presentation.webm"),
+        options=PostprocessingOptions(audio_rendition=True)
+    )
+    assert mock_run_command.call_args.args[0][-16:] == [
+        "-c", "copy",
+        "-progress", "pipe:1",
+        "-nostats",
+        "-y", "foo/presentation.webm",
+        "-map", "0:a?", "-vn", *ENCODER_PROFILES["vp9"].audio, "-y", "foo/presentation.audio.webm"
+    ]
+
 @pytest.mark.asyncio
 async def test_postprocess_tracks_no_overlay(mocker: MockerFixture):
     async def mock_concat(p: Path):
@@ -200,9 +566,9 @@ async def test_postprocess_tracks_no_overlay(mocker: MockerFixture):
     def mock_isdir(self: Path):
         return self == Path("foo/stream")
 
-    stream_props = VideoProperties(width=1920, height=1080, crop=Rectangle(left=0, top=0, width=1920, height=1080))
+    stream_props = VideoProperties(width=1440, height=810, crop=Rectangle(left=0, top=0, width=1440, height=810))
 
-    mock_run_command = mocker.patch("ise_record.postprocess._run_command")
+    mock_run_command = mocker.patch("ise_record.postprocess.run_command")
     mock_concat_chunks = mocker.patch("ise_record.postprocess.concat_chunks", wraps=mock_concat)
     mocker.patch("ise_record.postprocess.video_properties", AsyncMock(return_value=stream_props))
     mock_unlink = mocker.patch("pathlib.Path.unlink", autospec=True)
@@ -223,8 +589,11 @@ async def test_postprocess_tracks_no_overlay(mocker: MockerFixture):
         "-i", "foo/stream/full.webm",
         "-filter_complex", generate_ffmpeg_filter(stream_props, False),
         "-map", "0:a?",
+        *encoder_args(ENCODER_PROFILES["vp9"]),
+        "-progress", "pipe:1",
+        "-nostats",
         "-y", "foo/presentation.webm"
-    ])
+    ], ANY)
 
     mock_concat_chunks.assert_called_once_with(Path("foo/stream"))
     mock_unlink.assert_called_once_with(Path("foo/stream/full.webm"))
@@ -236,7 +605,7 @@ async def test_postprocess_tracks_multi_audio(mocker: MockerFixture):
 
     stream_props = VideoProperties(width=1920, height=1080, crop=Rectangle(left=0, top=0, width=1920, height=1080))
 
-    mock_run_command = mocker.patch("ise_record.postprocess._run_command")
+    mock_run_command = mocker.patch("ise_record.postprocess.run_command")
     mock_concat_chunks = mocker.patch("ise_record.postprocess.concat_chunks", wraps=mock_concat)
     mocker.patch("ise_record.postprocess.video_properties", AsyncMock(return_value=stream_props))
     mock_unlink = mocker.patch("pathlib.Path.unlink", autospec=True)
@@ -268,8 +637,11 @@ async def test_postprocess_tracks_multi_audio(mocker: MockerFixture):
         "-map", "2:a",
         "-map", "3:a",
         "-map", "4:a",
+        *encoder_args(ENCODER_PROFILES["vp9"]),
+        "-progress", "pipe:1",
+        "-nostats",
         "-y", "foo/presentation.webm"
-    ])
+    ], ANY)
 
     mock_concat_chunks.assert_has_calls([
         call(Path("foo/stream")),
@@ -295,9 +667,9 @@ async def test_postprocess_tracks_multi_audio_no_overlay(mocker: MockerFixture):
     def mock_isdir(self: Path):
         return self != Path("foo/overlay")
 
-    stream_props = VideoProperties(width=1920, height=1080, crop=Rectangle(left=0, top=0, width=1920, height=1080))
+    stream_props = VideoProperties(width=1440, height=810, crop=Rectangle(left=0, top=0, width=1440, height=810))
 
-    mock_run_command = mocker.patch("ise_record.postprocess._run_command")
+    mock_run_command = mocker.patch("ise_record.postprocess.run_command")
     mock_concat_chunks = mocker.patch("ise_record.postprocess.concat_chunks", wraps=mock_concat)
     mocker.patch("ise_record.postprocess.video_properties", AsyncMock(return_value=stream_props))
     mock_unlink = mocker.patch("pathlib.Path.unlink", autospec=True)
@@ -328,8 +700,11 @@ async def test_postprocess_tracks_multi_audio_no_overlay(mocker: MockerFixture):
         "-map", "1:a",
         "-map", "2:a",
         "-map", "3:a",
+        *encoder_args(ENCODER_PROFILES["vp9"]),
+        "-progress", "pipe:1",
+        "-nostats",
         "-y", "foo/presentation.webm"
-    ])
+    ], ANY)
 
     mock_concat_chunks.assert_has_calls([
         call(Path("foo/stream")),
@@ -367,7 +742,9 @@ async def test_postprocess_recordings(mocker: MockerFixture):
         rec_path / "stream",
         rec_path / "overlay",
         audio_paths,
-        expected_result.output_file
+        expected_result.output_file,
+        None,
+        PostprocessingOptions()
     )
 
     mock_is_dir.assert_has_calls([
@@ -377,6 +754,18 @@ async def test_postprocess_recordings(mocker: MockerFixture):
 
     mock_glob.assert_called_once_with(rec_path, "audio-*")
 
+@pytest.mark.asyncio
+async def test_postprocess_recordings_encoder_container(mocker: MockerFixture):
+    options = PostprocessingOptions(encoder=ENCODER_PROFILES["h264"])
+
+    mocker.patch("pathlib.Path.is_dir", return_value=True, autospec=True)
+    mocker.patch("pathlib.Path.glob", return_value=[], autospec=True)
+    mock_postprocess_tracks = mocker.patch("ise_record.postprocess.postprocess_tracks", autospec=True)
+
+    await postprocess_recording(Path("foo"), options=options)
+
+    assert mock_postprocess_tracks.call_args.args[3] == Path("foo/presentation.mp4")
+
 @pytest.mark.asyncio
 async def test_postprocess_recordings_nonexistent(mocker: MockerFixture):
     rec_path = Path("foo")
@@ -419,3 +808,103 @@ async def test_postprocess_recordings_missing_main(mocker: MockerFixture):
         call(rec_path),
         call(rec_path / "stream")
     ])
+
+@pytest.mark.asyncio
+async def test_postprocess_tracks_render_cache(mocker: MockerFixture):
+    async def mock_concat(p: Path):
+        return p / "full.webm"
+
+    async def touch_output(command: list[str], *_) -> bytes:
+        Path(command[-1]).write_bytes(b"presentation")
+        return b""
+
+    stream_props = VideoProperties(width=1440, height=810, crop=Rectangle(left=0, top=0, width=1440, height=810), duration=60.0)
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        recording_path = Path(tempdir)
+        output_path = recording_path / "presentation.webm"
+        os.makedirs(recording_path / "stream")
+        (recording_path / "stream" / "chunk.0000").write_bytes(b"foo")
+
+        mock_run_command = mocker.patch("ise_record.postprocess.run_command", AsyncMock(side_effect=touch_output))
+        mocker.patch("ise_record.postprocess.concat_chunks", wraps=mock_concat)
+        mock_props = mocker.patch("ise_record.postprocess.video_properties", AsyncMock(return_value=stream_props))
+        mocker.patch("pathlib.Path.unlink", autospec=True)
+
+        async def render(options: PostprocessingOptions = PostprocessingOptions()) -> int:
+            mock_run_command.reset_mock()
+            result = await postprocess_tracks(recording_path / "stream", recording_path / "overlay", [], output_path, options=options)
+            assert result._replace(stages=()) == Result(output_file=output_path, reason=ResultReason.SUCCESS)
+            return mock_run_command.call_count
+
+        assert await render() == 1
+
+        # nothing changed, not even probing is necessary
+        mock_props.reset_mock()
+        assert await render() == 0
+        mock_props.assert_not_called()
+
+        # changed settings, changed inputs and missing outputs all mean rendering again
+        assert await render(PostprocessingOptions(encoder=ENCODER_PROFILES["vp9-fast"])) == 1
+        assert await render(PostprocessingOptions(encoder=ENCODER_PROFILES["vp9-fast"], encoder_threads=4)) == 0
+
+        (recording_path / "stream" / "chunk.0001").write_bytes(b"foo")
+        assert await render() == 1
+
+        os.remove(output_path)
+        assert await render() == 1
+
+        assert await render(PostprocessingOptions(use_render_cache=False)) == 1
+
+@pytest.mark.asyncio
+async def test_postprocess_tracks_stage_stats(mocker: MockerFixture):
+    async def mock_concat(p: Path):
+        (p / "full.webm").write_bytes(b"x" * 700)
+        return p / "full.webm"
+
+    async def touch_output(command: list[str], *_) -> bytes:
+        Path(command[-1]).write_bytes(b"x" * 7)
+        return b""
+
+    stream_props = VideoProperties(width=1440, height=810, crop=Rectangle(left=0, top=0, width=1440, height=810), duration=56.0)
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        recording_path = Path(tempdir)
+        output_path = recording_path / "presentation.webm"
+        os.makedirs(recording_path / "stream")
+
+        mocker.patch("ise_record.postprocess.run_command", AsyncMock(side_effect=touch_output))
+        mocker.patch("ise_record.postprocess.concat_chunks", wraps=mock_concat)
+        mocker.patch("ise_record.postprocess.video_properties", AsyncMock(return_value=stream_props))
+        mock_log = mocker.patch("ise_record.postprocess.logger.info")
+
+        result = await postprocess_tracks(recording_path / "stream", recording_path / "overlay", [], output_path)
+
+    assert result.reason == ResultReason.SUCCESS
+    assert [ s.phase for s in result.stages ] == [ Phase.CONCAT, Phase.PROBE, Phase.RENDER ]
+    assert all(s.wall_seconds >= 0 and s.cpu_seconds >= 0 for s in result.stages)
+
+    # bits per second of the concatenated input and of the rendered output
+    assert result.stages[0].bitrate == 100.0
+    assert result.stages[1].bitrate is None
+    assert result.stages[2].bitrate == 1.0
+
+    mock_log.assert_any_call("Stage stats of %s: %s", output_path, ANY)
+
+@pytest.mark.asyncio
+async def test_postprocess_tracks_stage_stats_failure(mocker: MockerFixture):
+    stream_props = VideoProperties(width=1440, height=810, crop=Rectangle(left=0, top=0, width=1440, height=810), duration=60.0)
+
+    mocker.patch("ise_record.postprocess.run_command", AsyncMock(side_effect=CalledProcessError(1, "ffmpeg", b"", b"")))
+    mocker.patch("ise_record.postprocess.concat_chunks", AsyncMock(return_value=Path("foo/stream/full.webm")))
+    mocker.patch("ise_record.postprocess.video_properties", AsyncMock(return_value=stream_props))
+    mocker.patch("ise_record.postprocess.cached_video_properties", return_value=None)
+    mocker.patch("pathlib.Path.is_dir", new=lambda _: False)
+    mocker.patch("pathlib.Path.unlink", autospec=True)
+
+    result = await postprocess_tracks(Path("foo/stream"), Path("foo/overlay"), [], Path("foo/presentation.webm"))
+
+    # the failed render is accounted for, too
+    assert result.reason == ResultReason.FAILURE
+    assert [ s.phase for s in result.stages ] == [ Phase.CONCAT, Phase.PROBE, Phase.RENDER ]
+    assert result.stages[2].bitrate is None
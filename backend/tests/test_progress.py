@@ -0,0 +1,40 @@
+# pylint: disable=line-too-long
+# pylint: disable=missing-function-docstring
+# pylint: disable=missing-module-docstring
+
+from ise_record.progress import FfmpegProgressParser, Phase, Progress
+
+def test_ffmpeg_progress_parser():
+    reports: list[Progress] = []
+    parser = FfmpegProgressParser(120.0, reports.append)
+
+    for line in [
+        b"frame=900\n",
+        b"fps=60.00\n",
+        b"out_time_us=30000000\n",
+        b"speed=2.0x\n",
+        b"progress=continue\n",
+        b"frame=0\n",
+        b"fps=0.00\n",
+        b"out_time_us=N/A\n",
+        b"speed=N/A\n",
+        b"progress=continue\n",
+        b"out_time_us=120000000\n",
+        b"progress=end\n",
+    ]:
+        parser(line)
+
+    assert reports == [
+        Progress(phase=Phase.RENDER, percent=25.0, fps=60.0, speed=2.0, eta=45.0),
+        Progress(phase=Phase.RENDER, percent=None, fps=0.0, speed=None, eta=None),
+        Progress(phase=Phase.RENDER, percent=100.0, fps=None, speed=None, eta=0.0),
+    ]
+
+def test_ffmpeg_progress_parser_unknown_duration():
+    reports: list[Progress] = []
+    parser = FfmpegProgressParser(None, reports.append)
+
+    for line in [ b"fps=30.00\n", b"out_time_us=30000000\n", b"speed=1.5x\n", b"progress=continue\n" ]:
+        parser(line)
+
+    assert reports == [ Progress(phase=Phase.RENDER, percent=None, fps=30.0, speed=1.5, eta=None) ]
@@ -0,0 +1,73 @@
+# pylint: disable=line-too-long
+# pylint: disable=missing-function-docstring
+# pylint: disable=missing-module-docstring
+
+import os
+from pathlib import Path
+import tempfile
+
+from ise_record.render_cache import (
+    cache_path_for,
+    discard_cache_entry,
+    is_cached,
+    read_cache_entry,
+    render_cache_key,
+    RenderCacheEntry,
+    store_cache_entry,
+    track_fingerprint
+)
+
+def test_track_fingerprint():
+    with tempfile.TemporaryDirectory() as tempdir:
+        track_path = Path(tempdir) / "stream"
+        os.makedirs(track_path)
+
+        for name in [ "chunk.0001", "chunk.0000", "full.webm", "chunk.foo" ]:
+            (track_path / name).write_bytes(b"foo")
+
+        fingerprint = track_fingerprint(track_path)
+
+        assert fingerprint[0] == "stream"
+        assert [ c[:2] for c in fingerprint[1:] ] == [ [ "chunk.0000", 3 ], [ "chunk.0001", 3 ] ]
+
+        # a replaced chunk changes the fingerprint
+        (track_path / "chunk.0001").write_bytes(b"foobar")
+        assert track_fingerprint(track_path) != fingerprint
+
+        # so does a missing track
+        assert track_fingerprint(Path(tempdir) / "overlay") == [ "overlay" ]
+
+def test_render_cache_key():
+    assert render_cache_key(1, [ "foo" ], { "b": 1, "a": 2 }) == render_cache_key(1, [ "foo" ], { "a": 2, "b": 1 })
+    assert render_cache_key(1, [ "foo" ]) != render_cache_key(1, [ "bar" ])
+
+def test_cache_entry():
+    with tempfile.TemporaryDirectory() as tempdir:
+        output_path = Path(tempdir) / "presentation.webm"
+        manifest_path = Path(tempdir) / "streaming" / "master.m3u8"
+
+        assert read_cache_entry(output_path) is None
+        assert not is_cached(output_path, "foo")
+
+        os.makedirs(manifest_path.parent)
+        output_path.write_bytes(b"foo")
+        manifest_path.write_bytes(b"foo")
+
+        store_cache_entry(output_path, "foo", [ output_path, manifest_path ])
+
+        assert cache_path_for(output_path) == Path(tempdir) / ".presentation.webm.cache.json"
+        assert read_cache_entry(output_path) == RenderCacheEntry(key="foo", outputs=[ "presentation.webm", "streaming/master.m3u8" ])
+        assert is_cached(output_path, "foo")
+        assert not is_cached(output_path, "bar")
+
+        # all outputs have to be there
+        manifest_path.unlink()
+        assert not is_cached(output_path, "foo")
+
+        discard_cache_entry(output_path)
+        discard_cache_entry(output_path)
+        assert read_cache_entry(output_path) is None
+
+def test_store_cache_entry_failure():
+    # not being able to write the entry is not an error
+    store_cache_entry(Path("/nonexistent/presentation.webm"), "foo", [ Path("/nonexistent/presentation.webm") ])
@@ -11,7 +11,8 @@ from unittest.mock import ANY
 import pytest
 from pytest_mock import MockerFixture
 
-from ise_record.postprocess import Result, ResultReason
+from ise_record.postprocess import Result, ResultReason, StageStats
+from ise_record.progress import Phase
 from ise_record.reporting import (
     generate_report,
     normalize_recipient,
@@ -44,6 +45,22 @@ def test_generate_report():
     assert "foo/presentation.webm" in report.get_payload()
     assert "Encoding succeeded" in report.get_payload()
 
+def test_generate_report_stages():
+    result = Result(
+        reason = ResultReason.SUCCESS,
+        output_file = Path("foo/presentation.webm"),
+        stages = (
+            StageStats(phase=Phase.CONCAT, wall_seconds=1.25, cpu_seconds=0.5, bytes_read=0, bytes_written=10 * 1024 * 1024, bitrate=2_500_000.0),
+            StageStats(phase=Phase.PROBE, wall_seconds=3.0, cpu_seconds=2.0, bytes_read=1024 * 1024, bytes_written=0)
+        )
+    )
+
+    report = generate_report("render@example.de", "lecturer@example.de", "foo_1234", result)
+
+    assert "concat: 1.2 s, CPU 0.5 s, read 0.0 MiB, written 10.0 MiB, 2500 kbit/s" in report.get_content()
+    assert "probe: 3.0 s, CPU 2.0 s, read 1.0 MiB, written 0.0 MiB\n" in report.get_content()
+    assert "RSS" not in report.get_content()
+
 def test_generate_report_failure():
     sender = "render@example.de"
     recipient = "lecturer@example.de"
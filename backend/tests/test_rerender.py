@@ -11,6 +11,8 @@ import pytest
 from pytest_mock import MockerFixture
 import rerender # pyright: ignore[reportMissingTypeStubs]
 
+from ise_record.encoders import ENCODER_PROFILES
+from ise_record.options import PostprocessingOptions
 from ise_record.postprocess import Result, ResultReason
 
 @pytest.mark.asyncio
@@ -24,7 +26,7 @@ async def test_rerender(mocker: MockerFixture):
     await rerender.main()
 
     mock_basic_config.assert_called_once_with(level="INFO")
-    mock_postprocess.assert_called_once_with(Path("foo"))
+    mock_postprocess.assert_called_once_with(Path("foo"), options=PostprocessingOptions())
 
 @pytest.mark.asyncio
 async def test_rerender_loglevel(mocker: MockerFixture):
@@ -37,4 +39,88 @@ async def test_rerender_loglevel(mocker: MockerFixture):
     await rerender.main()
 
     mock_basic_config.assert_called_once_with(level="DEBUG")
-    mock_postprocess.assert_called_once_with(Path("foo"))
+    mock_postprocess.assert_called_once_with(Path("foo"), options=PostprocessingOptions())
+
+@pytest.mark.asyncio
+async def test_rerender_crop_detect_sampling(mocker: MockerFixture):
+    expected_result = Result(reason = ResultReason.SUCCESS, output_file = Path("foo/presentation.webm"))
+
+    mocker.patch("sys.argv", [ "./rerender.py", "--crop-detect-samples", "8", "--crop-detect-frames", "5", "foo" ])
+    mock_postprocess = mocker.patch("rerender.postprocess_recording", autospec=True, return_value=expected_result)
+    mocker.patch("logging.basicConfig")
+
+    await rerender.main()
+
+    mock_postprocess.assert_called_once_with(Path("foo"), options=PostprocessingOptions(crop_detect_samples=8, crop_detect_frames=5))
+
+@pytest.mark.asyncio
+async def test_rerender_ignore_crop_cache(mocker: MockerFixture):
+    expected_result = Result(reason = ResultReason.SUCCESS, output_file = Path("foo/presentation.webm"))
+
+    mocker.patch("sys.argv", [ "./rerender.py", "--ignore-crop-cache", "foo" ])
+    mock_postprocess = mocker.patch("rerender.postprocess_recording", autospec=True, return_value=expected_result)
+    mocker.patch("logging.basicConfig")
+
+    await rerender.main()
+
+    mock_postprocess.assert_called_once_with(Path("foo"), options=PostprocessingOptions(use_crop_cache=False))
+
+@pytest.mark.asyncio
+async def test_rerender_pipe_chunks(mocker: MockerFixture):
+    expected_result = Result(reason = ResultReason.SUCCESS, output_file = Path("foo/presentation.webm"))
+
+    mocker.patch("sys.argv", [ "./rerender.py", "--pipe-chunks", "--io-concurrency", "2", "foo" ])
+    mock_postprocess = mocker.patch("rerender.postprocess_recording", autospec=True, return_value=expected_result)
+    mocker.patch("logging.basicConfig")
+
+    await rerender.main()
+
+    mock_postprocess.assert_called_once_with(Path("foo"), options=PostprocessingOptions(pipe_chunks=True, io_concurrency=2))
+
+@pytest.mark.asyncio
+async def test_rerender_encoder_profile(mocker: MockerFixture):
+    expected_result = Result(reason = ResultReason.SUCCESS, output_file = Path("foo/presentation.mp4"))
+
+    mocker.patch("sys.argv", [ "./rerender.py", "--encoder-profile", "h264", "--encoder-threads", "4", "--no-stream-copy", "--render-segments", "8", "--checkpoint-interval", "300", "foo" ])
+    mock_postprocess = mocker.patch("rerender.postprocess_recording", autospec=True, return_value=expected_result)
+    mocker.patch("logging.basicConfig")
+
+    await rerender.main()
+
+    mock_postprocess.assert_called_once_with(Path("foo"), options=PostprocessingOptions(encoder=ENCODER_PROFILES["h264"], encoder_threads=4, stream_copy=False, render_segments=8, checkpoint_seconds=300.0))
+
+@pytest.mark.asyncio
+async def test_rerender_renditions(mocker: MockerFixture):
+    expected_result = Result(reason = ResultReason.SUCCESS, output_file = Path("foo/presentation.webm"))
+
+    mocker.patch("sys.argv", [ "./rerender.py", "--rendition", "720", "--rendition", "480", "--audio-rendition", "foo" ])
+    mock_postprocess = mocker.patch("rerender.postprocess_recording", autospec=True, return_value=expected_result)
+    mocker.patch("logging.basicConfig")
+
+    await rerender.main()
+
+    mock_postprocess.assert_called_once_with(Path("foo"), options=PostprocessingOptions(renditions=(720, 480), audio_rendition=True))
+
+@pytest.mark.asyncio
+async def test_rerender_streaming_format(mocker: MockerFixture):
+    expected_result = Result(reason = ResultReason.SUCCESS, output_file = Path("foo/presentation.webm"))
+
+    mocker.patch("sys.argv", [ "./rerender.py", "--streaming-format", "hls", "foo" ])
+    mock_postprocess = mocker.patch("rerender.postprocess_recording", autospec=True, return_value=expected_result)
+    mocker.patch("logging.basicConfig")
+
+    await rerender.main()
+
+    mock_postprocess.assert_called_once_with(Path("foo"), options=PostprocessingOptions(streaming_format="hls"))
+
+@pytest.mark.asyncio
+async def test_rerender_ignore_render_cache(mocker: MockerFixture):
+    expected_result = Result(reason = ResultReason.SUCCESS, output_file = Path("foo/presentation.webm"))
+
+    mocker.patch("sys.argv", [ "./rerender.py", "--ignore-render-cache", "foo" ])
+    mock_postprocess = mocker.patch("rerender.postprocess_recording", autospec=True, return_value=expected_result)
+    mocker.patch("logging.basicConfig")
+
+    await rerender.main()
+
+    mock_postprocess.assert_called_once_with(Path("foo"), options=PostprocessingOptions(use_render_cache=False))
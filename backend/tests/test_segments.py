@@ -0,0 +1,422 @@
+# pylint: disable=line-too-long
+# pylint: disable=missing-function-docstring
+# pylint: disable=missing-module-docstring
+# pylint: disable=too-many-locals
+
+import asyncio
+import os
+from pathlib import Path
+from subprocess import CalledProcessError
+import tempfile
+from typing import Callable
+from unittest.mock import AsyncMock
+
+import pytest
+from pytest_mock import MockerFixture
+
+from ise_record.cropdetect import Rectangle, VideoProperties
+from ise_record.encoders import ENCODER_PROFILES, video_encoder_args
+from ise_record.options import PostprocessingOptions
+from ise_record.postprocess import generate_ffmpeg_filter, postprocess_tracks, ResultReason
+from ise_record.progress import Phase, Progress
+from ise_record.segments import (
+    _segment_count, # pyright: ignore[reportPrivateUsage]
+    read_segment_manifest,
+    record_segment,
+    render_key,
+    RenderedSegment,
+    segment_starts,
+    SegmentManifest,
+    usable_segments
+)
+
+def test_segment_starts():
+    # no keyframes to snap to
+    assert segment_starts(300.0, 3, []) == [ 0.0, 100.0, 200.0 ]
+
+    # keyframes close enough to the ideal split points are used
+    assert segment_starts(300.0, 3, [ 0.0, 95.0, 170.0, 260.0 ]) == [ 0.0, 95.0, 200.0 ]
+    assert segment_starts(300.0, 3, [ 0.0, 102.0, 196.5 ]) == [ 0.0, 102.0, 196.5 ]
+
+    # segments that would collapse are dropped
+    assert segment_starts(300.0, 1, [ 0.0 ]) == [ 0.0 ]
+
+@pytest.mark.asyncio
+async def test_postprocess_tracks_segmented(mocker: MockerFixture):
+    async def mock_concat(p: Path):
+        return p / "full.webm"
+
+    stream_props = VideoProperties(width=1440, height=810, crop=Rectangle(left=0, top=0, width=1440, height=810), duration=600.0)
+    progress: list[Progress] = []
+
+    async def mock_command(command: list[str], on_output_line: Callable[[bytes], None]) -> bytes:
+        # segments were listed for the concat demuxer before muxing
+        if "concat" in command:
+            list_path = Path(command[command.index("-i") + 1])
+            assert list_path.read_text(encoding="utf-8") == "".join(f"file 'segment.{i:04d}.webm'\n" for i in range(3))
+
+        for line in [ "speed=2.0x", "progress=end" ]:
+            on_output_line(f"{line}\n".encode())
+        return b""
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        output_path = Path(tempdir) / "presentation.webm"
+
+        mock_run_command = mocker.patch("ise_record.segments.run_command", AsyncMock(side_effect=mock_command))
+        mocker.patch("ise_record.postprocess.concat_chunks", wraps=mock_concat)
+        mocker.patch("ise_record.postprocess.video_properties", AsyncMock(return_value=stream_props))
+        mocker.patch("ise_record.postprocess.cached_video_properties", return_value=None)
+        mocker.patch("ise_record.segments.keyframe_times", AsyncMock(return_value=[ 0.0, 190.0, 410.0 ]))
+        mocker.patch("pathlib.Path.unlink", autospec=True)
+        mocker.patch("pathlib.Path.is_dir", return_value=True)
+
+        result = await postprocess_tracks(
+            Path("foo/stream"), Path("foo/overlay"), [ Path("foo/audio-0") ], output_path,
+            progress=progress.append,
+            options=PostprocessingOptions(render_segments=3, encoder_threads=2)
+        )
+
+        assert result.reason == ResultReason.SUCCESS
+        assert not os.path.exists(Path(tempdir) / ".presentation.webm.segments")
+
+    commands = [ c.args[0] for c in mock_run_command.call_args_list ]
+    segment_dir = Path(tempdir) / ".presentation.webm.segments"
+    video_args = [ *video_encoder_args(ENCODER_PROFILES["vp9"], 2), "-progress", "pipe:1", "-nostats" ]
+    video_filter = generate_ffmpeg_filter(stream_props, True)
+
+    assert commands[:3] == [
+        [
+            "ffmpeg",
+            "-ss", "0.000", "-t", "190.000", "-i", "foo/stream/full.webm",
+            "-ss", "0.000", "-t", "190.000", "-i", "foo/overlay/full.webm",
+            "-filter_complex", video_filter, "-an", *video_args, "-y", str(segment_dir / "segment.0000.webm")
+        ],
+        [
+            "ffmpeg",
+            "-ss", "190.000", "-t", "220.000", "-i", "foo/stream/full.webm",
+            "-ss", "190.000", "-t", "220.000", "-i", "foo/overlay/full.webm",
+            "-filter_complex", video_filter, "-an", *video_args, "-y", str(segment_dir / "segment.0001.webm")
+        ],
+        [
+            "ffmpeg",
+            "-ss", "410.000", "-i", "foo/stream/full.webm",
+            "-ss", "410.000", "-i", "foo/overlay/full.webm",
+            "-filter_complex", video_filter, "-an", *video_args, "-y", str(segment_dir / "segment.0002.webm")
+        ]
+    ]
+
+    assert commands[3] == [
+        "ffmpeg",
+        "-f", "concat", "-safe", "0", "-i", str(segment_dir / "segments.txt"),
+        "-i", "foo/stream/full.webm",
+        "-i", "foo/audio-0/full.webm",
+        "-map", "0:v", "-map", "1:a?", "-map", "2:a",
+        "-c:v", "copy", *ENCODER_PROFILES["vp9"].audio,
+        "-progress", "pipe:1", "-nostats",
+        "-y", str(output_path)
+    ]
+
+    render_progress = [ p for p in progress if p.phase == Phase.RENDER ]
+    assert render_progress[-1].percent == 100.0
+    assert progress[-1] == Progress(phase=Phase.MUX, percent=100.0, speed=2.0, eta=0.0)
+
+@pytest.mark.asyncio
+async def test_postprocess_tracks_segmented_failure(mocker: MockerFixture):
+    async def mock_concat(p: Path):
+        return p / "full.webm"
+
+    stream_props = VideoProperties(width=1440, height=810, crop=Rectangle(left=0, top=0, width=1440, height=810), duration=600.0)
+    killed: list[str] = []
+
+    async def mock_command(command: list[str], _: Callable[[bytes], None]) -> bytes:
+        if command[-1].endswith("segment.0000.webm"):
+            raise CalledProcessError(1, command)
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            killed.append(command[-1])
+            raise
+        return b""
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        mocker.patch("ise_record.segments.run_command", AsyncMock(side_effect=mock_command))
+        mocker.patch("ise_record.postprocess.concat_chunks", wraps=mock_concat)
+        mocker.patch("ise_record.postprocess.video_properties", AsyncMock(return_value=stream_props))
+        mocker.patch("ise_record.postprocess.cached_video_properties", return_value=None)
+        mocker.patch("ise_record.segments.keyframe_times", AsyncMock(return_value=[]))
+        mocker.patch("pathlib.Path.unlink", autospec=True)
+        mocker.patch("pathlib.Path.is_dir", return_value=False)
+
+        result = await postprocess_tracks(
+            Path("foo/stream"), Path("foo/overlay"), [], Path(tempdir) / "presentation.webm",
+            options=PostprocessingOptions(render_segments=4)
+        )
+
+        assert result.reason == ResultReason.FAILURE
+        assert len(killed) == 3
+
+        # nothing was completed, so nothing can be reused
+        manifest = read_segment_manifest(Path(tempdir) / ".presentation.webm.segments")
+        assert manifest is not None
+        assert manifest.segments == []
+
+@pytest.mark.asyncio
+async def test_postprocess_tracks_segmented_renditions(mocker: MockerFixture):
+    async def mock_concat(p: Path):
+        return p / "full.webm"
+
+    stream_props = VideoProperties(width=1440, height=810, crop=Rectangle(left=0, top=0, width=1440, height=810), duration=120.0)
+    lists: dict[str, str] = {}
+
+    async def mock_command(command: list[str], *_) -> bytes:
+        for arg in command:
+            if arg.endswith(".txt"):
+                lists[Path(arg).name] = Path(arg).read_text(encoding="utf-8")
+        return b""
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        output_path = Path(tempdir) / "presentation.webm"
+
+        mock_run_command = mocker.patch("ise_record.segments.run_command", AsyncMock(side_effect=mock_command))
+        mocker.patch("ise_record.postprocess.concat_chunks", wraps=mock_concat)
+        mocker.patch("ise_record.postprocess.video_properties", AsyncMock(return_value=stream_props))
+        mocker.patch("ise_record.postprocess.cached_video_properties", return_value=None)
+        mocker.patch("ise_record.segments.keyframe_times", AsyncMock(return_value=[]))
+        mocker.patch("pathlib.Path.unlink", autospec=True)
+        mocker.patch("pathlib.Path.is_dir", new=lambda self: self != Path("foo/overlay"))
+
+        result = await postprocess_tracks(
+            Path("foo/stream"), Path("foo/overlay"), [], output_path,
+            options=PostprocessingOptions(render_segments=2, renditions=(720,), audio_rendition=True)
+        )
+
+        assert result.reason == ResultReason.SUCCESS
+
+    commands = [ c.args[0] for c in mock_run_command.call_args_list ]
+    segment_dir = Path(tempdir) / ".presentation.webm.segments"
+    video_args = video_encoder_args(ENCODER_PROFILES["vp9"], 0)
+    audio_args = ENCODER_PROFILES["vp9"].audio
+
+    # every segment is rendered in each rendition from one decode
+    assert commands[0][-(2 * len(video_args) + 15):] == [
+        "-filter_complex", generate_ffmpeg_filter(stream_props, False, [ 720 ]),
+        "-map", "[v]", "-an", *video_args, "-progress", "pipe:1", "-nostats", "-y", str(segment_dir / "segment.0000.webm"),
+        "-map", "[v720]", "-an", *video_args, "-y", str(segment_dir / "segment.0000.720p.webm")
+    ]
+
+    assert lists == {
+        "segments.txt": "file 'segment.0000.webm'\nfile 'segment.0001.webm'\n",
+        "segments.720p.txt": "file 'segment.0000.720p.webm'\nfile 'segment.0001.720p.webm'\n"
+    }
+
+    assert commands[2] == [
+        "ffmpeg",
+        "-f", "concat", "-safe", "0", "-i", str(segment_dir / "segments.txt"),
+        "-i", "foo/stream/full.webm",
+        "-f", "concat", "-safe", "0", "-i", str(segment_dir / "segments.720p.txt"),
+        "-map", "0:v", "-map", "1:a?", "-c:v", "copy", *audio_args,
+        "-progress", "pipe:1", "-nostats",
+        "-y", str(output_path),
+        "-map", "2:v", "-map", "1:a?", "-c:v", "copy", *audio_args,
+        "-y", str(Path(tempdir) / "presentation.720p.webm"),
+        "-map", "1:a?", "-vn", *audio_args,
+        "-y", str(Path(tempdir) / "presentation.audio.webm")
+    ]
+
+def test_usable_segments():
+    with tempfile.TemporaryDirectory() as tempdir:
+        segment_dir = Path(tempdir)
+
+        assert not usable_segments(segment_dir, "key")
+        assert read_segment_manifest(segment_dir) == SegmentManifest(render_key="key", segments=[])
+
+        segments = [
+            RenderedSegment(start=0.0, length=10.0, filename="segment.0000.webm"),
+            RenderedSegment(start=10.0, length=10.0, filename="segment.0001.webm"),
+            RenderedSegment(start=30.0, length=10.0, filename="segment.0002.webm")
+        ]
+
+        for segment in segments:
+            (segment_dir / segment.filename).write_bytes(b"segment")
+            record_segment(segment_dir, segment)
+
+        # recorded, but gone since
+        record_segment(segment_dir, RenderedSegment(start=40.0, length=10.0, filename="segment.0003.webm"))
+
+        (segment_dir / "segment.0009.webm").write_bytes(b"stale")
+
+        (segment_dir / "segment.0001.720p.webm").write_bytes(b"rendition")
+
+        # gaps in the timeline are fine, renditions are kept with their segment
+        assert usable_segments(segment_dir, "key") == segments
+        assert sorted(p.name for p in segment_dir.iterdir()) == [ "manifest.json", "segment.0000.webm", "segment.0001.720p.webm", "segment.0001.webm", "segment.0002.webm" ]
+
+        # segments rendered with other settings don't fit
+        assert not usable_segments(segment_dir, "other key")
+        assert sorted(p.name for p in segment_dir.iterdir()) == [ "manifest.json" ]
+
+@pytest.mark.asyncio
+async def test_postprocess_tracks_segmented_reuse(mocker: MockerFixture):
+    async def mock_concat(p: Path):
+        return p / "full.webm"
+
+    stream_props = VideoProperties(width=1440, height=810, crop=Rectangle(left=0, top=0, width=1440, height=810), duration=600.0)
+    options = PostprocessingOptions(render_segments=2)
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        output_path = Path(tempdir) / "presentation.webm"
+        segment_dir = Path(tempdir) / ".presentation.webm.segments"
+
+        # a segment left behind by an earlier render with the same settings
+        segment_dir.mkdir()
+        usable_segments(segment_dir, render_key(generate_ffmpeg_filter(stream_props, False), options))
+        (segment_dir / "segment.0000.webm").write_bytes(b"segment")
+        record_segment(segment_dir, RenderedSegment(start=0.0, length=200.0, filename="segment.0000.webm"))
+
+        mock_run_command = mocker.patch("ise_record.segments.run_command", AsyncMock(return_value=b""))
+        mocker.patch("ise_record.postprocess.concat_chunks", wraps=mock_concat)
+        mocker.patch("ise_record.postprocess.cached_video_properties", return_value=stream_props)
+        mocker.patch("ise_record.segments.keyframe_times", AsyncMock(return_value=[ 0.0, 390.0 ]))
+        mocker.patch("pathlib.Path.unlink", autospec=True)
+        mocker.patch("pathlib.Path.is_dir", return_value=False)
+
+        result = await postprocess_tracks(Path("foo/stream"), Path("foo/overlay"), [], output_path, options=options)
+
+        assert result.reason == ResultReason.SUCCESS
+        assert not segment_dir.exists()
+
+    commands = [ c.args[0] for c in mock_run_command.call_args_list ]
+
+    # only the rest of the timeline is split among the renderers
+    assert [ c[:5] for c in commands[:2] ] == [
+        [ "ffmpeg", "-ss", "200.000", "-t", "190.000" ],
+        [ "ffmpeg", "-ss", "390.000", "-i", "foo/stream/full.webm" ]
+    ]
+    assert [ c[-1] for c in commands[:2] ] == [ str(segment_dir / "segment.0001.webm"), str(segment_dir / "segment.0002.webm") ]
+    assert commands[2][:7] == [ "ffmpeg", "-f", "concat", "-safe", "0", "-i", str(segment_dir / "segments.txt") ]
+
+def test_segment_count():
+    assert _segment_count(600.0, PostprocessingOptions()) == 1
+    assert _segment_count(600.0, PostprocessingOptions(render_segments=4)) == 4
+    assert _segment_count(600.0, PostprocessingOptions(checkpoint_seconds=100.0)) == 6
+    assert _segment_count(600.0, PostprocessingOptions(render_segments=8, checkpoint_seconds=100.0)) == 8
+
+    # segments don't get shorter than 30 seconds
+    assert _segment_count(600.0, PostprocessingOptions(checkpoint_seconds=1.0)) == 20
+    assert _segment_count(45.0, PostprocessingOptions(checkpoint_seconds=10.0)) == 1
+
+async def _touch_output(command: list[str], *_) -> bytes:
+    Path(command[-1]).write_bytes(b"segment")
+    return b""
+
+def _patch_inputs(mocker: MockerFixture, stream_props: VideoProperties) -> None:
+    async def mock_concat(p: Path):
+        return p / "full.webm"
+
+    mocker.patch("ise_record.postprocess.concat_chunks", wraps=mock_concat)
+    mocker.patch("ise_record.postprocess.video_properties", AsyncMock(return_value=stream_props))
+    mocker.patch("ise_record.postprocess.cached_video_properties", return_value=None)
+    mocker.patch("ise_record.segments.keyframe_times", AsyncMock(return_value=[]))
+    mocker.patch("pathlib.Path.unlink", autospec=True)
+    mocker.patch("pathlib.Path.is_dir", return_value=False)
+
+@pytest.mark.asyncio
+async def test_postprocess_tracks_resume_from_checkpoint(mocker: MockerFixture):
+    stream_props = VideoProperties(width=1440, height=810, crop=Rectangle(left=0, top=0, width=1440, height=810), duration=300.0)
+    running: list[str] = []
+    max_running = 0
+    fail = True
+
+    async def mock_command(command: list[str], *_) -> bytes:
+        nonlocal max_running
+
+        if fail and command[-1].endswith("segment.0002.webm"):
+            raise CalledProcessError(1, command)
+
+        running.append(command[-1])
+        max_running = max(max_running, len(running))
+        await asyncio.sleep(0.01)
+        running.remove(command[-1])
+
+        return await _touch_output(command)
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        output_path = Path(tempdir) / "presentation.webm"
+        segment_dir = Path(tempdir) / ".presentation.webm.segments"
+        options = PostprocessingOptions(checkpoint_seconds=100.0)
+
+        mock_run_command = mocker.patch("ise_record.segments.run_command", AsyncMock(side_effect=mock_command))
+        _patch_inputs(mocker, stream_props)
+
+        result = await postprocess_tracks(Path("foo/stream"), Path("foo/overlay"), [], output_path, options=options)
+
+        # one renderer, the completed segments are kept
+        assert result.reason == ResultReason.FAILURE
+        assert max_running == 1
+        assert [ s.filename for s in read_segment_manifest(segment_dir).segments ] == [ "segment.0000.webm", "segment.0001.webm" ] # type: ignore
+
+        fail = False
+        mock_run_command.reset_mock()
+
+        result = await postprocess_tracks(Path("foo/stream"), Path("foo/overlay"), [], output_path, options=options)
+
+        assert result.reason == ResultReason.SUCCESS
+
+    # the second run only renders the rest
+    commands = [ c.args[0] for c in mock_run_command.call_args_list ]
+    assert len(commands) == 2
+    assert commands[0][commands[0].index("-ss") + 1] == "200.000"
+    assert commands[0][-1] == str(segment_dir / "segment.0002.webm")
+
+@pytest.mark.asyncio
+async def test_postprocess_tracks_resume_out_of_order(mocker: MockerFixture):
+    stream_props = VideoProperties(width=1440, height=810, crop=Rectangle(left=0, top=0, width=1440, height=810), duration=120.0)
+    fail = True
+    segment_list = ""
+
+    async def mock_command(command: list[str], *_) -> bytes:
+        nonlocal segment_list
+
+        if "concat" in command:
+            segment_list = Path(command[command.index("-i") + 1]).read_text(encoding="utf-8")
+        elif fail and command[-1].endswith("segment.0000.webm"):
+            # the earlier segment is interrupted after the later one finished
+            await asyncio.sleep(0.05)
+            raise CalledProcessError(1, command)
+        elif fail and command[-1].endswith("segment.0002.webm"):
+            await asyncio.sleep(10)
+
+        return await _touch_output(command)
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        output_path = Path(tempdir) / "presentation.webm"
+        segment_dir = Path(tempdir) / ".presentation.webm.segments"
+        options = PostprocessingOptions(render_segments=2, checkpoint_seconds=40.0)
+
+        mock_run_command = mocker.patch("ise_record.segments.run_command", AsyncMock(side_effect=mock_command))
+        _patch_inputs(mocker, stream_props)
+
+        result = await postprocess_tracks(Path("foo/stream"), Path("foo/overlay"), [], output_path, options=options)
+
+        # only the second of three segments was completed
+        assert result.reason == ResultReason.FAILURE
+        assert read_segment_manifest(segment_dir).segments == [ RenderedSegment(start=40.0, length=40.0, filename="segment.0001.webm") ] # type: ignore
+
+        fail = False
+        mock_run_command.reset_mock()
+
+        result = await postprocess_tracks(Path("foo/stream"), Path("foo/overlay"), [], output_path, options=options)
+
+        assert result.reason == ResultReason.SUCCESS
+
+    # the second run renders what is missing before and after it, and joins the segments in order
+    commands = [ c.args[0] for c in mock_run_command.call_args_list ]
+    assert len(commands) == 3
+    assert commands[0][commands[0].index("-ss") + 1] == "0.000"
+    assert commands[0][commands[0].index("-t") + 1] == "40.000"
+    assert commands[0][-1] == str(segment_dir / "segment.0002.webm")
+    assert commands[1][commands[1].index("-ss") + 1] == "80.000"
+    assert "-t" not in commands[1]
+    assert commands[1][-1] == str(segment_dir / "segment.0003.webm")
+
+    assert segment_list == "file 'segment.0002.webm'\nfile 'segment.0001.webm'\nfile 'segment.0003.webm'\n"
@@ -4,18 +4,26 @@
 # pylint: disable=too-many-locals
 # pylint: disable=protected-access
 # pylint: disable=no-member
+# pylint: disable=redefined-outer-name
 
+from datetime import datetime, timezone
 import os
 from pathlib import Path
 import tempfile
-from unittest.mock import ANY
+import time
+from unittest.mock import ANY, Mock, call
 
+from fastapi import BackgroundTasks
 from fastapi.testclient import TestClient
 import pytest
 from pytest_mock import MockerFixture
 
+from ise_record.encoders import EncoderProfile, ENCODER_PROFILES
+from ise_record.options import PostprocessingOptions
 from ise_record.postprocess import Result, ResultReason
-from ise_record.server import app, create_app, get_settings, _postprocessing_task, PostProcessingJob, Settings # pyright: ignore[reportPrivateUsage]
+from ise_record.jobs import JobProgress, JobQueue, JobRecord, JobState
+from ise_record.progress import Phase
+from ise_record.server import app, create_app, get_job_queue, get_settings, _postprocessing_task, PostProcessingJob, Settings, _live_render_task, _store_chunk, UploadContext # pyright: ignore[reportPrivateUsage]
 
 client = TestClient(app)
 
@@ -42,7 +50,7 @@ async def test_postprocessing_task_with_report(mocker: MockerFixture):
         settings
     )
 
-    mock_postprocess.assert_called_once_with(Path("data/foo"))
+    mock_postprocess.assert_called_once_with(Path("data/foo"), None, PostprocessingOptions())
     mock_send.assert_called_once_with(
         ANY,
         hostname="localhost",
@@ -83,7 +91,7 @@ async def test_postprocessing_task_no_lecturer(mocker: MockerFixture):
         settings
     )
 
-    mock_postprocess.assert_called_once_with(Path("data/foo"))
+    mock_postprocess.assert_called_once_with(Path("data/foo"), None, PostprocessingOptions())
     mock_send.assert_not_called()
 
 @pytest.mark.asyncio
@@ -98,12 +106,62 @@ async def test_postprocessing_task_no_smtp_config(mocker: MockerFixture):
         Settings()
     )
 
-    mock_postprocess.assert_called_once_with(Path("data/foo"))
+    mock_postprocess.assert_called_once_with(Path("data/foo"), None, PostprocessingOptions())
     mock_send.assert_not_called()
 
-def test_schedule_postprocessing(mocker: MockerFixture):
+@pytest.mark.asyncio
+async def test_postprocessing_task_merged_recipients(mocker: MockerFixture):
+    expected_result = Result(reason = ResultReason.SUCCESS, output_file=Path("foo/presentation.webm"))
+
+    mocker.patch("ise_record.server.postprocess_recording", autospec=True, return_value=expected_result)
+    mocker.patch("ise_record.server.normalize_recipient", side_effect=lambda address, _: address)
+    mock_send = mocker.patch("aiosmtplib.send", autospec=True)
+
+    await _postprocessing_task( # pyright: ignore[reportPrivateUsage]
+        PostProcessingJob(recording="foo", recipient=None),
+        Settings(smtp_server="localhost", smtp_sender="render@example.de"),
+        merged_recipients=[ "lecturer@example.de", "tutor@example.de" ]
+    )
+
+    assert [ c.args[0]["To"] for c in mock_send.call_args_list ] == [ "lecturer@example.de", "tutor@example.de" ]
+
+@pytest.fixture
+def mock_job_queue(mocker: MockerFixture):
+    queue = mocker.Mock(spec=JobQueue)
+    queue.submit.side_effect = lambda recording, recipient, priority, encoder_profile: JobRecord(
+        id="1234",
+        seq=1,
+        recording=recording,
+        recipient=recipient,
+        priority=priority,
+        encoder_profile=encoder_profile,
+        submitted=datetime.now(timezone.utc)
+    )
+
+    app.dependency_overrides[get_job_queue] = lambda: queue
+    yield queue
+    del app.dependency_overrides[get_job_queue]
+
+@pytest.mark.asyncio
+async def test_postprocessing_task_in_worker(mocker: MockerFixture):
+    expected_result = Result(reason = ResultReason.SUCCESS, output_file=Path("foo/presentation.webm"))
+
+    mock_postprocess = mocker.patch("ise_record.server.postprocess_recording", autospec=True)
+    mock_in_worker = mocker.patch("ise_record.server.postprocess_in_worker", autospec=True, return_value=expected_result)
+    executor = mocker.Mock()
+
+    await _postprocessing_task( # pyright: ignore[reportPrivateUsage]
+        PostProcessingJob(recording="foo", recipient=None),
+        Settings(),
+        None,
+        executor
+    )
+
+    mock_in_worker.assert_called_once_with(executor, Path("data/foo"), None, PostprocessingOptions())
+    mock_postprocess.assert_not_called()
+
+def test_schedule_postprocessing(mocker: MockerFixture, mock_job_queue: Mock):
     mock_isdir = mocker.patch("os.path.isdir", return_value=True)
-    mock_add_task = mocker.patch("fastapi.BackgroundTasks.add_task")
 
     response = client.post(
         "/api/jobs",
@@ -115,16 +173,14 @@ def test_schedule_postprocessing(mocker: MockerFixture):
     )
 
     assert response.status_code == 202
+    assert response.json()["id"] == "1234"
+    assert response.json()["recording"] == "foo"
+    assert response.json()["state"] == "pending"
     mock_isdir.assert_called_once_with(get_settings().destdir / "foo")
-    mock_add_task.assert_called_once_with(
-        _postprocessing_task, # pyright: ignore[reportPrivateUsage]
-        PostProcessingJob(recording="foo", recipient="foo@bar.de"),
-        get_settings()
-    )
+    mock_job_queue.submit.assert_called_once_with("foo", "foo@bar.de", 0, None)
 
-def test_schedule_postprocessing_recipient_omitted(mocker: MockerFixture):
+def test_schedule_postprocessing_recipient_omitted(mocker: MockerFixture, mock_job_queue: Mock):
     mock_isdir = mocker.patch("os.path.isdir", return_value=True)
-    mock_add_task = mocker.patch("fastapi.BackgroundTasks.add_task")
 
     response = client.post(
         "/api/jobs",
@@ -136,15 +192,56 @@ def test_schedule_postprocessing_recipient_omitted(mocker: MockerFixture):
 
     assert response.status_code == 202
     mock_isdir.assert_called_once_with(get_settings().destdir / "foo")
-    mock_add_task.assert_called_once_with(
-        _postprocessing_task, # pyright: ignore[reportPrivateUsage]
-        PostProcessingJob(recording="foo", recipient=None),
-        get_settings()
+    mock_job_queue.submit.assert_called_once_with("foo", None, 0, None)
+
+def test_schedule_postprocessing_priority(mocker: MockerFixture, mock_job_queue: Mock):
+    mocker.patch("os.path.isdir", return_value=True)
+
+    response = client.post(
+        "/api/jobs",
+        headers={ "Content-Type": "application/json" },
+        json={
+            "recording": "foo",
+            "priority": 10
+        }
+    )
+
+    assert response.status_code == 202
+    mock_job_queue.submit.assert_called_once_with("foo", None, 10, None)
+
+def test_schedule_postprocessing_encoder_profile(mocker: MockerFixture, mock_job_queue: Mock):
+    mocker.patch("os.path.isdir", return_value=True)
+
+    response = client.post(
+        "/api/jobs",
+        headers={ "Content-Type": "application/json" },
+        json={
+            "recording": "foo",
+            "encoder_profile": "h264"
+        }
     )
 
-def test_schedule_postprocessing_error(mocker: MockerFixture):
+    assert response.status_code == 202
+    assert response.json()["encoder_profile"] == "h264"
+    mock_job_queue.submit.assert_called_once_with("foo", None, 0, "h264")
+
+def test_schedule_postprocessing_unknown_encoder_profile(mocker: MockerFixture, mock_job_queue: Mock):
+    mocker.patch("os.path.isdir", return_value=True)
+
+    response = client.post(
+        "/api/jobs",
+        headers={ "Content-Type": "application/json" },
+        json={
+            "recording": "foo",
+            "encoder_profile": "foo"
+        }
+    )
+
+    assert response.status_code == 400
+    mock_job_queue.submit.assert_not_called()
+
+def test_schedule_postprocessing_error(mocker: MockerFixture, mock_job_queue: Mock):
     mock_isdir = mocker.patch("os.path.isdir", return_value=False)
-    mock_add_task = mocker.patch("fastapi.BackgroundTasks.add_task")
 
     response = client.post(
         "/api/jobs",
@@ -157,11 +254,9 @@ def test_schedule_postprocessing_error(mocker: MockerFixture):
 
     assert response.status_code == 400
     mock_isdir.assert_called_once_with(get_settings().destdir / "foo")
-    mock_add_task.assert_not_called()
-
-def test_schedule_postprocessing_input_validation(mocker: MockerFixture):
-    mock_add_task = mocker.patch("fastapi.BackgroundTasks.add_task")
+    mock_job_queue.submit.assert_not_called()
 
+def test_schedule_postprocessing_input_validation(mock_job_queue: Mock):
     response = client.post(
         "/api/jobs",
         headers={ "Content-Type": "application/json" },
@@ -172,11 +267,10 @@ def test_schedule_postprocessing_input_validation(mocker: MockerFixture):
     )
 
     assert response.status_code == 422
-    mock_add_task.assert_not_called()
+    mock_job_queue.submit.assert_not_called()
 
-def test_schedule_postprocessing_broken_recipient_still_starts_post(mocker: MockerFixture):
+def test_schedule_postprocessing_broken_recipient_still_starts_post(mocker: MockerFixture, mock_job_queue: Mock):
     mock_isdir = mocker.patch("os.path.isdir", return_value=True)
-    mock_add_task = mocker.patch("fastapi.BackgroundTasks.add_task")
 
     response = client.post(
         "/api/jobs",
@@ -189,12 +283,80 @@ def test_schedule_postprocessing_broken_recipient_still_starts_post(mocker: Mock
 
     assert response.status_code == 202
     mock_isdir.assert_called_once_with(get_settings().destdir / "foo")
-    mock_add_task.assert_called_once_with(
-        _postprocessing_task, # pyright: ignore[reportPrivateUsage]
-        PostProcessingJob(recording="foo", recipient="I made a lot of typos"),
-        get_settings()
+    mock_job_queue.submit.assert_called_once_with("foo", "I made a lot of typos", 0, None)
+
+
+def test_list_jobs(mock_job_queue: Mock):
+    mock_job_queue.jobs.return_value = [
+        JobRecord(id="1234", seq=1, recording="foo", state=JobState.DONE, submitted=datetime.now(timezone.utc)),
+        JobRecord(
+            id="5678", seq=2, recording="bar", state=JobState.RUNNING, submitted=datetime.now(timezone.utc),
+            progress=JobProgress(phase=Phase.RENDER, percent=40.0, fps=50.0, speed=1.5, eta=60.0, updated=datetime.now(timezone.utc))
+        )
+    ]
+
+    response = client.get("/api/jobs")
+
+    assert response.status_code == 200
+    assert [ j["id"] for j in response.json() ] == [ "1234", "5678" ]
+    assert response.json()[1]["progress"]["phase"] == "render"
+    assert response.json()[1]["progress"]["percent"] == 40.0
+
+def test_get_job(mock_job_queue: Mock):
+    mock_job_queue.latest_for.return_value = JobRecord(
+        id="1234", seq=1, recording="foo", state=JobState.PENDING, submitted=datetime.now(timezone.utc)
     )
 
+    response = client.get("/api/jobs/foo")
+
+    assert response.status_code == 200
+    assert response.json()["id"] == "1234"
+    assert response.json()["state"] == "pending"
+    mock_job_queue.latest_for.assert_called_once_with("foo")
+
+def test_get_job_unknown(mock_job_queue: Mock):
+    mock_job_queue.latest_for.return_value = None
+
+    response = client.get("/api/jobs/foo")
+
+    assert response.status_code == 404
+
+def test_get_job_input_validation(mock_job_queue: Mock):
+    response = client.get("/api/jobs/.hidden")
+
+    assert response.status_code == 422
+    mock_job_queue.latest_for.assert_not_called()
+
+def test_scheduled_job_runs_in_background(mocker: MockerFixture):
+    mock_task = mocker.patch("ise_record.server._postprocessing_task", autospec=True)
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        settings = Settings(destdir=Path(tempdir))
+        os.makedirs(Path(tempdir) / "foo")
+
+        application = create_app(settings)
+        application.dependency_overrides[get_settings] = lambda: settings
+
+        with TestClient(application) as tc:
+            response = tc.post(
+                "/api/jobs",
+                headers={ "Content-Type": "application/json" },
+                json={
+                    "recording": "foo",
+                    "recipient": "foo@bar.de"
+                }
+            )
+
+            assert response.status_code == 202
+
+            for _ in range(100):
+                if mock_task.called:
+                    break
+                time.sleep(0.01)
+
+        # the job is rendered with the profile that was the default when it was submitted
+        mock_task.assert_called_once_with(PostProcessingJob(recording="foo", recipient="foo@bar.de", encoder_profile="vp9"), settings, ANY, ANY, [])
+        assert os.path.isfile(Path(tempdir) / ".jobs" / f"{response.json()['id']}.json")
 
 def test_chunk_upload():
     sample_path = Path(os.path.dirname(__file__)) / "assets" / "sample.webm"
@@ -231,6 +393,108 @@ def test_chunk_upload():
             finally:
                 del app.dependency_overrides[get_settings]
 
+def test_chunk_upload_assembles_track():
+    with tempfile.TemporaryDirectory() as tempdir:
+        def mock_settings(destdir: Path = Path(tempdir)):
+            return Settings(destdir=destdir)
+        app.dependency_overrides[get_settings] = mock_settings
+
+        try:
+            for ix, data in [ (1, b"bar"), (0, b"foo"), (2, b"baz") ]:
+                response = client.post(
+                    "/api/chunks",
+                    data={
+                        "recording": "foo",
+                        "track": "stream",
+                        "index": str(ix)
+                    },
+                    files={
+                        "chunk": data
+                    }
+                )
+                assert response.status_code == 201
+
+            with open(Path(tempdir) / "foo" / "stream" / "full.webm", "rb") as full:
+                assert full.read() == b"foobarbaz"
+        finally:
+            del app.dependency_overrides[get_settings]
+
+def test_chunk_upload_triggers_crop_detection(mocker: MockerFixture):
+    mock_update = mocker.patch("ise_record.server.update_crop_cache", autospec=True)
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        def mock_settings(destdir: Path = Path(tempdir)):
+            return Settings(destdir=destdir, crop_detect_interval=2)
+        app.dependency_overrides[get_settings] = mock_settings
+
+        try:
+            for track in [ "stream", "overlay" ]:
+                for ix in range(4):
+                    response = client.post(
+                        "/api/chunks",
+                        data={
+                            "recording": "foo",
+                            "track": track,
+                            "index": str(ix)
+                        },
+                        files={
+                            "chunk": b"foo"
+                        }
+                    )
+                    assert response.status_code == 201
+        finally:
+            del app.dependency_overrides[get_settings]
+
+    # mocked update never writes a cache, so every upload from the second on is due
+    stream_path = Path(tempdir) / "foo" / "stream"
+    assert mock_update.call_args_list == [
+        call(stream_path, 2, 5.0, 10),
+        call(stream_path, 3, 5.0, 10),
+        call(stream_path, 4, 5.0, 10)
+    ]
+
+def test_chunk_upload_triggers_live_rendering(mocker: MockerFixture):
+    mock_render = mocker.patch("ise_record.server.render_live_segments", autospec=True)
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        settings = Settings(destdir=Path(tempdir), live_render_window=12)
+        app.dependency_overrides[get_settings] = lambda: settings
+
+        try:
+            for track in [ "stream", "overlay", "audio-0" ]:
+                response = client.post(
+                    "/api/chunks",
+                    data={
+                        "recording": "foo",
+                        "track": track,
+                        "index": "0"
+                    },
+                    files={
+                        "chunk": b"foo"
+                    }
+                )
+                assert response.status_code == 201
+        finally:
+            del app.dependency_overrides[get_settings]
+
+    # audio isn't part of the rendered segments
+    assert mock_render.call_args_list == [
+        call(Path(tempdir) / "foo", 5.0, 12, settings.postprocessing_options())
+    ] * 2
+
+@pytest.mark.asyncio
+async def test_live_render_task_in_worker(mocker: MockerFixture):
+    mock_render = mocker.patch("ise_record.server.render_live_segments", autospec=True)
+    mock_render_in_worker = mocker.patch("ise_record.server.render_live_in_worker", autospec=True)
+    worker_pool = Mock()
+    settings = Settings(live_render_window=12)
+
+    await _live_render_task(Path("data/foo"), settings, worker_pool)
+
+    # live renders stay off the event loop that takes the uploads
+    mock_render_in_worker.assert_called_once_with(worker_pool, Path("data/foo"), 5.0, 12, settings.postprocessing_options())
+    mock_render.assert_not_called()
+
 def test_chunk_upload_input_validation():
     sample_path = Path(os.path.dirname(__file__)) / "assets" / "sample.webm"
 
@@ -347,6 +611,135 @@ def test_chunk_upload_input_validation():
         assert response.status_code == 422
 
 
+def test_chunk_upload_batch():
+    with tempfile.TemporaryDirectory() as tempdir:
+        def mock_settings(destdir: Path = Path(tempdir)):
+            return Settings(destdir=destdir)
+        app.dependency_overrides[get_settings] = mock_settings
+
+        try:
+            response = client.post(
+                "/api/chunks/batch",
+                data={
+                    "recording": "foo",
+                    "track": [ "stream", "overlay", "stream", "overlay" ],
+                    "index": [ "1", "0", "0", "1" ]
+                },
+                files=[
+                    ("chunk", ("a", b"bar")),
+                    ("chunk", ("b", b"qux")),
+                    ("chunk", ("c", b"foo")),
+                    ("chunk", ("d", b"quux"))
+                ]
+            )
+
+            assert response.status_code == 201
+            assert response.json() == {
+                "recording": "foo",
+                "chunks": [
+                    { "track": "overlay", "index": 0, "filename": "chunk.0000" },
+                    { "track": "overlay", "index": 1, "filename": "chunk.0001" },
+                    { "track": "stream", "index": 0, "filename": "chunk.0000" },
+                    { "track": "stream", "index": 1, "filename": "chunk.0001" }
+                ]
+            }
+
+            # chunks of a batch are assembled like chunks uploaded one by one
+            assert (Path(tempdir) / "foo" / "stream" / "full.webm").read_bytes() == b"foobar"
+            assert (Path(tempdir) / "foo" / "overlay" / "full.webm").read_bytes() == b"quxquux"
+        finally:
+            del app.dependency_overrides[get_settings]
+
+def test_chunk_upload_batch_input_validation():
+    with tempfile.TemporaryDirectory() as tempdir:
+        def mock_settings(destdir: Path = Path(tempdir)):
+            return Settings(destdir=destdir)
+        app.dependency_overrides[get_settings] = mock_settings
+
+        try:
+            for tracks, indices in [
+                ([ "stream", ".." ], [ "0", "0" ]),
+                ([ "stream", "overlay" ], [ "0", "-1" ]),
+                ([ "stream", "overlay" ], [ "0", "10000" ]),
+                ([ "stream" ], [ "0", "1" ]),
+                ([ "stream", "stream" ], [ "0" ]),
+                ([ "stream", "stream" ], [ "0", "0" ])
+            ]:
+                response = client.post(
+                    "/api/chunks/batch",
+                    data={ "recording": "foo", "track": tracks, "index": indices },
+                    files=[ ("chunk", ("a", b"foo")), ("chunk", ("b", b"bar")) ]
+                )
+                assert response.status_code == 422
+
+            # nothing of a rejected batch is stored
+            assert not os.listdir(tempdir)
+        finally:
+            del app.dependency_overrides[get_settings]
+
+def test_chunk_put():
+    sample_path = Path(os.path.dirname(__file__)) / "assets" / "sample.webm"
+    sample = sample_path.read_bytes()
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        def mock_settings(destdir: Path = Path(tempdir)):
+            return Settings(destdir=destdir)
+        app.dependency_overrides[get_settings] = mock_settings
+
+        try:
+            for ix, fname in [ (0, "chunk.0000"), (1, "chunk.0001"), (9999, "chunk.9999") ]:
+                response = client.put(
+                    f"/api/recordings/foo/stream/{ix}",
+                    headers={ "Content-Type": "application/octet-stream" },
+                    content=sample
+                )
+
+                assert response.status_code == 201
+                assert response.json() == { "recording": "foo", "track": "stream", "index": ix, "filename": fname }
+                assert (Path(tempdir) / "foo" / "stream" / fname).read_bytes() == sample
+
+            # the track is assembled as with multipart uploads
+            assert (Path(tempdir) / "foo" / "stream" / "full.webm").read_bytes() == sample * 2
+            assert not list((Path(tempdir) / "foo" / "stream").glob(".*.upload"))
+        finally:
+            del app.dependency_overrides[get_settings]
+
+def test_chunk_put_input_validation():
+    with tempfile.TemporaryDirectory() as tempdir:
+        def mock_settings(destdir: Path = Path(tempdir)):
+            return Settings(destdir=destdir)
+        app.dependency_overrides[get_settings] = mock_settings
+
+        try:
+            for url in [
+                "/api/recordings/AND 0 == 0; DROP TABLE important_data; --/stream/42",
+                "/api/recordings/foo/-stream/42",
+                "/api/recordings/foo/stream/-1",
+                "/api/recordings/foo/stream/10000",
+                "/api/recordings/foo/stream/bar"
+            ]:
+                response = client.put(url, content=b"foo")
+                assert response.status_code == 422
+
+            assert not os.listdir(tempdir)
+        finally:
+            del app.dependency_overrides[get_settings]
+
+@pytest.mark.asyncio
+async def test_store_chunk_aborted():
+    async def interrupted_upload():
+        yield b"foo"
+        raise OSError("client went away")
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        context = UploadContext(BackgroundTasks(), Settings(destdir=Path(tempdir)))
+
+        with pytest.raises(OSError):
+            await _store_chunk("foo", "stream", 0, interrupted_upload(), context) # pyright: ignore[reportPrivateUsage]
+
+        # neither a chunk nor a partial upload is left behind
+        assert not os.listdir(Path(tempdir) / "foo" / "stream")
+
 def test_chunk_upload_with_more_digits():
     sample_path = Path(os.path.dirname(__file__)) / "assets" / "sample.webm"
     sample_size = os.stat(sample_path).st_size
@@ -431,3 +824,77 @@ def test_cors_preflight_jobs_forbidden():
     )
     assert response.status_code == 400
     assert "Access-Control-Allow-Origin" not in response.headers
+
+def test_postprocessing_options():
+    settings = Settings(crop_detect_samples=12, crop_detect_frames=4, pipe_chunks=True, io_concurrency=2, stream_copy=False, render_segments=8, render_checkpoint_interval=300, render_cache=False)
+
+    assert settings.postprocessing_options() == PostprocessingOptions(crop_detect_samples=12, crop_detect_frames=4, pipe_chunks=True, io_concurrency=2, stream_copy=False, render_segments=8, checkpoint_seconds=300.0, use_render_cache=False)
+
+def test_postprocessing_options_encoder_profile():
+    settings = Settings(encoder_profile="av1", encoder_threads=8)
+
+    assert settings.postprocessing_options().encoder == ENCODER_PROFILES["av1"]
+    assert settings.postprocessing_options().encoder_threads == 8
+    assert settings.postprocessing_options("h264").encoder == ENCODER_PROFILES["h264"]
+
+    with pytest.raises(ValueError):
+        settings.postprocessing_options("foo")
+
+def test_custom_encoder_profiles(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setenv("ISE_RECORD_ENCODER_PROFILES", '{ "archive": { "container": "mkv", "video": [ "-c:v", "ffv1" ], "audio": [ "-c:a", "flac" ] } }')
+    monkeypatch.setenv("ISE_RECORD_ENCODER_PROFILE", "archive")
+
+    settings = Settings()
+
+    assert settings.postprocessing_options().encoder == EncoderProfile(container="mkv", video=[ "-c:v", "ffv1" ], audio=[ "-c:a", "flac" ])
+
+def test_renditions(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setenv("ISE_RECORD_RENDITIONS", "[ 720, 480 ]")
+    monkeypatch.setenv("ISE_RECORD_AUDIO_RENDITION", "true")
+
+    options = Settings().postprocessing_options()
+
+    assert options.renditions == (720, 480)
+    assert options.audio_rendition
+
+def test_streaming_format(monkeypatch: pytest.MonkeyPatch):
+    assert Settings().postprocessing_options().streaming_format is None
+
+    monkeypatch.setenv("ISE_RECORD_STREAMING_FORMAT", "hls")
+    assert Settings().postprocessing_options().streaming_format == "hls"
+
+    monkeypatch.setenv("ISE_RECORD_STREAMING_FORMAT", "rtmp")
+    with pytest.raises(ValueError):
+        Settings()
+
+def test_unknown_default_encoder_profile():
+    with pytest.raises(ValueError):
+        Settings(encoder_profile="foo")
+
+def test_metrics():
+    with tempfile.TemporaryDirectory() as tempdir:
+        settings = Settings(destdir=Path(tempdir))
+        application = create_app(settings)
+        application.dependency_overrides[get_settings] = lambda: settings
+        tc = TestClient(application)
+
+        before = tc.get("/metrics")
+        response = tc.post(
+            "/api/chunks",
+            data={ "recording": "foo", "track": "stream", "index": "0" },
+            files={ "chunk": b"foobar" }
+        )
+        after = tc.get("/metrics")
+
+        assert response.status_code == 201
+        assert after.status_code == 200
+        assert after.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+
+        def sample(text: str, name: str) -> float:
+            line = next(l for l in text.splitlines() if l.startswith(f"{name} "))
+            return float(line.split()[1])
+
+        assert sample(after.text, "ise_record_chunk_uploads_total") == sample(before.text, "ise_record_chunk_uploads_total") + 1
+        assert sample(after.text, "ise_record_chunk_upload_bytes_total") == sample(before.text, "ise_record_chunk_upload_bytes_total") + 6
+        assert 'ise_record_postprocessing_jobs{state="pending"} 0' in after.text
+        assert "# TYPE ise_record_render_seconds histogram" in after.text
@@ -0,0 +1,139 @@
+# pylint: disable=line-too-long
+# pylint: disable=missing-function-docstring
+# pylint: disable=missing-module-docstring
+
+import os
+from pathlib import Path
+import tempfile
+from unittest.mock import AsyncMock
+
+import pytest
+from pytest_mock import MockerFixture
+
+from ise_record.cropdetect import Rectangle, VideoProperties
+from ise_record.options import PostprocessingOptions
+from ise_record.postprocess import postprocess_tracks, ResultReason
+from ise_record.progress import Phase, Progress
+from ise_record.streaming import streaming_command
+
+STREAM_PROPS = VideoProperties(width=1440, height=810, crop=Rectangle(left=0, top=0, width=1440, height=810), duration=60.0)
+
+async def _mock_concat(p: Path):
+    return p / "full.webm"
+
+async def _mock_command(command: list[str], *_) -> bytes:
+    return b"1\n" if command[0] == "ffprobe" else b""
+
+def _patch_pipeline(mocker: MockerFixture) -> AsyncMock:
+    # rendering and packaging share one mock, so that the commands come out in order
+    mock_run_command = AsyncMock(side_effect=_mock_command)
+
+    mocker.patch("ise_record.postprocess.run_command", mock_run_command)
+    mocker.patch("ise_record.streaming.run_command", mock_run_command)
+    mocker.patch("ise_record.postprocess.concat_chunks", wraps=_mock_concat)
+    mocker.patch("ise_record.postprocess.video_properties", AsyncMock(return_value=STREAM_PROPS))
+    mocker.patch("ise_record.postprocess.cached_video_properties", return_value=None)
+    mocker.patch("pathlib.Path.unlink", autospec=True)
+
+    return mock_run_command
+
+def test_streaming_command_hls():
+    manifest_path = Path("foo/streaming/master.m3u8")
+
+    assert streaming_command([ Path("foo/presentation.webm"), Path("foo/presentation.720p.webm") ], True, "hls", manifest_path) == [
+        "ffmpeg",
+        "-i", "foo/presentation.webm",
+        "-i", "foo/presentation.720p.webm",
+        "-map", "0:v:0", "-map", "1:v:0", "-map", "0:a:0",
+        "-c", "copy",
+        "-progress", "pipe:1",
+        "-nostats",
+        "-f", "hls",
+        "-hls_time", "6",
+        "-hls_playlist_type", "vod",
+        "-hls_segment_type", "fmp4",
+        "-hls_segment_filename", "foo/streaming/segment_%v_%05d.m4s",
+        "-master_pl_name", "master.m3u8",
+        "-var_stream_map", "v:0,agroup:audio v:1,agroup:audio a:0,agroup:audio",
+        "-y", "foo/streaming/playlist_%v.m3u8"
+    ]
+
+    # without audio, there is no audio group
+    command = streaming_command([ Path("foo/presentation.webm") ], False, "hls", manifest_path)
+    assert command[command.index("-var_stream_map") + 1] == "v:0"
+    assert "0:a:0" not in command
+
+def test_streaming_command_dash():
+    manifest_path = Path("foo/streaming/manifest.mpd")
+
+    assert streaming_command([ Path("foo/presentation.webm") ], True, "dash", manifest_path) == [
+        "ffmpeg",
+        "-i", "foo/presentation.webm",
+        "-map", "0:v:0", "-map", "0:a:0",
+        "-c", "copy",
+        "-progress", "pipe:1",
+        "-nostats",
+        "-f", "dash",
+        "-seg_duration", "6",
+        "-use_template", "1",
+        "-use_timeline", "1",
+        "-adaptation_sets", "id=0,streams=v id=1,streams=a",
+        "-y", "foo/streaming/manifest.mpd"
+    ]
+
+@pytest.mark.asyncio
+async def test_postprocess_tracks_streaming(mocker: MockerFixture):
+    progress: list[Progress] = []
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        output_path = Path(tempdir) / "presentation.webm"
+        stale_path = Path(tempdir) / "streaming" / "stale.m4s"
+        os.makedirs(stale_path.parent)
+        stale_path.write_bytes(b"foo")
+
+        mock_run_command = _patch_pipeline(mocker)
+
+        result = await postprocess_tracks(
+            Path("foo/stream"), Path("foo/overlay"), [], output_path, progress.append,
+            options=PostprocessingOptions(renditions=(720,), streaming_format="dash")
+        )
+
+        assert result.reason == ResultReason.SUCCESS
+
+        # output of earlier runs is replaced
+        assert not stale_path.exists()
+        assert stale_path.parent.is_dir()
+
+    commands = [ c.args[0] for c in mock_run_command.call_args_list ]
+
+    # keyframes are forced at the segment length
+    assert commands[0][commands[0].index("-g") + 1] == "180"
+
+    assert commands[1] == [ "ffprobe", "-v", "error", "-select_streams", "a", "-show_entries", "stream=index", "-of", "csv=p=0", str(output_path) ]
+    assert commands[2] == streaming_command([ output_path, Path(tempdir) / "presentation.720p.webm" ], True, "dash", Path(tempdir) / "streaming" / "manifest.mpd")
+
+    assert progress[-1].phase == Phase.PACKAGE
+
+@pytest.mark.asyncio
+async def test_postprocess_tracks_streaming_no_stream_copy(mocker: MockerFixture):
+    with tempfile.TemporaryDirectory() as tempdir:
+        output_path = Path(tempdir) / "presentation.webm"
+
+        # would be remuxed as-is without a streaming format
+        mock_run_command = _patch_pipeline(mocker)
+
+        result = await postprocess_tracks(
+            Path("foo/stream"), Path("foo/overlay"), [], output_path,
+            options=PostprocessingOptions(streaming_format="hls")
+        )
+
+        assert result.reason == ResultReason.SUCCESS
+
+    commands = [ c.args[0] for c in mock_run_command.call_args_list ]
+
+    # the main stream is re-encoded with keyframes at the segment length rather than copied
+    assert "copy" not in commands[0]
+    assert "-filter_complex" in commands[0]
+    assert commands[0][commands[0].index("-g") + 1] == "180"
+
+    assert commands[2] == streaming_command([ output_path ], True, "hls", Path(tempdir) / "streaming" / "master.m3u8")
@@ -0,0 +1,78 @@
+# pylint: disable=line-too-long
+# pylint: disable=missing-function-docstring
+# pylint: disable=missing-module-docstring
+
+import asyncio
+from concurrent.futures.process import BrokenProcessPool
+import os
+from pathlib import Path
+import signal
+import tempfile
+import time
+
+import pytest
+
+from ise_record.jobs import ProgressWriter
+from ise_record.postprocess import Result, ResultReason
+from ise_record.worker import postprocess_in_worker, render_live_in_worker, WorkerPool
+
+@pytest.mark.asyncio
+async def test_postprocess_in_worker():
+    with tempfile.TemporaryDirectory() as tempdir:
+        recording_path = Path(tempdir) / "foo"
+        os.makedirs(recording_path)
+
+        pool = WorkerPool(1)
+
+        try:
+            result = await postprocess_in_worker(
+                pool,
+                recording_path,
+                ProgressWriter(Path(tempdir) / "progress.json")
+            )
+        finally:
+            pool.shutdown()
+
+        assert result == Result(output_file=None, reason=ResultReason.MAIN_STREAM_MISSING)
+
+@pytest.mark.asyncio
+async def test_render_live_in_worker():
+    with tempfile.TemporaryDirectory() as tempdir:
+        recording_path = Path(tempdir) / "foo"
+        os.makedirs(recording_path / "stream")
+
+        pool = WorkerPool(1)
+
+        try:
+            # nothing assembled yet, so there is no crop area to render with
+            assert await render_live_in_worker(pool, recording_path, 5.0, 12) == []
+        finally:
+            pool.shutdown()
+
+@pytest.mark.asyncio
+async def test_killed_worker_is_replaced():
+    pool = WorkerPool(2)
+
+    try:
+        # idle processes are taken in turn, so the two sleeps below run in these processes
+        first_pid = await pool.run(os.getpid)
+        second_pid = await pool.run(os.getpid)
+        assert first_pid != second_pid
+
+        killed = asyncio.create_task(pool.run(time.sleep, 1.0))
+        survivor = asyncio.create_task(pool.run(time.sleep, 1.0))
+        await asyncio.sleep(0.2)
+
+        os.kill(first_pid, signal.SIGKILL)
+
+        # only the work of the killed process fails
+        with pytest.raises(BrokenProcessPool):
+            await killed
+        await survivor
+
+        # and later work runs in a fresh process
+        pids = { await pool.run(os.getpid), await pool.run(os.getpid) }
+        assert second_pid in pids
+        assert first_pid not in pids
+    finally:
+        pool.shutdown()